@@ -0,0 +1,52 @@
+"""2つのベンチマーク結果(JSON)を比較
+
+使い方:
+    python -m benchmarks.compare baseline.json results.json
+"""
+import argparse
+import json
+from typing import Dict
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    """シナリオ結果の数値をドット区切りのキーに展開（リストは strategy/options で識別）"""
+    
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            label = child.get("strategy") or json.dumps(child.get("options"), sort_keys=True) if isinstance(child, dict) else None
+            items.update(flatten(child, f"{prefix}[{label or i}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        items[prefix] = value
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=5.0, help="表示する変化率(%%)の下限")
+    args = parser.parse_args()
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    
+    print(f"baseline: {baseline['meta'].get('commit')}  current: {current['meta'].get('commit')}")
+    before = flatten(baseline["scenarios"])
+    after = flatten(current["scenarios"])
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        if old == 0:
+            continue
+        change = (new - old) / abs(old) * 100
+        if abs(change) >= args.threshold:
+            print(f"{key:<60} {old:>12} -> {new:<12} ({change:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""次元削減・量子化による recall とインデックスサイズのレポート
+
+元の次元のfloatベクトルでの検索結果を正解として、次元数（APIの dimensions 指定）と
+ローカルインデックスの量子化（int8 / binary、floatでの再スコアあり/なし）の
+組み合わせごとに recall@k・1ベクトルあたりのバイト数・検索時間を出力する。
+
+使い方:
+    python -m benchmarks.embedding_report --embeddings corpus.npy --dimensions 1536,1024,512,256
+    python -m benchmarks.embedding_report --from-chunks 5000 --output report.json
+    python -m benchmarks.embedding_report --synthetic 100000
+"""
+import argparse
+import json
+from typing import Tuple
+
+import numpy as np
+
+from services.chunk_evaluation import embedding_profile_report
+from services.embeddings import DEFAULT_RESCORE_FACTOR
+
+
+def synthetic_embeddings(count: int, dimensions: int, seed: int) -> np.ndarray:
+    """クラスタ構造を持つランダムなベクトル（APIなしで試す用。recallの値は実データとは異なる）"""
+    
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(count // 200, 1), dimensions)).astype(np.float32)
+    # 実際の埋め込みと同様に先頭の次元ほど分散が大きいようにする
+    scale = np.linspace(2.0, 0.5, dimensions, dtype=np.float32)
+    labels = rng.integers(0, len(centers), count)
+    return (centers[labels] + rng.normal(scale=0.6, size=(count, dimensions)).astype(np.float32)) * scale
+
+
+def chunk_embeddings(count: int, seed: int) -> np.ndarray:
+    """チャンクストアの本文をサンプリングして元の次元でベクトル化"""
+    
+    from sqlalchemy import select, func
+    from database import SessionLocal
+    from models import Chunk
+    from services.clients import get_openai_client
+    from services.embeddings import get_embedding_profile
+    
+    with SessionLocal() as db:
+        db.execute(select(func.setseed(seed / 2 ** 31)))
+        texts = list(db.execute(select(Chunk.text).order_by(func.random()).limit(count)).scalars())
+    if not texts:
+        raise SystemExit("No chunks in the chunk store")
+    
+    # 次元を削減していない埋め込みを正解にするため dimensions は指定しない
+    embeddings = []
+    for start in range(0, len(texts), 100):
+        response = get_openai_client().embeddings.create(
+            model=get_embedding_profile()["model"],
+            input=texts[start:start + 100]
+        )
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def split_queries(embeddings: np.ndarray, queries: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """一部のベクトルをクエリとしてコーパスから除く（自分自身がヒットしないように）"""
+    
+    order = np.random.default_rng(seed).permutation(len(embeddings))
+    queries = min(queries, len(embeddings) // 2)
+    return embeddings[order[queries:]], embeddings[order[:queries]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs index size for reduced-dimension / quantized embeddings")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--embeddings", help="埋め込みの .npy ファイル（件数 × 次元）")
+    source.add_argument("--from-chunks", type=int, help="チャンクストアから指定件数をサンプリングしてベクトル化")
+    source.add_argument("--synthetic", type=int, default=20000, help="合成データの件数")
+    parser.add_argument("--synthetic-dimensions", type=int, default=1536)
+    parser.add_argument("--dimensions", default="1536,1024,512,256", help="カンマ区切りの次元数")
+    parser.add_argument("--quantizations", default="none,int8,binary")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=DEFAULT_RESCORE_FACTOR)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+    
+    if args.embeddings:
+        embeddings = np.load(args.embeddings).astype(np.float32)
+    elif args.from_chunks:
+        embeddings = chunk_embeddings(args.from_chunks, args.seed)
+    else:
+        embeddings = synthetic_embeddings(args.synthetic, args.synthetic_dimensions, args.seed)
+    
+    docs, queries = split_queries(embeddings, args.queries, args.seed)
+    dimensions = [d for d in (int(x) for x in args.dimensions.split(",")) if d <= embeddings.shape[1]]
+    report = embedding_profile_report(
+        docs, queries,
+        dimensions=dimensions,
+        quantizations=tuple(args.quantizations.split(",")),
+        top_k=args.top_k,
+        rescore_factor=args.rescore_factor
+    )
+    
+    print(f"{len(docs)} vectors, {len(queries)} queries, recall@{args.top_k} against full-dimension float search")
+    print(f"{'dims':>6} {'quant':>7} {'rescore':>7} {'recall':>7} {'bytes/vec':>10} {'index MB':>9} {'x smaller':>9} {'ms/query':>9}")
+    for row in report:
+        print(
+            f"{row['dimensions']:>6} {row['quantization']:>7} {row['rescore_factor']:>7} {row['recall_at_k']:>7.3f} "
+            f"{row['bytes_per_vector']:>10.1f} {row['index_mb']:>9.2f} {row['compression']:>9.1f} {row['query_ms']:>9.3f}"
+        )
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(docs), "queries": len(queries), "top_k": args.top_k, "results": report}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
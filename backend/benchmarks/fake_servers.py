@@ -0,0 +1,489 @@
+"""ベンチマーク用のローカルなOpenAI/Pinecone/Notion互換サーバー
+
+実際のAPIキーなしで services/* を動かすためのスタブ。レイテンシとエラーを
+サービスごとに注入でき、乱数シードを固定すれば同じ条件を再現できる。
+
+使い方（APIを手動で動かす場合）:
+    python -m benchmarks.fake_servers --port 9100 --latency-ms 30 --error-rate 0.01
+    
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+    PINECONE_INDEX_HOST=http://127.0.0.1:9100
+    NOTION_BASE_URL=http://127.0.0.1:9100
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIMENSION = 1536
+WORD_PATTERN = re.compile(r"\w+")
+
+
+@dataclass
+class FaultConfig:
+    """1サービス分のレイテンシ/エラー注入設定"""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    # エラー時に返す Retry-After（秒、Noneなら付けない）
+    retry_after: Optional[float] = None
+    # 一部のリクエストだけ遅くする（テールレイテンシの再現）
+    slow_rate: float = 0.0
+    slow_ms: float = 0.0
+
+
+@dataclass
+class FakeServerConfig:
+    openai: FaultConfig = field(default_factory=FaultConfig)
+    pinecone: FaultConfig = field(default_factory=FaultConfig)
+    notion: FaultConfig = field(default_factory=FaultConfig)
+    seed: int = 42
+    # Notionの1ページあたりのブロック数
+    notion_blocks: int = 120
+    # 生成する回答の長さ（単語数）
+    answer_words: int = 120
+    # ストリーミング時のトークン間の間隔
+    token_delay_ms: float = 0.0
+    
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> np.ndarray:
+    """単語のハッシュから決定的なベクトルを作成（同じ単語を含むテキストほど類似する）"""
+    
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dimension] += 1.0 if (value >> 63) else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class _VectorStore:
+    """Pinecone互換のインメモリベクトルストア（名前空間ごと）"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.namespaces: Dict[str, Dict[str, Tuple[np.ndarray, Dict]]] = {}
+    
+    def upsert(self, namespace: str, vectors: List[Dict]) -> int:
+        with self.lock:
+            store = self.namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                store[vector["id"]] = (np.asarray(vector["values"], dtype=np.float32), vector.get("metadata") or {})
+        return len(vectors)
+    
+    def delete(self, namespace: str, ids: Optional[List[str]], metadata_filter: Optional[Dict], delete_all: bool) -> None:
+        with self.lock:
+            store = self.namespaces.setdefault(namespace, {})
+            if delete_all:
+                store.clear()
+            for vector_id in ids or []:
+                store.pop(vector_id, None)
+            if metadata_filter:
+                for vector_id in [k for k, (_, meta) in store.items() if _matches(meta, metadata_filter)]:
+                    del store[vector_id]
+    
+    def query(self, namespace: str, vector: List[float], top_k: int, metadata_filter: Optional[Dict]) -> List[Dict]:
+        with self.lock:
+            items = [
+                (vector_id, values, meta)
+                for vector_id, (values, meta) in self.namespaces.get(namespace, {}).items()
+                if not metadata_filter or _matches(meta, metadata_filter)
+            ]
+        if not items:
+            return []
+        
+        matrix = np.stack([values for _, values, _ in items])
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1) * np.linalg.norm(query), 1e-12)
+        order = np.argsort(-scores)[:top_k]
+        return [
+            {"id": items[i][0], "score": float(scores[i]), "values": [float(v) for v in items[i][1]], "metadata": items[i][2]}
+            for i in order
+        ]
+    
+    def update(self, namespace: str, vector_id: str, set_metadata: Optional[Dict]) -> None:
+        with self.lock:
+            store = self.namespaces.setdefault(namespace, {})
+            if vector_id in store:
+                values, metadata = store[vector_id]
+                store[vector_id] = (values, {**metadata, **(set_metadata or {})})
+    
+    def fetch(self, namespace: str, ids: List[str]) -> Dict[str, Dict]:
+        with self.lock:
+            store = self.namespaces.get(namespace, {})
+            return {
+                vector_id: {"id": vector_id, "values": [float(v) for v in store[vector_id][0]], "metadata": store[vector_id][1]}
+                for vector_id in ids if vector_id in store
+            }
+    
+    def count(self) -> int:
+        with self.lock:
+            return sum(len(store) for store in self.namespaces.values())
+
+
+def _matches(metadata: Dict, metadata_filter: Dict) -> bool:
+    """Pineconeのメタデータフィルタ（$eq/$in/$gte など主要な演算子のみ）を評価"""
+    
+    for key, condition in metadata_filter.items():
+        if key == "$and":
+            if not all(_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(metadata, sub) for sub in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        if isinstance(value, list):
+            # 文字列のリストは、いずれかの要素が条件を満たせば一致
+            if not any(_matches({key: item}, {key: condition}) for item in value):
+                return False
+            continue
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if op == "$gt" and not value > expected:
+                    return False
+                if op == "$gte" and not value >= expected:
+                    return False
+                if op == "$lt" and not value < expected:
+                    return False
+                if op == "$lte" and not value <= expected:
+                    return False
+    return True
+
+
+def _service_for(path: str) -> Optional[str]:
+    if path.startswith("/v1/embeddings") or path.startswith("/v1/chat"):
+        return "openai"
+    if path.startswith("/vectors") or path.startswith("/query") or path.startswith("/describe_index_stats"):
+        return "pinecone"
+    if path.startswith("/v1/pages") or path.startswith("/v1/blocks") or path.startswith("/v1/search"):
+        return "notion"
+    return None
+
+
+def _error_body(service: str, status: int) -> Dict:
+    message = f"Injected {service} error ({status})"
+    if service == "openai":
+        return {"error": {"message": message, "type": "server_error", "code": None}}
+    if service == "notion":
+        return {"object": "error", "status": status, "code": "service_unavailable", "message": message}
+    return {"code": 14, "message": message}
+
+
+def _rich_text(text: str) -> List[Dict]:
+    return [{"type": "text", "plain_text": text, "annotations": {}, "href": None}]
+
+
+def create_app(config: Optional[FakeServerConfig] = None) -> FastAPI:
+    """フェイクサーバーのFastAPIアプリを作成"""
+    
+    config = config or FakeServerConfig()
+    rng = random.Random(config.seed)
+    store = _VectorStore()
+    stats = {"requests": {}, "injected_errors": {}}
+    app = FastAPI(title="Fake upstream APIs")
+    app.state.config = config
+    app.state.store = store
+    app.state.stats = stats
+    
+    @app.middleware("http")
+    async def inject_faults(request: Request, call_next):
+        service = _service_for(request.url.path)
+        if service is None:
+            return await call_next(request)
+        fault: FaultConfig = getattr(config, service)
+        stats["requests"][service] = stats["requests"].get(service, 0) + 1
+        
+        delay = fault.latency_ms + (rng.uniform(-fault.jitter_ms, fault.jitter_ms) if fault.jitter_ms else 0.0)
+        if fault.slow_rate and rng.random() < fault.slow_rate:
+            delay += fault.slow_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if fault.error_rate and rng.random() < fault.error_rate:
+            stats["injected_errors"][service] = stats["injected_errors"].get(service, 0) + 1
+            headers = {"Retry-After": f"{fault.retry_after:g}"} if fault.retry_after is not None else None
+            return JSONResponse(_error_body(service, fault.error_status), status_code=fault.error_status, headers=headers)
+        return await call_next(request)
+    
+    # === OpenAI ===
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimension = body.get("dimensions") or EMBEDDING_DIMENSION
+        data = []
+        tokens = 0
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, dimension)
+            tokens += max(len(text) // 4, 1)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+        answer = " ".join(f"word{i}" for i in range(config.answer_words))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": config.answer_words,
+            "total_tokens": prompt_tokens + config.answer_words
+        }
+        if body.get("stream"):
+            return StreamingResponse(
+                _chat_stream(body.get("model", "gpt-4"), answer, usage, body.get("stream_options") or {}),
+                media_type="text/event-stream"
+            )
+        return {
+            "id": f"chatcmpl-fake-{rng.randrange(1 << 30)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+    
+    async def _chat_stream(model: str, answer: str, usage: Dict, options: Dict):
+        """SSEで1単語ずつ返す（stream_options.include_usage があれば最後に使用量を返す）"""
+        
+        completion_id = f"chatcmpl-fake-{rng.randrange(1 << 30)}"
+        
+        def event(choices: List[Dict], usage_body: Optional[Dict] = None) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                "usage": usage_body
+            }
+            return f"data: {json.dumps(chunk)}\n\n"
+        
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            content = word if i == 0 else " " + word
+            yield event([{"index": 0, "delta": {"content": content}, "finish_reason": None}])
+            if config.token_delay_ms:
+                await asyncio.sleep(config.token_delay_ms / 1000)
+        yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if options.get("include_usage"):
+            yield event([], usage)
+        yield "data: [DONE]\n\n"
+    
+    # === Pinecone（データプレーン） ===
+    @app.post("/vectors/upsert")
+    async def upsert(request: Request):
+        body = await request.json()
+        return {"upsertedCount": store.upsert(body.get("namespace", ""), body.get("vectors", []))}
+    
+    @app.post("/query")
+    async def query(request: Request):
+        body = await request.json()
+        matches = store.query(body.get("namespace", ""), body["vector"], body.get("topK", 10), body.get("filter"))
+        for match in matches:
+            if not body.get("includeMetadata"):
+                del match["metadata"]
+            if not body.get("includeValues"):
+                del match["values"]
+        return {"matches": matches, "namespace": body.get("namespace", "")}
+    
+    @app.get("/vectors/fetch")
+    async def fetch(request: Request):
+        namespace = request.query_params.get("namespace", "")
+        return {"vectors": store.fetch(namespace, request.query_params.getlist("ids")), "namespace": namespace}
+    
+    @app.post("/vectors/update")
+    async def update(request: Request):
+        body = await request.json()
+        store.update(body.get("namespace", ""), body["id"], body.get("setMetadata"))
+        return {}
+    
+    @app.post("/vectors/delete")
+    async def delete(request: Request):
+        body = await request.json()
+        store.delete(body.get("namespace", ""), body.get("ids"), body.get("filter"), body.get("deleteAll", False))
+        return {}
+    
+    @app.api_route("/describe_index_stats", methods=["GET", "POST"])
+    async def describe_index_stats():
+        return {"dimension": EMBEDDING_DIMENSION, "totalVectorCount": store.count(), "namespaces": {}}
+    
+    # === Notion ===
+    @app.get("/v1/pages/{page_id}")
+    async def retrieve_page(page_id: str):
+        return {
+            "object": "page",
+            "id": page_id,
+            "url": f"https://www.notion.so/{page_id}",
+            "created_time": "2025-01-01T00:00:00.000Z",
+            "last_edited_time": "2025-01-02T00:00:00.000Z",
+            "properties": {"title": {"type": "title", "title": _rich_text(f"Benchmark page {page_id}")}}
+        }
+    
+    @app.get("/v1/blocks/{block_id}/children")
+    async def block_children(block_id: str, start_cursor: Optional[str] = None, page_size: int = 100):
+        start = int(start_cursor or 0)
+        end = min(start + page_size, config.notion_blocks)
+        results = []
+        for i in range(start, end):
+            if i % 10 == 0:
+                results.append({"type": "heading_2", "heading_2": {"rich_text": _rich_text(f"Section {i // 10}")}})
+            else:
+                text = f"Paragraph {i} of {block_id} describes deployment step {i} and its configuration."
+                results.append({"type": "paragraph", "paragraph": {"rich_text": _rich_text(text)}})
+        has_more = end < config.notion_blocks
+        return {"object": "list", "results": results, "has_more": has_more, "next_cursor": str(end) if has_more else None}
+    
+    @app.post("/v1/search")
+    async def search(request: Request):
+        return {
+            "object": "list",
+            "results": [await retrieve_page(f"page-{i}") for i in range(20)],
+            "has_more": False,
+            "next_cursor": None
+        }
+    
+    @app.get("/_stats")
+    async def server_stats():
+        return {**stats, "vectors": store.count()}
+    
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeServers:
+    """フェイクサーバーを別スレッドで起動・停止する"""
+    
+    def __init__(self, config: Optional[FakeServerConfig] = None, port: Optional[int] = None):
+        self.config = config or FakeServerConfig()
+        self.port = port or _free_port()
+        self.app = create_app(self.config)
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+    
+    def environment(self) -> Dict[str, str]:
+        """services/* をフェイクサーバーに向けるための環境変数"""
+        return {
+            "OPENAI_API_KEY": "sk-fake",
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "PINECONE_API_KEY": "pc-fake",
+            "PINECONE_INDEX_NAME": "benchmark",
+            "PINECONE_INDEX_HOST": self.base_url,
+            "NOTION_TOKEN": "secret_fake",
+            "NOTION_BASE_URL": self.base_url,
+        }
+    
+    def __enter__(self) -> "FakeServers":
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake servers did not start")
+            time.sleep(0.01)
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        if self._thread:
+            self._thread.join(timeout=10)
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    """レイテンシ/エラー注入のコマンドライン引数を追加"""
+    
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="全サービス共通のレイテンシ")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, help="エラー時に返す Retry-After（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="slow-ms だけ遅くするリクエストの割合")
+    parser.add_argument("--slow-ms", type=float, default=0.0)
+    for service in ("openai", "pinecone", "notion"):
+        parser.add_argument(f"--{service}-latency-ms", type=float)
+        parser.add_argument(f"--{service}-error-rate", type=float)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeServerConfig:
+    def fault(service: str) -> FaultConfig:
+        latency = getattr(args, f"{service}_latency_ms")
+        error_rate = getattr(args, f"{service}_error_rate")
+        return FaultConfig(
+            latency_ms=args.latency_ms if latency is None else latency,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate if error_rate is None else error_rate,
+            retry_after=args.retry_after,
+            slow_rate=args.slow_rate,
+            slow_ms=args.slow_ms
+        )
+    
+    return FakeServerConfig(openai=fault("openai"), pinecone=fault("pinecone"), notion=fault("notion"), seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI/Pinecone/Notion servers")
+    parser.add_argument("--port", type=int, default=9100)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    
+    uvicorn.run(create_app(config_from_args(args)), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
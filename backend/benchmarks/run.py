@@ -0,0 +1,275 @@
+"""オフラインのエンドツーエンドベンチマーク
+
+ローカルのフェイクサーバー（benchmarks.fake_servers）に services/* を向けて、
+APIキーなしで再現可能なシナリオを実行し、結果をJSONに書き出す。
+
+使い方:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --scenarios search,qa --latency-ms 40 --jitter-ms 10 --concurrency 16
+    python -m benchmarks.compare baseline.json results.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.fake_servers import FakeServers, add_fault_arguments, config_from_args
+from benchmarks.bench_chunking import build_document, bench_strategy, STRATEGIES
+
+SCENARIOS = ["chunking", "ingestion", "search", "qa", "notion", "data_analysis"]
+
+QUERY_TEMPLATES = [
+    "how to configure step {i}",
+    "環境変数 設定手順{i}",
+    "verify the result of step {i} with the health check",
+    "restart the service after step {i}",
+]
+
+
+def summarize_latencies(latencies: List[float], elapsed: float, errors: int) -> Dict:
+    """レイテンシ(秒)の分布をミリ秒単位の要約にする"""
+    
+    values = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "elapsed_seconds": round(elapsed, 3),
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+def run_concurrent(call: Callable[[int], None], requests: int, concurrency: int) -> Dict:
+    """call(i) を指定の同時実行数で requests 回実行してレイテンシを集計"""
+    
+    latencies: List[float] = []
+    errors = 0
+    
+    def timed(i: int):
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency in executor.map(timed, range(requests)):
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+    return {"concurrency": concurrency, **summarize_latencies(latencies, time.perf_counter() - start, errors)}
+
+
+# === シナリオ ===
+
+def scenario_chunking(args) -> Dict:
+    document = build_document(args.chunk_size_mb)
+    return {
+        "size_mb": args.chunk_size_mb,
+        "results": [bench_strategy(strategy, document, args.repeat) for strategy in STRATEGIES]
+    }
+
+
+def scenario_ingestion(args) -> Dict:
+    from services.chunking import chunk_and_embed
+    
+    size_mb = args.document_kb / 1024
+    documents = [build_document(size_mb) for _ in range(args.documents)]
+    chunks = []
+    
+    def ingest(i: int) -> None:
+        stats = asyncio.run(chunk_and_embed(f"bench-{i}", f"Benchmark document {i}", documents[i]))
+        chunks.append(stats["chunks_created"])
+    
+    result = run_concurrent(ingest, args.documents, args.ingest_concurrency)
+    elapsed = result["elapsed_seconds"]
+    return {
+        **result,
+        "documents": args.documents,
+        "document_kb": args.document_kb,
+        "chunks": sum(chunks),
+        "chunks_per_second": round(sum(chunks) / elapsed, 2) if elapsed else None,
+        "mb_per_second": round(len(chunks) * size_mb / elapsed, 3) if elapsed else None,
+    }
+
+
+def _ensure_corpus(args) -> None:
+    """検索系シナリオ用にインデックスが空ならドキュメントを登録"""
+    
+    from services.chunking import chunk_and_embed
+    from services.clients import get_index
+    
+    if get_index().describe_index_stats().total_vector_count:
+        return
+    document = build_document(args.document_kb / 1024)
+    for i in range(min(args.documents, 10)):
+        asyncio.run(chunk_and_embed(f"bench-{i}", f"Benchmark document {i}", document))
+
+
+def scenario_search(args) -> Dict:
+    from services.search import search_similar_chunks
+    
+    _ensure_corpus(args)
+    
+    def search(i: int) -> None:
+        query = QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)].format(i=i % 50)
+        asyncio.run(search_similar_chunks(query, top_k=5))
+    
+    return run_concurrent(search, args.requests, args.concurrency)
+
+
+def scenario_qa(args) -> Dict:
+    from services.qa import answer_question
+    
+    _ensure_corpus(args)
+    
+    def ask(i: int) -> None:
+        question = QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)].format(i=i % 50)
+        asyncio.run(answer_question(question))
+    
+    return run_concurrent(ask, max(args.requests // 4, 1), args.concurrency)
+
+
+def scenario_notion(args) -> Dict:
+    from services.notion_service import get_notion_page_as_markdown
+    
+    def fetch(i: int) -> None:
+        asyncio.run(get_notion_page_as_markdown(f"page-{i}"))
+    
+    return run_concurrent(fetch, max(args.requests // 4, 1), args.concurrency)
+
+
+def scenario_data_analysis(args) -> Dict:
+    from services.data_analysis import DataAnalyzer
+    
+    rng = np.random.default_rng(args.seed)
+    rows = args.rows
+    frame = {
+        "id": np.arange(rows),
+        "amount": rng.normal(1000, 250, rows).round(2),
+        "quantity": rng.integers(1, 50, rows),
+        "category": rng.choice(["alpha", "beta", "gamma", "delta"], rows),
+        "region": rng.choice(["east", "west", "north", "south"], rows),
+    }
+    import pandas as pd
+    buffer = io.BytesIO()
+    pd.DataFrame(frame).to_csv(buffer, index=False)
+    content = buffer.getvalue()
+    
+    results = []
+    for options in ({}, {"use_arrow": True, "optimize_dtypes": True}):
+        start = time.perf_counter()
+        analyzer = DataAnalyzer(content, "csv", **options)
+        load_seconds = time.perf_counter() - start
+        analyzer.run_full_analysis()
+        total_seconds = time.perf_counter() - start
+        results.append({
+            "options": options,
+            "rows": rows,
+            "csv_mb": round(len(content) / (1024 * 1024), 2),
+            "load_seconds": round(load_seconds, 4),
+            "total_seconds": round(total_seconds, 4),
+            "rows_per_second": round(rows / total_seconds, 1)
+        })
+    return {"results": results}
+
+
+SCENARIO_FUNCTIONS = {
+    "chunking": scenario_chunking,
+    "ingestion": scenario_ingestion,
+    "search": scenario_search,
+    "qa": scenario_qa,
+    "notion": scenario_notion,
+    "data_analysis": scenario_data_analysis,
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def run(args) -> Dict:
+    scenarios = SCENARIOS if args.scenarios == "all" else args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIO_FUNCTIONS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    
+    config = config_from_args(args)
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "fake_servers": config.to_dict(),
+            "args": vars(args),
+        },
+        "scenarios": {}
+    }
+    
+    with FakeServers(config) as servers:
+        # クライアント作成前にフェイクサーバーへ向ける
+        os.environ.update(servers.environment())
+        from services.clients import reset_clients
+        reset_clients()
+        
+        for name in scenarios:
+            print(f"Running {name}...", flush=True)
+            start = time.perf_counter()
+            results["scenarios"][name] = SCENARIO_FUNCTIONS[name](args)
+            results["scenarios"][name]["scenario_seconds"] = round(time.perf_counter() - start, 3)
+            print(json.dumps(results["scenarios"][name], ensure_ascii=False), flush=True)
+        
+        results["meta"]["upstream_requests"] = dict(servers.app.state.stats["requests"])
+        results["meta"]["injected_errors"] = dict(servers.app.state.stats["injected_errors"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("--scenarios", default="all", help=f"カンマ区切り: {','.join(SCENARIOS)}")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--requests", type=int, default=200, help="検索リクエスト数（QA/Notionはその1/4）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--document-kb", type=float, default=64)
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--chunk-size-mb", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=200_000)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,5 +1,7 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -13,11 +15,80 @@ SQLALCHEMY_DATABASE_URL = os.getenv(
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+
+def async_database_url(url: str) -> URL:
+    """同期用のURLを非同期エンジン用（asyncpgドライバ）のURLに変換
+    
+    postgres:// や postgresql+psycopg2:// などドライバ指定によらず asyncpg にし、
+    asyncpg が受け付けない libpq の sslmode は同じ意味の ssl に置き換える。
+    """
+    
+    async_url = make_url(url).set(drivername="postgresql+asyncpg")
+    sslmode = async_url.query.get("sslmode")
+    if sslmode is not None:
+        async_url = async_url.difference_update_query(["sslmode"])
+        # asyncpg の ssl は libpq の sslmode と同じ値（disable, require, verify-full など）を受け付ける
+        if "ssl" not in async_url.query:
+            async_url = async_url.update_query_dict({"ssl": sslmode})
+    return async_url
+
+
+# 非同期エンジン用URL（asyncpgドライバ）
+ASYNC_DATABASE_URL = async_database_url(SQLALCHEMY_DATABASE_URL)
+
+# コネクションプール設定（環境変数で調整可能）
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+
 # エンジン作成
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **POOL_SETTINGS)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_SETTINGS)
 
 # セッションファクトリ作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 # Baseクラス（モデルの基底クラス）
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+# プールの待ち状態を計測するためのカウンタ
+_pool_counters = {}
+
+
+def _track_pool(target: Engine, name: str) -> None:
+    """チェックアウト回数と、プール上限に達した状態でのチェックアウト回数を記録"""
+    counters = _pool_counters.setdefault(name, {"checkouts": 0, "saturated_checkouts": 0})
+
+    @event.listens_for(target, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+        pool = target.pool
+        if pool.checkedout() >= pool.size() + POOL_SETTINGS["max_overflow"]:
+            counters["saturated_checkouts"] += 1
+
+
+_track_pool(engine, "sync")
+_track_pool(async_engine.sync_engine, "async")
+
+
+def pool_stats() -> dict:
+    """各エンジンのコネクションプールの使用状況を取得"""
+    stats = {}
+    for name, target in (("sync", engine), ("async", async_engine.sync_engine)):
+        pool = target.pool
+        capacity = pool.size() + POOL_SETTINGS["max_overflow"]
+        stats[name] = {
+            "pool_size": pool.size(),
+            "max_overflow": POOL_SETTINGS["max_overflow"],
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "utilization": pool.checkedout() / capacity if capacity else 0.0,
+            **_pool_counters.get(name, {}),
+        }
+    return stats
\ No newline at end of file
@@ -0,0 +1,42 @@
+import hashlib
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+
+def _version(created_at: Optional[datetime], updated_at: Optional[datetime]) -> int:
+    """更新日時（未更新なら作成日時）をマイクロ秒単位の整数にする"""
+    timestamp = updated_at or created_at
+    return int(timestamp.timestamp() * 1_000_000) if timestamp else 0
+
+
+def document_etag(document_id: int, created_at: Optional[datetime], updated_at: Optional[datetime]) -> str:
+    """ドキュメント単体の強いETag（本文を読まずに id と更新日時から作成）"""
+    return f'"{document_id}-{_version(created_at, updated_at)}"'
+
+
+def list_etag(rows: Iterable[Tuple[int, Optional[datetime], Optional[datetime]]], variant: str) -> str:
+    """一覧ページのETag（クエリ条件と、各行の id・更新日時から作成）"""
+    digest = hashlib.sha1(variant.encode("utf-8"))
+    for document_id, created_at, updated_at in rows:
+        digest.update(f"|{document_id}-{_version(created_at, updated_at)}".encode("ascii"))
+    return f'"{digest.hexdigest()}"'
+
+
+def _parse(header: str) -> list:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def if_none_match(header: Optional[str], etag: str) -> bool:
+    """If-None-Match が現在のETagに一致するか（弱い比較）"""
+    if not header:
+        return False
+    tags = _parse(header)
+    return "*" in tags or etag in [tag.removeprefix("W/") for tag in tags]
+
+
+def if_match(header: Optional[str], etag: str) -> bool:
+    """If-Match が現在のETagに一致するか（強い比較、ヘッダーなしは常に一致）"""
+    if header is None:
+        return True
+    tags = _parse(header)
+    return "*" in tags or etag in tags
\ No newline at end of file
@@ -1,20 +1,30 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Request
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, model_validator
+from typing import Annotated, List, Literal, Optional, Dict, Union, get_args
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, func, tuple_, select
 from datetime import datetime
 import os
 import io
+import math
+import json
+import time
+import asyncio
+import tempfile
 import requests
 from dotenv import load_dotenv
 
-from database import SessionLocal, engine
+from database import SessionLocal, AsyncSessionLocal, engine, pool_stats
 from models import Base, Document
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from pagination import encode_cursor, decode_cursor
+from etag import document_etag, list_etag, if_none_match, if_match
+from metrics import REQUEST_LATENCY, REQUESTS_IN_PROGRESS, render_metrics
+from services.single_flight import SingleFlight, request_key
+from services.rate_limit import create_rate_limiter, rate_limit_user
+from services.upstream import UpstreamError, DeadlineExceeded, deadline_scope
 
 load_dotenv()
 app = FastAPI(title="Tech Doc Assistant API")
@@ -31,18 +41,137 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # === レート制限設定 ===
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# ユーザー・ルートごとのトークンバケットを推定コストで消費する（全ワーカー・レプリカで共有）
+rate_limiter = create_rate_limiter()
+
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "1000"))
+
+
+async def charge_rate_limit(request: Request, route: str, cost: float) -> None:
+    """推定コストでレート制限の予算を消費し、超過した場合は429を返す"""
+    decision = await rate_limiter.charge(rate_limit_user(request), route, cost)
+    if decision.allowed:
+        return
+    if decision.retry_after is None:
+        raise HTTPException(status_code=413, detail=f"Request cost {cost:.0f} exceeds the {route} budget")
+    raise HTTPException(
+        status_code=429,
+        detail=f"Rate limit exceeded for {route} ({decision.remaining:.0f} remaining, {cost:.0f} requested)",
+        headers={"Retry-After": str(max(math.ceil(decision.retry_after), 1))}
+    )
+
+# === 外部APIの障害 ===
+# 対話的なルートの外部API呼び出しはリクエストの期限内に終わらせる（X-Request-Timeout で短くできる）
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+DEADLINE_PATHS = {"/api/search", "/api/search/batch", "/api/ask", "/api/ask/stream"}
+
+
+@app.middleware("http")
+async def propagate_deadline(request: Request, call_next):
+    if request.url.path not in DEADLINE_PATHS:
+        return await call_next(request)
+    seconds = REQUEST_DEADLINE_SECONDS
+    try:
+        seconds = min(seconds, float(request.headers.get("X-Request-Timeout", seconds)))
+    except ValueError:
+        pass
+    with deadline_scope(seconds):
+        return await call_next(request)
+
+
+def upstream_http_exception(e: UpstreamError) -> HTTPException:
+    """外部APIの一時的な障害は503（期限切れは504）として返す"""
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    headers = {"Retry-After": str(max(math.ceil(e.retry_after), 1))} if e.retry_after else None
+    return HTTPException(status_code=503, detail=str(e), headers=headers)
+
+# === 同一リクエストの単一実行 ===
+# 同時に届いた同じ検索・質問は1回だけ処理して結果を共有する
+# 共有する処理はサーバーの期限で実行し、各リクエストは自分の期限（X-Request-Timeout）まで待つ
+search_flight = SingleFlight("search", deadline_seconds=REQUEST_DEADLINE_SECONDS)
+ask_flight = SingleFlight("ask", deadline_seconds=REQUEST_DEADLINE_SECONDS)
+ask_stream_flight = SingleFlight("ask_stream", deadline_seconds=REQUEST_DEADLINE_SECONDS)
+
+# === メトリクス ===
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    start = time.perf_counter()
+    status = 500
+    in_progress = REQUESTS_IN_PROGRESS.labels(request.method)
+    in_progress.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_progress.dec()
+        # パスではなくルートのテンプレート（/documents/{document_id}）で集計する
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
 # === データベース初期化 ===
 @app.on_event("startup")
 def startup_event():
+    from services.text_search import ensure_text_search
+    from services.notion_import import ensure_notion_columns
+    from services.chunk_dedup import ensure_dedup_columns
     # アプリ起動時にテーブルを作成
     Base.metadata.create_all(bind=engine)
+    # 既存テーブルに全文検索用カラム・NotionページIDのカラム・重複検出用のカラムを追加
+    ensure_text_search(engine)
+    ensure_notion_columns(engine)
+    ensure_dedup_columns(engine)
+    # 既存テーブルに後から追加したインデックスも作成
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+@app.on_event("startup")
+async def warmup_clients():
+    from services.clients import warmup
+    # 外部APIクライアントと重いモジュールを事前に用意し、最初のリクエストの遅延をなくす
+    if os.getenv("CLIENT_WARMUP", "true").lower() == "true":
+        app.state.warmup_ms = await asyncio.to_thread(warmup)
+        print(f"Warmup finished: {app.state.warmup_ms}")
+
+@app.on_event("startup")
+async def start_index_worker():
+    from services.index_worker import IndexWorker
+    # ドキュメントの変更をバックグラウンドでベクトルインデックスに反映
+    if os.getenv("INDEX_WORKER_ENABLED", "true").lower() == "true":
+        app.state.index_worker = IndexWorker()
+        app.state.index_worker.start()
+
+@app.on_event("shutdown")
+async def stop_index_worker():
+    worker = getattr(app.state, "index_worker", None)
+    if worker is not None:
+        await worker.stop()
+
+@app.on_event("startup")
+def start_chunk_compare_pool():
+    from services.chunk_evaluation import start_executor
+    # チャンク分割戦略の比較用のワーカープール（プロセスは最初の比較で起動する）
+    start_executor()
+
+@app.on_event("shutdown")
+def stop_chunk_compare_pool():
+    from services.chunk_evaluation import shutdown_executor
+    shutdown_executor()
 
 def get_db():
     db = SessionLocal()
@@ -51,20 +180,58 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # === リクエスト/レスポンスモデル定義 ===
+# services.chunking の ChunkStrategy / SizeUnit と同じ値（import時に numpy などを読み込まないよう再定義）
+ChunkStrategy = Literal["fixed", "markdown", "semantic", "hybrid"]
+SizeUnit = Literal["chars", "tokens"]
+
 class ChunkRequest(BaseModel):
     document_id: str
     title: str
     content: str
-    strategy: str = "markdown"
+    strategy: ChunkStrategy = "markdown"
+    size_unit: SizeUnit = "chars"
+    chunk_size: Optional[int] = Field(None, gt=0)
+    overlap: Optional[int] = Field(None, ge=0)
+    
+    @model_validator(mode="after")
+    def check_overlap(self):
+        if self.chunk_size is not None and self.overlap is not None and self.overlap >= self.chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
+        return self
+
+class EvalQuery(BaseModel):
+    query: str
+    expected: str
+
+class ChunkCompareRequest(ChunkRequest):
+    strategies: Optional[List[ChunkStrategy]] = None
+    queries: Optional[List[EvalQuery]] = None
+    top_k: int = Field(5, ge=1)
 
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 5
+    diversify: bool = False
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    diversify: bool = False
+
+class TextSearchRequest(BaseModel):
+    query: str
+    top_k: int = 10
+    fuzzy: bool = True
 
 class QuestionRequest(BaseModel):
     question: str
     document_ids: Optional[List[str]] = None
+    diversify: bool = False
 
 class DocumentCreate(BaseModel):
     title: str
@@ -80,10 +247,17 @@ class DocumentResponse(BaseModel):
     content: str
     created_at: datetime
     updated_at: Optional[datetime]
-
+    
     class Config:
         from_attributes = True
 
+class DocumentListItem(BaseModel):
+    id: int
+    title: Optional[str] = None
+    content: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 class NotionPageRequest(BaseModel):
     page_id: str
 
@@ -91,8 +265,51 @@ class NotionSearchRequest(BaseModel):
     query: Optional[str] = None
 
 class NotionImportRequest(BaseModel):
-    page_id: str
+    page_id: Optional[str] = None
+    page_ids: List[str] = []
     chunk_strategy: str = "markdown"
+    concurrency: Optional[int] = None
+
+# ジョブの最大試行回数の上限（失敗し続けるジョブでワーカーを占有しないように）
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", "10"))
+
+# 分析ジョブのファイル形式（services.data_analysis.FileType と同じ。pandasを読み込まないようここで定義）
+AnalyzeFileType = Literal["csv", "excel", "parquet", "feather"]
+# 分析ジョブで受け付けるファイルの最大バイト数（ファイルはジョブの入力としてDBに保存される）
+ANALYZE_MAX_UPLOAD_BYTES = int(os.getenv("ANALYZE_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+class NotionImportJobPayload(NotionImportRequest):
+    @model_validator(mode="after")
+    def require_pages(self):
+        if not self.page_id and not self.page_ids:
+            raise ValueError("page_id or page_ids is required")
+        return self
+
+class DedupReportJobPayload(BaseModel):
+    threshold: Optional[float] = Field(None, gt=0, le=1)
+    top: int = Field(20, ge=1, le=1000)
+
+class JobSubmitBase(BaseModel):
+    max_attempts: int = Field(3, ge=1, le=MAX_JOB_ATTEMPTS)
+
+class ChunkJobRequest(JobSubmitBase):
+    type: Literal["chunk"]
+    payload: ChunkRequest
+
+class NotionImportJobRequest(JobSubmitBase):
+    type: Literal["notion_import"]
+    payload: NotionImportJobPayload
+
+class DedupReportJobRequest(JobSubmitBase):
+    type: Literal["dedup_report"]
+    payload: DedupReportJobPayload = DedupReportJobPayload()
+
+# ペイロードはジョブの種類ごとに投入時に検証する（不正なジョブをワーカーで失敗させない）
+# analyze はファイルを受け取る /api/jobs/analyze から投入する
+JobSubmitRequest = Annotated[
+    Union[ChunkJobRequest, NotionImportJobRequest, DedupReportJobRequest],
+    Field(discriminator="type")
+]
 
 class DBConnectionTest(BaseModel):
     db_type: str
@@ -126,102 +343,412 @@ def db_health_check(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database unhealthy: {str(e)}")
 
+@app.get("/health/index")
+async def index_outbox_stats(db: AsyncSession = Depends(get_async_db)):
+    from services.index_worker import outbox_stats
+    try:
+        return await outbox_stats(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/health/db/pool")
+def db_pool_stats():
+    return pool_stats()
+
 # === ドキュメント CRUD ===
-@app.get("/documents", response_model=List[DocumentResponse])
-def get_documents(db: Session = Depends(get_db)):
-    documents = db.query(Document).order_by(Document.created_at.desc()).all()
-    return documents
+# 一覧で選択できるフィールドと summary ビューでの本文の長さ
+DOCUMENT_FIELDS = ["id", "title", "content", "created_at", "updated_at"]
+SUMMARY_CONTENT_LENGTH = 200
+
+@app.get("/documents", response_model=List[DocumentListItem], response_model_exclude_unset=True)
+async def get_documents(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # 返すフィールドを決定（idは常に含める）
+    selected = DOCUMENT_FIELDS
+    if fields:
+        selected = ["id"] + [f for f in fields.split(",") if f and f != "id"]
+        unknown = set(selected) - set(DOCUMENT_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    # summary ビューでは本文をDB側で切り詰めて転送量を抑える
+    columns = {
+        "id": Document.id,
+        "title": Document.title,
+        "content": func.substr(Document.content, 1, SUMMARY_CONTENT_LENGTH).label("content")
+            if view == "summary" else Document.content,
+        "created_at": Document.created_at,
+        "updated_at": Document.updated_at,
+    }
+    query = select(
+        *[columns[f] for f in selected],
+        Document.created_at.label("cursor_created_at"),
+        Document.updated_at.label("version_updated_at")
+    )
+    
+    # (created_at, id) のキーセットページネーション
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(tuple_(Document.created_at, Document.id) < tuple_(cursor_created_at, cursor_id))
+    
+    order = (Document.created_at.desc(), Document.id.desc())
+    variant = f"{view}|{','.join(selected)}|{limit}|{cursor or ''}"
+    etag_header = request.headers.get("if-none-match")
+    if etag_header:
+        # 本文を読む前に id と更新日時だけでETagを比較し、変更がなければ304を返す
+        versions = await db.execute(
+            query.with_only_columns(Document.id, Document.created_at, Document.updated_at)
+            .order_by(*order).limit(limit)
+        )
+        etag = list_etag(versions.all(), variant)
+        if if_none_match(etag_header, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    
+    result = await db.execute(query.order_by(*order).limit(limit + 1))
+    rows = result.all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].cursor_created_at, rows[-1].id)
+    
+    response.headers["ETag"] = list_etag(
+        [(row.id, row.cursor_created_at, row.version_updated_at) for row in rows], variant
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    return [{f: getattr(row, f) for f in selected} for row in rows]
+
+# 一括インポートで受け付けるContent-Type
+ARCHIVE_CONTENT_TYPES = {
+    "application/zip": "zip",
+    "application/x-zip-compressed": "zip",
+    "application/x-tar": "tar",
+    "application/gzip": "tar",
+    "application/x-gzip": "tar",
+}
+
+@app.post("/documents/bulk")
+async def bulk_import_documents(
+    request: Request,
+    index: bool = True,
+    strategy: ChunkStrategy = "markdown",
+    db: AsyncSession = Depends(get_async_db)
+):
+    from services.bulk_documents import (
+        iter_ndjson_documents, iter_archive_documents, insert_documents
+    )
+    from services.index_worker import enqueue_reindex_many
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        if content_type in ("application/x-ndjson", "application/jsonl"):
+            # NDJSONはストリームのまま読み込んで登録
+            ids = await insert_documents(db, iter_ndjson_documents(request.stream()))
+        elif content_type in ARCHIVE_CONTENT_TYPES:
+            # zip/tarはランダムアクセスが必要なため一時ファイルに退避
+            with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as spool:
+                async for chunk in request.stream():
+                    spool.write(chunk)
+                spool.seek(0)
+                ids = await insert_documents(db, iter_archive_documents(spool, ARCHIVE_CONTENT_TYPES[content_type]))
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+        if index:
+            # インデックスへの反映もドキュメントと同じトランザクションで記録
+            await enqueue_reindex_many(db, ids, strategy)
+        # 全件を1トランザクションでコミット
+        await db.commit()
+    except HTTPException:
+        raise
+    except (ValueError, UnicodeDecodeError) as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {"imported": len(ids), "document_ids": ids, "indexing_queued": index and bool(ids)}
+
+@app.get("/documents/export")
+async def export_documents(db: AsyncSession = Depends(get_async_db)):
+    from services.bulk_documents import export_documents_ndjson
+    return StreamingResponse(
+        export_documents_ndjson(db),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=documents.ndjson"}
+    )
 
 @app.get("/documents/{document_id}", response_model=DocumentResponse)
-def get_document(document_id: int, db: Session = Depends(get_db)):
-    document = db.query(Document).filter(Document.id == document_id).first()
+async def get_document(
+    document_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
+    etag_header = request.headers.get("if-none-match")
+    if etag_header:
+        # 本文を読む前に更新日時だけでETagを比較
+        result = await db.execute(
+            select(Document.created_at, Document.updated_at).where(Document.id == document_id)
+        )
+        version = result.first()
+        if not version:
+            raise HTTPException(status_code=404, detail="Document not found")
+        etag = document_etag(document_id, version.created_at, version.updated_at)
+        if if_none_match(etag_header, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    response.headers["ETag"] = document_etag(document.id, document.created_at, document.updated_at)
+    response.headers["Cache-Control"] = "no-cache"
     return document
 
 @app.post("/documents", response_model=DocumentResponse)
-def create_document(doc: DocumentCreate, db: Session = Depends(get_db)):
+async def create_document(doc: DocumentCreate, response: Response, db: AsyncSession = Depends(get_async_db)):
+    from services.index_worker import enqueue_reindex
     document = Document(title=doc.title, content=doc.content)
     db.add(document)
-    db.commit()
-    db.refresh(document)
+    # IDを確定させてからインデックス反映を同じトランザクションで記録
+    await db.flush()
+    enqueue_reindex(db, document.id)
+    await db.commit()
+    await db.refresh(document)
+    response.headers["ETag"] = document_etag(document.id, document.created_at, document.updated_at)
     return document
 
 @app.put("/documents/{document_id}", response_model=DocumentResponse)
-def update_document(document_id: int, doc: DocumentUpdate, db: Session = Depends(get_db)):
-    document = db.query(Document).filter(Document.id == document_id).first()
+async def update_document(
+    document_id: int,
+    doc: DocumentUpdate,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # If-Match の確認から更新までの間に他の更新が入らないよう行ロックを取る
+    document = await db.get(Document, document_id, with_for_update=True)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
+    if not if_match(request.headers.get("if-match"), document_etag(document.id, document.created_at, document.updated_at)):
+        raise HTTPException(status_code=412, detail="Document has been modified by another request")
+    from services.index_worker import enqueue_reindex
     if doc.title is not None: document.title = doc.title
     if doc.content is not None: document.content = doc.content
     document.updated_at = datetime.now()
-    db.commit()
-    db.refresh(document)
+    enqueue_reindex(db, document.id)
+    await db.commit()
+    await db.refresh(document)
+    response.headers["ETag"] = document_etag(document.id, document.created_at, document.updated_at)
     return document
 
 @app.delete("/documents/{document_id}")
-def delete_document(document_id: int, db: Session = Depends(get_db)):
-    document = db.query(Document).filter(Document.id == document_id).first()
+async def delete_document(document_id: int, db: AsyncSession = Depends(get_async_db)):
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
-    db.delete(document)
-    db.commit()
+    from services.index_worker import enqueue_reindex
+    await db.delete(document)
+    enqueue_reindex(db, document_id, action="delete")
+    await db.commit()
     return {"message": "Document deleted successfully"}
 
 # === チャンク/検索/QA (RAG関連) ===
 @app.post("/api/chunk")
-async def chunk_document(request: ChunkRequest):
+async def chunk_document(request: ChunkRequest, http_request: Request):
     from services.chunking import chunk_and_embed
+    from services.rate_limit import chunk_cost
+    await charge_rate_limit(http_request, "chunk", chunk_cost(request.content))
     try:
         return await chunk_and_embed(
             document_id=request.document_id,
             title=request.title,
             content=request.content,
-            strategy=request.strategy
+            strategy=request.strategy,
+            size_unit=request.size_unit,
+            chunk_size=request.chunk_size,
+            overlap=request.overlap
         )
+    except UpstreamError as e:
+        raise upstream_http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/search")
-@limiter.limit("10/minute")
 async def search_documents(request: Request, search_req: SearchRequest):
     from services.search import search_similar_chunks
+    from services.rate_limit import search_cost
+    await charge_rate_limit(request, "search", search_cost([search_req.query]))
+    key = request_key(query=search_req.query, top_k=search_req.top_k, diversify=search_req.diversify)
     try:
-        results = await search_similar_chunks(query=search_req.query, top_k=search_req.top_k)
+        results = await search_flight.do(
+            key, lambda: search_similar_chunks(query=search_req.query, top_k=search_req.top_k, diversify=search_req.diversify)
+        )
         return {"results": results}
+    except UpstreamError as e:
+        raise upstream_http_exception(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/search/batch")
+async def search_documents_batch(request: Request, search_req: BatchSearchRequest):
+    from services.search import search_similar_chunks_batch
+    from services.rate_limit import search_cost
+    if not search_req.queries:
+        raise HTTPException(status_code=400, detail="queries must not be empty")
+    if len(search_req.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries per request")
+    # リクエスト数ではなくクエリごとのコストで制限する
+    await charge_rate_limit(request, "search_batch", search_cost(search_req.queries))
+    try:
+        results = await search_similar_chunks_batch(search_req.queries, top_k=search_req.top_k, diversify=search_req.diversify)
+    except UpstreamError as e:
+        raise upstream_http_exception(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": [{"query": query, "results": chunks} for query, chunks in zip(search_req.queries, results)]}
+
+@app.post("/api/search/text")
+def search_documents_text(search_req: TextSearchRequest, db: Session = Depends(get_db)):
+    from services.text_search import search_documents_text
+    # 英数字の語は tsvector で、日本語の語は形態素解析ができないため部分一致で検索する
+    try:
+        return {"results": search_documents_text(db, search_req.query, search_req.top_k, search_req.fuzzy)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/ask")
-async def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest, http_request: Request):
     from services.qa import answer_question
+    from services.rate_limit import ask_cost
+    await charge_rate_limit(http_request, "ask", ask_cost(request.question))
+    key = request_key(question=request.question, document_ids=request.document_ids or [], diversify=request.diversify)
     try:
-        return await answer_question(question=request.question, document_ids=request.document_ids)
+        return await ask_flight.do(
+            key, lambda: answer_question(question=request.question, document_ids=request.document_ids, diversify=request.diversify)
+        )
+    except UpstreamError as e:
+        raise upstream_http_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/ask/stream")
+async def ask_question_stream(request: QuestionRequest, http_request: Request):
+    from services.qa import stream_answer
+    from services.rate_limit import ask_cost
+    await charge_rate_limit(http_request, "ask", ask_cost(request.question))
+    key = request_key(question=request.question, document_ids=request.document_ids or [], diversify=request.diversify)
+    # 同じ質問の生成中に届いたリクエストは、生成済みのトークンから受け取る
+    events = ask_stream_flight.stream(
+        key, lambda: stream_answer(question=request.question, document_ids=request.document_ids, diversify=request.diversify)
+    )
+    
+    async def ndjson():
+        try:
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @app.post("/api/chunk/compare")
-async def compare_chunking_strategies(request: ChunkRequest):
-    from services.chunking import DocumentChunker
+async def compare_chunking_strategies(request: ChunkCompareRequest, http_request: Request):
+    from services.chunk_evaluation import compare_strategies, STRATEGIES
+    from services.rate_limit import compare_cost
+    await charge_rate_limit(http_request, "chunk", compare_cost(
+        request.content,
+        len(request.strategies or STRATEGIES),
+        [q.query for q in request.queries] if request.queries else None
+    ))
     try:
-        strategies = ["fixed", "markdown", "semantic", "hybrid"]
-        results = {}
-        for strategy in strategies:
-            chunker = DocumentChunker(strategy=strategy)
-            chunks = chunker.chunk_text(request.content)
-            chunk_sizes = [c["metadata"]["chunk_size"] for c in chunks]
-            results[strategy] = {
-                "chunks_count": len(chunks),
-                "average_size": sum(chunk_sizes) / len(chunk_sizes) if chunk_sizes else 0,
-                "min_size": min(chunk_sizes) if chunk_sizes else 0,
-                "max_size": max(chunk_sizes) if chunk_sizes else 0,
-                "sample_chunks": [c["text"][:200] + "..." for c in chunks[:3]]
-            }
-        return results
+        return await compare_strategies(
+            content=request.content,
+            strategies=request.strategies,
+            size_unit=request.size_unit,
+            chunk_size=request.chunk_size,
+            overlap=request.overlap,
+            queries=[q.model_dump() for q in request.queries] if request.queries else None,
+            top_k=request.top_k
+        )
     except Exception as e:
         # ここで ModuleNotFoundError (langchain) が出る場合は requirements.txt を確認
         raise HTTPException(status_code=500, detail=str(e))
 
+# === バックグラウンドジョブ ===
+@app.post("/api/jobs", status_code=202)
+async def submit_job(request: JobSubmitRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
+    from services.jobs import submit_job, job_to_dict
+    from services.rate_limit import job_cost
+    # ジョブでも同期のAPIと同じ予算を消費する（ジョブにすれば制限を回避できないように）
+    payload = request.payload.model_dump(exclude_unset=True)
+    await charge_rate_limit(http_request, *job_cost(request.type, payload))
+    try:
+        job = await submit_job(db, request.type, payload, max_attempts=request.max_attempts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job_to_dict(job)
+
+@app.post("/api/jobs/analyze", status_code=202)
+async def submit_analysis_job(
+    request: Request,
+    file_type: AnalyzeFileType,
+    sheet: Optional[List[str]] = Query(None),
+    all_sheets: bool = False,
+    max_rows: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    from services.jobs import submit_job, job_to_dict
+    from services.rate_limit import job_cost
+    # ファイルはリクエストボディとしてそのまま受け取り、ワーカーで分析する
+    too_large = HTTPException(status_code=413, detail=f"File exceeds {ANALYZE_MAX_UPLOAD_BYTES} bytes")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > ANALYZE_MAX_UPLOAD_BYTES:
+        raise too_large
+    # Content-Lengthのない（chunked）リクエストも読み込みながら上限で打ち切る
+    content = bytearray()
+    async for chunk in request.stream():
+        content += chunk
+        if len(content) > ANALYZE_MAX_UPLOAD_BYTES:
+            raise too_large
+    content = bytes(content)
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty file")
+    await charge_rate_limit(request, *job_cost("analyze", {}))
+    # Excelのシートは名前で指定（複数可）、all_sheets で全シートを分析
+    options = {}
+    if all_sheets:
+        options["sheet_name"] = None
+    elif sheet:
+        options["sheet_name"] = sheet[0] if len(sheet) == 1 else sheet
+    if max_rows is not None:
+        options["max_rows"] = max_rows
+    job = await submit_job(db, "analyze", {"file_type": file_type, "options": options}, input_data=content)
+    return job_to_dict(job)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    from services.jobs import get_job, job_to_dict
+    job = await get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    from services.jobs import cancel_job, job_to_dict
+    job = await cancel_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
+
 # === Notionサービス ===
 @app.post("/api/notion/page")
 async def get_notion_page(request: NotionPageRequest):
@@ -239,6 +766,27 @@ async def search_notion(request: NotionSearchRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/notion/import")
+async def import_notion_pages(request: NotionImportRequest, http_request: Request):
+    from services.notion_import import import_notion_pages, unique_page_ids, MAX_PAGES_PER_REQUEST
+    from services.chunking import ChunkStrategy
+    from services.rate_limit import notion_import_cost
+    page_ids = unique_page_ids(request.page_ids + ([request.page_id] if request.page_id else []))
+    if not page_ids:
+        raise HTTPException(status_code=400, detail="page_id or page_ids is required")
+    if len(page_ids) > MAX_PAGES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGES_PER_REQUEST} pages per request")
+    if request.chunk_strategy not in get_args(ChunkStrategy):
+        raise HTTPException(status_code=400, detail=f"Unknown chunk strategy: {request.chunk_strategy}")
+    await charge_rate_limit(http_request, "notion_import", notion_import_cost(len(page_ids)))
+    
+    # ページごとの進捗（fetching / indexing / done / error）をNDJSONで逐次返す
+    events = import_notion_pages(page_ids, request.chunk_strategy, request.concurrency)
+    return StreamingResponse(
+        (json.dumps(event, ensure_ascii=False) + "\n" async for event in events),
+        media_type="application/x-ndjson"
+    )
+
 # === データベース接続サービス ===
 @app.post("/api/database/test")
 async def test_database_connection(request: DBConnectionTest):
@@ -0,0 +1,157 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+# 外部API呼び出しを含む処理向けのバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP requests currently being processed",
+    ["method"]
+)
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "Latency of each stage inside an operation (e.g. embed, vector_query, generate)",
+    ["operation", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+TOKENS = Counter(
+    "openai_tokens_total",
+    "OpenAI tokens used",
+    ["model", "kind"]
+)
+CONNECTOR_CONNECTIONS = Counter(
+    "connector_connections_total",
+    "External database connection attempts",
+    ["db_type", "result"]
+)
+CONNECTOR_OPEN = Gauge(
+    "connector_open_engines",
+    "External database engines currently open",
+    ["db_type"]
+)
+CONNECTOR_LATENCY = Histogram(
+    "connector_operation_duration_seconds",
+    "External database operation latency",
+    ["db_type", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+
+SINGLE_FLIGHT = Counter(
+    "single_flight_requests_total",
+    "Requests that started a computation (leader) or joined an in-flight one (follower)",
+    ["operation", "role"]
+)
+UPSTREAM_CALLS = Counter(
+    "upstream_calls_total",
+    "Upstream API calls by outcome (success, retry, error, hedge, hedge_won, deadline_exceeded)",
+    ["dependency", "operation", "result"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_attempt_duration_seconds",
+    "Latency of successful upstream API attempts",
+    ["dependency", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+UPSTREAM_CIRCUIT_STATE = Gauge(
+    "upstream_circuit_state",
+    "Circuit breaker state per dependency (0=closed, 1=half_open, 2=open)",
+    ["dependency"]
+)
+RATE_LIMIT_DECISIONS = Counter(
+    "rate_limit_decisions_total",
+    "Rate limit decisions (allowed, rejected, local_rejected, too_large, store_error)",
+    ["route", "result"]
+)
+CHUNK_DEDUP = Counter(
+    "chunk_dedup_total",
+    "Chunks embedded and stored (unique) or sharing an existing near-duplicate chunk (duplicate)",
+    ["result"]
+)
+
+
+@contextmanager
+def stage_timer(operation: str, stage: str) -> Iterator[None]:
+    """処理の1ステージの所要時間を記録"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(operation, stage).observe(time.perf_counter() - start)
+
+
+def record_token_usage(model: str, usage) -> None:
+    """OpenAIレスポンスの usage をトークン数として記録"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    if prompt_tokens:
+        TOKENS.labels(model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        TOKENS.labels(model, "completion").inc(completion_tokens)
+
+
+# === キャッシュのヒット率 ===
+
+_caches: Dict[str, Callable] = {}
+
+
+def register_cache(name: str, cached_function: Callable) -> None:
+    """lru_cacheで包んだ関数のヒット数/ミス数を公開する"""
+    _caches[name] = cached_function
+
+
+class _CacheCollector:
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "lru_cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "lru_cache misses", labels=["cache"])
+        ratio = GaugeMetricFamily("cache_hit_ratio", "lru_cache hit ratio", labels=["cache"])
+        size = GaugeMetricFamily("cache_size", "lru_cache entries", labels=["cache"])
+        for name, cached_function in _caches.items():
+            info = cached_function.cache_info()
+            total = info.hits + info.misses
+            hits.add_metric([name], info.hits)
+            misses.add_metric([name], info.misses)
+            ratio.add_metric([name], info.hits / total if total else 0.0)
+            size.add_metric([name], info.currsize)
+        yield from (hits, misses, ratio, size)
+
+
+class _PoolCollector:
+    """アプリのDBコネクションプールの状態（database.pool_stats）を公開"""
+    
+    def collect(self):
+        from database import pool_stats
+        
+        gauges = {
+            key: GaugeMetricFamily(f"db_pool_{key}", f"DB connection pool {key.replace('_', ' ')}", labels=["engine"])
+            for key in ("pool_size", "checked_out", "checked_in", "overflow", "utilization")
+        }
+        counters = {
+            key: CounterMetricFamily(f"db_pool_{key}", f"DB connection pool {key.replace('_', ' ')}", labels=["engine"])
+            for key in ("checkouts", "saturated_checkouts")
+        }
+        for name, stats in pool_stats().items():
+            for key, family in {**gauges, **counters}.items():
+                family.add_metric([name], stats.get(key, 0))
+        yield from gauges.values()
+        yield from counters.values()
+
+
+REGISTRY.register(_CacheCollector())
+REGISTRY.register(_PoolCollector())
+
+
+def render_metrics() -> tuple:
+    """Prometheus形式のテキストとContent-Typeを返す"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
\ No newline at end of file
@@ -1,7 +1,15 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Index, Computed, Float, Boolean, LargeBinary, text
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB, ARRAY
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from database import Base
 
+# 全文検索用tsvectorの生成式（タイトルを本文より重み付け）
+SEARCH_VECTOR_EXPRESSION = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(content, '')), 'B')"
+)
+
 class Document(Base):
     __tablename__ = "documents"
 
@@ -10,5 +18,116 @@ class Document(Base):
     content = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Notionからインポートしたドキュメントの元ページ（再インポート時の上書き用）
+    notion_page_id = Column(String)
+    # 通常のクエリでは読み込まない
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_EXPRESSION, persisted=True)))
+
+    __table_args__ = (
+        # 一覧のキーセットページネーション (created_at, id) 用
+        Index("ix_documents_created_at_id", "created_at", "id"),
+        # 全文検索用
+        Index("ix_documents_search_vector", "search_vector", postgresql_using="gin"),
+        # Notionページ単位のupsert（ON CONFLICT）用
+        Index(
+            "ix_documents_notion_page_id", "notion_page_id",
+            unique=True, postgresql_where=text("notion_page_id IS NOT NULL")
+        ),
+    )
+
+class Chunk(Base):
+    """チャンク本文（Pineconeのメタデータには保存せず、検索後にベクトルIDでまとめて取得）"""
+    __tablename__ = "chunks"
+
+    # PineconeのベクトルID（{document_id}_chunk_{chunk_index}）
+    id = Column(String, primary_key=True)
+    document_id = Column(String, nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    # 見出しなどのネストしたメタデータ
+    extra_metadata = Column(JSONB)
+    # 重複検出用のMinHashシグネチャ（uint32 × 置換数）とLSHのバンドごとのハッシュ
+    minhash = deferred(Column(LargeBinary))
+    lsh_bands = Column(ARRAY(BigInteger))
+
+    __table_args__ = (
+        # ドキュメント単位の削除・余ったチャンクの削除用
+        Index("ix_chunks_document_id_chunk_index", "document_id", "chunk_index"),
+        # バンドのハッシュが一致する候補の検索（&&）用
+        Index("ix_chunks_lsh_bands", "lsh_bands", postgresql_using="gin"),
+    )
+
+class ChunkReference(Base):
+    """他のドキュメントのチャンクとほぼ同じため、ベクトルと本文を共有しているチャンク"""
+    __tablename__ = "chunk_references"
+
+    document_id = Column(String, primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    # 共有しているチャンク（chunks.id = PineconeのベクトルID）
+    chunk_id = Column(String, nullable=False, index=True)
+    # 共有元が削除された場合にこのドキュメントのベクトルとして保存し直すためのメタデータ
+    vector_metadata = Column(JSONB, nullable=False)
+    extra_metadata = Column(JSONB)
+
+class RateLimitBucket(Base):
+    """レート制限のトークンバケット（全ワーカー・レプリカで共有）"""
+    __tablename__ = "rate_limit_buckets"
+
+    # route:{ルート}:{ユーザー} または user:{ユーザー}
+    key = Column(String, primary_key=True)
+    # 最終更新時点の残りトークン（経過時間に応じて補充して使う）
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+class IndexOutbox(Base):
+    """ベクトルインデックスへの反映待ちの変更（ドキュメント更新と同じトランザクションで記録）"""
+    __tablename__ = "index_outbox"
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, nullable=False)
+    # upsert / delete（実際の処理は反映時点のドキュメントの有無で決まる）
+    action = Column(String, nullable=False, default="upsert")
+    strategy = Column(String, nullable=False, default="markdown")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # リトライ時のバックオフ（この時刻まで処理しない）
+    available_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    # リトライ上限に達した場合のみ設定（成功した行は削除）
+    failed_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # 未処理の変更をドキュメント単位でまとめる
+        Index("ix_index_outbox_pending", "document_id", "id", postgresql_where=text("failed_at IS NULL")),
+    )
+
+class Job(Base):
+    """ワーカープロセスで実行する長時間処理のジョブ"""
+    __tablename__ = "jobs"
 
+    id = Column(Integer, primary_key=True)
+    type = Column(String, nullable=False)
+    # queued / running / succeeded / failed / cancelled
+    status = Column(String, nullable=False, default="queued")
+    payload = Column(JSONB, nullable=False, default=dict)
+    # アップロードされたファイルなどの入力データ（一覧では読み込まない）
+    input_data = deferred(Column(LargeBinary))
+    result = Column(JSONB)
+    error = Column(Text)
+    progress = Column(Float, nullable=False, default=0.0)
+    progress_message = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    worker_id = Column(String)
+    # リトライ時のバックオフ（この時刻まで実行しない）
+    run_after = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    heartbeat_at = Column(DateTime(timezone=True))
 
+    __table_args__ = (
+        # 種類ごとの実行待ちジョブの取得用
+        Index("ix_jobs_queued", "type", "run_after", "id", postgresql_where=text("status = 'queued'")),
+    )
\ No newline at end of file
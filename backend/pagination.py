@@ -0,0 +1,19 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+
+def encode_cursor(created_at: datetime, document_id: int) -> str:
+    """キーセットページネーション用のカーソルを作成"""
+    raw = f"{created_at.isoformat()}|{document_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """カーソルを (created_at, id) に復元"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, document_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(document_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
\ No newline at end of file
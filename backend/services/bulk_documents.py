@@ -0,0 +1,173 @@
+import json
+import os
+import tarfile
+import zipfile
+from typing import List, Dict, Iterable, Iterator, AsyncIterable, AsyncIterator, IO, Optional, Union
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Document
+
+# 1回のINSERTでまとめる行数と、タイトル・本文の合計バイト数の上限
+INSERT_BATCH_SIZE = 1000
+INSERT_BATCH_BYTES = 16 * 1024 * 1024
+
+# エクスポート時に1回で取得する行数
+EXPORT_BATCH_SIZE = 500
+
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".txt")
+
+# 1ドキュメント（NDJSONの1行、アーカイブ内の1ファイル）の最大バイト数
+MAX_DOCUMENT_BYTES = int(os.getenv("BULK_MAX_DOCUMENT_BYTES", str(10 * 1024 * 1024)))
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes], max_line_bytes: Optional[int] = None) -> AsyncIterator[str]:
+    """バイト列のストリームを行単位に変換
+    
+    改行を含まない大きなチャンクが続いても線形時間で処理できるよう、
+    新しいチャンクだけを分割し、行の途中の断片はリストに溜めて行の終わりで結合する。
+    """
+    
+    pending: List[bytes] = []
+    pending_size = 0
+    line_number = 0
+    
+    def check_size(size: int) -> None:
+        if max_line_bytes is not None and size > max_line_bytes:
+            raise ValueError(f"Line {line_number + 1} exceeds the maximum document size ({max_line_bytes} bytes)")
+    
+    async for chunk in chunks:
+        start = 0
+        end = chunk.find(b"\n")
+        while end >= 0:
+            check_size(pending_size + end - start)
+            pending.append(chunk[start:end])
+            yield b"".join(pending).decode("utf-8")
+            line_number += 1
+            pending = []
+            pending_size = 0
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if start < len(chunk):
+            pending.append(chunk[start:])
+            pending_size += len(chunk) - start
+            check_size(pending_size)
+    if pending:
+        yield b"".join(pending).decode("utf-8")
+
+
+async def iter_ndjson_documents(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+    """NDJSONのストリームからドキュメントを逐次読み込む"""
+    
+    line_number = 0
+    async for line in aiter_lines(chunks, max_line_bytes=MAX_DOCUMENT_BYTES):
+        line_number += 1
+        if line.strip():
+            yield parse_ndjson_line(line, line_number)
+
+
+def parse_ndjson_line(line: str, line_number: int) -> Dict:
+    """NDJSONの1行をドキュメントに変換"""
+    
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON at line {line_number}: {str(e)}")
+    
+    if not isinstance(data, dict) or not isinstance(data.get("title"), str) or not isinstance(data.get("content"), str):
+        raise ValueError(f"Line {line_number} must have string 'title' and 'content'")
+    
+    return {"title": data["title"], "content": data["content"]}
+
+
+def markdown_title(filename: str, content: str) -> str:
+    """最初のh1見出し、なければファイル名をタイトルにする"""
+    
+    for line in content.splitlines():
+        if line.startswith("# "):
+            return line[2:].strip()
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def iter_archive_documents(fileobj: IO[bytes], archive_type: str) -> Iterator[Dict]:
+    """zip/tarアーカイブ内のMarkdownファイルをドキュメントとして読み込む"""
+    
+    if archive_type == "zip":
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(MARKDOWN_EXTENSIONS):
+                    continue
+                # 展開後のサイズで判定（宣言より大きく展開されるデータはzipfileが読み込みを打ち切る）
+                _check_document_size(info.filename, info.file_size)
+                content = archive.read(info).decode("utf-8")
+                yield {"title": markdown_title(info.filename, content), "content": content}
+    elif archive_type == "tar":
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.lower().endswith(MARKDOWN_EXTENSIONS):
+                    continue
+                _check_document_size(member.name, member.size)
+                content = archive.extractfile(member).read().decode("utf-8")
+                yield {"title": markdown_title(member.name, content), "content": content}
+    else:
+        raise ValueError(f"Unsupported archive type: {archive_type}")
+
+
+def _check_document_size(filename: str, size: int) -> None:
+    """アーカイブ内のファイルが最大サイズを超えていないか確認"""
+    
+    if size > MAX_DOCUMENT_BYTES:
+        raise ValueError(f"{filename} exceeds the maximum document size ({MAX_DOCUMENT_BYTES} bytes)")
+
+
+async def insert_documents(db: AsyncSession, documents: Union[Iterable[Dict], AsyncIterable[Dict]]) -> List[int]:
+    """ドキュメントを複数行INSERTでまとめて登録し、IDを返す（コミットは呼び出し側）"""
+    
+    if not hasattr(documents, "__aiter__"):
+        documents = _aiter(documents)
+    
+    ids = []
+    batch = []
+    batch_bytes = 0
+    async for document in documents:
+        batch.append(document)
+        batch_bytes += len(document["title"].encode("utf-8")) + len(document["content"].encode("utf-8"))
+        # 大きなドキュメントが続いても1文のパラメータが膨らみすぎないようにバイト数でも区切る
+        if len(batch) >= INSERT_BATCH_SIZE or batch_bytes >= INSERT_BATCH_BYTES:
+            ids.extend(await _insert_batch(db, batch))
+            batch = []
+            batch_bytes = 0
+    if batch:
+        ids.extend(await _insert_batch(db, batch))
+    return ids
+
+
+async def _aiter(items: Iterable) -> AsyncIterator:
+    """同期イテラブルを非同期イテレータに変換"""
+    for item in items:
+        yield item
+
+
+async def _insert_batch(db: AsyncSession, batch: List[Dict]) -> List[int]:
+    """1バッチ分を1つのINSERT ... RETURNINGで登録"""
+    
+    result = await db.execute(insert(Document).values(batch).returning(Document.id))
+    return list(result.scalars())
+
+
+async def export_documents_ndjson(db: AsyncSession) -> AsyncIterator[str]:
+    """全ドキュメントをNDJSONとしてストリーミング出力"""
+    
+    stmt = (
+        select(Document.id, Document.title, Document.content, Document.created_at, Document.updated_at)
+        .order_by(Document.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    result = await db.stream(stmt)
+    async for row in result:
+        yield json.dumps({
+            "id": row.id,
+            "title": row.title,
+            "content": row.content,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None
+        }, ensure_ascii=False) + "\n"
\ No newline at end of file
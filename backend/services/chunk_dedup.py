@@ -0,0 +1,362 @@
+import os
+import re
+import zlib
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Callable, Iterable, Tuple
+import numpy as np
+from sqlalchemy import text, select, update, func
+from sqlalchemy.engine import Engine
+from models import Chunk, ChunkReference
+
+# 取り込み時にほぼ同じチャンクを検出し、ベクトルと本文を共有するか
+CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP", "true").lower() == "true"
+
+# MinHashで推定したJaccard類似度がこの値以上のチャンクを重複とみなす
+DUPLICATE_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.9"))
+
+# 重複判定の対象にする最小文字数（見出しだけの短いチャンクは共有しない）
+MIN_DEDUP_CHARS = int(os.getenv("CHUNK_DEDUP_MIN_CHARS", "50"))
+
+# MinHashの置換数とLSHのバンド数（16バンド × 8行: 類似度0.9のペアはほぼ確実に、0.5のペアは約6%が候補になる）
+# シグネチャはデータベースに保存するため、変更した場合は保存済みのシグネチャを作り直すこと
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+
+# シグネチャ計算で一度に扱うシングル数（置換数 × この数 の一時配列を作る）
+SIGNATURE_BLOCK_SHINGLES = 16384
+
+# レポートでシグネチャを作り直す・読み込む行数
+REPORT_BATCH_SIZE = 1000
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """64ビット整数の混合関数（uint64の桁あふれを利用）"""
+    
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+# 置換の係数（乱数生成器のバージョンに依存しないよう固定の式で作る。a は奇数）
+_PERMUTATION_A = _splitmix64(np.arange(NUM_PERMUTATIONS, dtype=np.uint64)) | np.uint64(1)
+_PERMUTATION_B = _splitmix64(np.arange(NUM_PERMUTATIONS, 2 * NUM_PERMUTATIONS, dtype=np.uint64))
+
+
+def ensure_dedup_columns(engine: Engine) -> None:
+    """既存のchunksテーブルに重複検出用のカラムとインデックスを追加（PostgreSQLのみ）"""
+    
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS minhash BYTEA"))
+        conn.execute(text("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS lsh_bands BIGINT[]"))
+    for index in Chunk.__table__.indexes:
+        if index.name == "ix_chunks_lsh_bands":
+            index.create(bind=engine, checkfirst=True)
+
+
+def shingles(chunk_text: str) -> set:
+    """正規化した本文の文字n-gram（日本語のように空白で区切らない文章にも使える）"""
+    
+    normalized = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", chunk_text)).strip().lower()
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signatures(texts: List[str]) -> np.ndarray:
+    """各本文のMinHashシグネチャ（本文数 × 置換数 の uint32）
+    
+    シングルのハッシュを全本文分つなげ、置換ごとの値を一度に計算して本文ごとの最小値を取る。
+    """
+    
+    hashes = [
+        np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(chunk_text)), dtype=np.uint64)
+        for chunk_text in texts
+    ]
+    signatures = np.empty((len(texts), NUM_PERMUTATIONS), dtype=np.uint32)
+    start = 0
+    while start < len(texts):
+        # 一時配列が大きくなりすぎないよう、シングル数の合計で本文を区切る
+        end, total = start, 0
+        while end < len(texts) and (end == start or total + len(hashes[end]) <= SIGNATURE_BLOCK_SHINGLES):
+            total += len(hashes[end])
+            end += 1
+        block = np.concatenate(hashes[start:end])
+        offsets = np.cumsum([0] + [len(h) for h in hashes[start:end - 1]])
+        # multiply-shift ハッシュ: (a·x + b) mod 2^64 の上位32ビット
+        permuted = (_PERMUTATION_A[:, None] * block[None, :] + _PERMUTATION_B[:, None]) >> np.uint64(32)
+        signatures[start:end] = np.minimum.reduceat(permuted, offsets, axis=1).T
+        start = end
+    return signatures
+
+
+def lsh_keys(signatures: np.ndarray) -> np.ndarray:
+    """シグネチャをバンドに分け、バンドごとのハッシュ（本文数 × バンド数 の int64）を計算"""
+    
+    rows = NUM_PERMUTATIONS // LSH_BANDS
+    bands = signatures.reshape(len(signatures), LSH_BANDS, rows).astype(np.uint64)
+    keys = np.zeros((len(signatures), LSH_BANDS), dtype=np.uint64)
+    for row in range(rows):
+        keys = _splitmix64(keys ^ bands[:, :, row])
+    # 別のバンドの同じ値と一致しないよう、バンド番号を混ぜる
+    keys = _splitmix64(keys ^ np.arange(LSH_BANDS, dtype=np.uint64))
+    return keys.view(np.int64)
+
+
+def signature_similarity(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """MinHashシグネチャの一致率（Jaccard類似度の推定値）"""
+    return (others == signature).mean(axis=-1)
+
+
+def encode_signature(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+
+def decode_signature(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4").astype(np.uint32)
+
+
+def is_dedup_candidate(chunk_text: str) -> bool:
+    return len(chunk_text.strip()) >= MIN_DEDUP_CHARS
+
+
+@dataclass
+class DedupResult:
+    """バッチ内の各チャンクの重複判定の結果"""
+    # 共有するチャンクのID（重複でなければNone）
+    duplicate_of: List[Optional[str]]
+    # chunksテーブルに保存するシグネチャとバンドのハッシュ（短いチャンクはNoneと空のリスト）
+    signatures: List[Optional[bytes]]
+    band_keys: List[List[int]]
+
+
+class ChunkDeduplicator:
+    """取り込み中のドキュメントのチャンクを、既存のチャンクとこの取り込みで保存したチャンクと照合する
+    
+    既存のチャンクはLSHのバンドのハッシュが1つでも一致するものをデータベースから候補として取り、
+    MinHashで推定した類似度がしきい値以上で最も近いものを共有先にする。
+    同じドキュメントの既存のチャンクは上書き・削除されるため共有先にしない。
+    """
+    
+    def __init__(
+        self,
+        document_id: str,
+        threshold: Optional[float] = None,
+        lookup: Optional[Callable[[Iterable[int], str], List[Tuple[str, bytes, List[int]]]]] = None
+    ):
+        from services.chunk_store import find_candidate_chunks
+        
+        self.document_id = document_id
+        self.threshold = DUPLICATE_THRESHOLD if threshold is None else threshold
+        self.lookup = lookup or find_candidate_chunks
+        # この取り込みで保存したチャンク（バンドのハッシュ → チャンクの番号）
+        self._ids: List[str] = []
+        self._signatures: List[np.ndarray] = []
+        self._buckets: Dict[int, List[int]] = {}
+    
+    def match(self, chunk_ids: List[str], texts: List[str]) -> DedupResult:
+        """バッチのチャンクを順に照合し、重複でないチャンクは後続の照合対象に加える"""
+        
+        eligible = [is_dedup_candidate(chunk_text) for chunk_text in texts]
+        duplicate_of: List[Optional[str]] = [None] * len(texts)
+        encoded: List[Optional[bytes]] = [None] * len(texts)
+        band_keys: List[List[int]] = [[] for _ in texts]
+        if not any(eligible):
+            return DedupResult(duplicate_of, encoded, band_keys)
+        
+        positions = [i for i, ok in enumerate(eligible) if ok]
+        signatures = minhash_signatures([texts[i] for i in positions])
+        keys = lsh_keys(signatures)
+        
+        # 既存のチャンクの候補をバッチ分まとめて取得し、バンドのハッシュで引けるようにする
+        existing = self.lookup(keys.ravel().tolist(), self.document_id)
+        existing_ids = [row[0] for row in existing]
+        existing_signatures = np.array([decode_signature(row[1]) for row in existing]).reshape(-1, NUM_PERMUTATIONS)
+        existing_buckets: Dict[int, List[int]] = {}
+        for n, row in enumerate(existing):
+            for key in row[2]:
+                existing_buckets.setdefault(key, []).append(n)
+        
+        for n, i in enumerate(positions):
+            row_keys = keys[n].tolist()
+            encoded[i] = encode_signature(signatures[n])
+            band_keys[i] = row_keys
+            
+            best_id, best_score = None, self.threshold
+            for ids, candidates, buckets in (
+                (existing_ids, existing_signatures, existing_buckets),
+                (self._ids, self._signatures, self._buckets),
+            ):
+                found = sorted({c for key in row_keys for c in buckets.get(key, ())})
+                if not found:
+                    continue
+                scores = signature_similarity(signatures[n], np.asarray([candidates[c] for c in found]))
+                top = int(np.argmax(scores))
+                if scores[top] >= best_score:
+                    best_id, best_score = ids[found[top]], scores[top]
+            
+            if best_id is not None:
+                duplicate_of[i] = best_id
+                continue
+            for key in row_keys:
+                self._buckets.setdefault(key, []).append(len(self._ids))
+            self._ids.append(chunk_ids[i])
+            self._signatures.append(signatures[n])
+        
+        return DedupResult(duplicate_of, encoded, band_keys)
+
+
+def cluster_near_duplicates(buckets: Iterable[List[str]], signatures: Dict[str, np.ndarray], threshold: float) -> List[List[str]]:
+    """LSHの同じバケットに入ったチャンクのうち、類似度がしきい値以上のものをまとめる（Union-Find）"""
+    
+    parent: Dict[str, str] = {}
+    
+    def find(chunk_id: str) -> str:
+        parent.setdefault(chunk_id, chunk_id)
+        while parent[chunk_id] != chunk_id:
+            parent[chunk_id] = parent[parent[chunk_id]]
+            chunk_id = parent[chunk_id]
+        return chunk_id
+    
+    for bucket in buckets:
+        members = [chunk_id for chunk_id in dict.fromkeys(bucket) if chunk_id in signatures]
+        if len(members) < 2:
+            continue
+        matrix = np.asarray([signatures[chunk_id] for chunk_id in members])
+        for i in range(len(members) - 1):
+            similar = np.nonzero(signature_similarity(matrix[i], matrix[i + 1:]) >= threshold)[0]
+            for j in similar:
+                parent[find(members[i + 1 + j])] = find(members[i])
+    
+    clusters: Dict[str, List[str]] = {}
+    for chunk_id in parent:
+        clusters.setdefault(find(chunk_id), []).append(chunk_id)
+    return sorted((sorted(c) for c in clusters.values() if len(c) > 1), key=len, reverse=True)
+
+
+def _backfill_signatures(db, progress: Optional[Callable[[float, str], None]]) -> int:
+    """シグネチャのないチャンク（重複検出の導入前に保存したもの）のシグネチャを計算して保存"""
+    
+    remaining = db.execute(select(func.count()).select_from(Chunk).where(Chunk.lsh_bands.is_(None))).scalar_one()
+    done, last_id = 0, ""
+    while True:
+        rows = db.execute(
+            select(Chunk.id, Chunk.text)
+            .where(Chunk.lsh_bands.is_(None))
+            .where(Chunk.id > last_id)
+            .order_by(Chunk.id)
+            .limit(REPORT_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        eligible = [row for row in rows if is_dedup_candidate(row.text)]
+        signatures = minhash_signatures([row.text for row in eligible])
+        keys = lsh_keys(signatures)
+        values = {row.id: {"minhash": None, "lsh_bands": []} for row in rows}
+        for row, signature, row_keys in zip(eligible, signatures, keys):
+            values[row.id] = {"minhash": encode_signature(signature), "lsh_bands": row_keys.tolist()}
+        db.execute(update(Chunk), [{"id": chunk_id, **value} for chunk_id, value in values.items()])
+        db.commit()
+        done += len(rows)
+        if progress is not None:
+            progress(0.5 * done / max(remaining, 1), f"{done}/{remaining} signatures computed")
+    return done
+
+
+def build_dedup_report(
+    threshold: Optional[float] = None,
+    top: int = 20,
+    progress: Optional[Callable[[float, str], None]] = None
+) -> Dict:
+    """コーパス全体のほぼ同じチャンクを集計したレポート
+    
+    取り込み時に共有したチャンク（chunk_references）と、まだ共有されていない重複
+    （重複検出の導入前に保存したチャンクなど）のクラスタを報告する。
+    シグネチャのないチャンクはシグネチャを計算して保存し、以降の取り込みで照合できるようにする。
+    """
+    
+    from database import SessionLocal
+    
+    threshold = DUPLICATE_THRESHOLD if threshold is None else threshold
+    with SessionLocal() as db:
+        backfilled = _backfill_signatures(db, progress)
+        
+        stored_chunks = db.execute(select(func.count()).select_from(Chunk)).scalar_one()
+        references = db.execute(select(func.count()).select_from(ChunkReference)).scalar_one()
+        sharing_documents = db.execute(select(func.count(func.distinct(ChunkReference.document_id)))).scalar_one()
+        
+        # LSHのバケットはデータベースで集計し、2件以上のバケットのチャンクだけを読み込む
+        band = func.unnest(Chunk.lsh_bands).label("band")
+        exploded = select(Chunk.id, band).subquery()
+        buckets = [
+            list(row.ids) for row in db.execute(
+                select(func.array_agg(exploded.c.id).label("ids"))
+                .group_by(exploded.c.band)
+                .having(func.count() > 1)
+            )
+        ]
+        candidate_ids = sorted({chunk_id for bucket in buckets for chunk_id in bucket})
+        if progress is not None:
+            progress(0.6, f"{len(candidate_ids)} candidate chunks in {len(buckets)} buckets")
+        
+        signatures: Dict[str, np.ndarray] = {}
+        for start in range(0, len(candidate_ids), REPORT_BATCH_SIZE):
+            batch = candidate_ids[start:start + REPORT_BATCH_SIZE]
+            for row in db.execute(select(Chunk.id, Chunk.minhash).where(Chunk.id.in_(batch))):
+                if row.minhash is not None:
+                    signatures[row.id] = decode_signature(row.minhash)
+        clusters = cluster_near_duplicates(buckets, signatures, threshold)
+        if progress is not None:
+            progress(0.9, f"{len(clusters)} near-duplicate clusters")
+        
+        shown = [chunk_id for cluster in clusters[:top] for chunk_id in cluster]
+        details = {
+            row.id: row for row in db.execute(
+                select(Chunk.id, Chunk.document_id, Chunk.text).where(Chunk.id.in_(shown))
+            )
+        } if shown else {}
+        
+        reference_counts = func.count().label("references")
+        most_shared = db.execute(
+            select(ChunkReference.chunk_id, reference_counts, Chunk.document_id, Chunk.text)
+            .join(Chunk, Chunk.id == ChunkReference.chunk_id)
+            .group_by(ChunkReference.chunk_id, Chunk.document_id, Chunk.text)
+            .order_by(reference_counts.desc())
+            .limit(top)
+        ).all()
+    
+    redundant = sum(len(cluster) - 1 for cluster in clusters)
+    total = stored_chunks + references
+    return {
+        "threshold": threshold,
+        "stored_chunks": stored_chunks,
+        "shared_references": references,
+        "documents_sharing_chunks": sharing_documents,
+        # 取り込み時の共有で埋め込み・保存を省いたチャンクの割合
+        "deduplicated_ratio": references / total if total else 0.0,
+        "signatures_backfilled": backfilled,
+        "near_duplicate_clusters": len(clusters),
+        # まだ共有されていない重複（各クラスタ1件を残せば削減できるベクトル数）
+        "redundant_chunks": redundant,
+        "reclaimable_ratio": redundant / stored_chunks if stored_chunks else 0.0,
+        "top_clusters": [
+            {
+                "size": len(cluster),
+                "chunk_ids": cluster,
+                "document_ids": sorted({details[chunk_id].document_id for chunk_id in cluster}),
+                "sample": details[cluster[0]].text[:200]
+            }
+            for cluster in clusters[:top]
+        ],
+        "most_shared_chunks": [
+            {"chunk_id": row.chunk_id, "document_id": row.document_id, "references": row.references, "sample": row.text[:200]}
+            for row in most_shared
+        ]
+    }
\ No newline at end of file
@@ -0,0 +1,300 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from services.embeddings import (
+    Quantization, DEFAULT_RESCORE_FACTOR, get_embedding_profile, normalize_rows, truncate_dimensions,
+    calibrate_int8, quantize_int8, int8_scores, quantize_binary, pack_binary_codes, hamming_distances, top_k_indices, quantized_size
+)
+
+STRATEGIES = ["fixed", "markdown", "semantic", "hybrid"]
+
+
+# チャンク分割用のワーカープール（アプリの起動時に作成し、終了時に停止する）
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def start_executor() -> ProcessPoolExecutor:
+    """チャンク分割用のワーカープールを作成（作成済みならそれを返す）
+    
+    マルチスレッドのサーバープロセスから fork しないよう spawn でワーカーを起動する。
+    """
+    
+    global _executor
+    if _executor is None:
+        workers = int(os.getenv("CHUNK_COMPARE_WORKERS", min(len(STRATEGIES), os.cpu_count() or 1)))
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_executor(executor: Optional[ProcessPoolExecutor] = None) -> None:
+    """ワーカープールを停止（executor を指定した場合は、それが現在のプールのときだけ停止）"""
+    
+    global _executor
+    if _executor is None or (executor is not None and executor is not _executor):
+        return
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+def _run_strategy(
+    strategy: str,
+    content: str,
+    size_unit: str,
+    chunk_size: Optional[int],
+    overlap: Optional[int]
+) -> Tuple[List[Dict], float]:
+    """ワーカープロセスで1つの戦略を実行し、チャンクと所要時間(ms)を返す"""
+    
+    from services.chunking import get_chunker
+    
+    start = time.perf_counter()
+    chunks = get_chunker(strategy, size_unit, chunk_size, overlap).chunk_text(content)
+    return chunks, (time.perf_counter() - start) * 1000
+
+
+def summarize_chunks(chunks: List[Dict]) -> Dict:
+    """チャンクサイズの統計を作成"""
+    
+    chunk_sizes = [c["metadata"]["chunk_size"] for c in chunks]
+    return {
+        "chunks_count": len(chunks),
+        "average_size": sum(chunk_sizes) / len(chunk_sizes) if chunk_sizes else 0,
+        "min_size": min(chunk_sizes) if chunk_sizes else 0,
+        "max_size": max(chunk_sizes) if chunk_sizes else 0,
+        "sample_chunks": [c["text"][:200] + "..." for c in chunks[:3]]
+    }
+
+
+class LocalIndex:
+    """評価用の一時的なインメモリベクトルインデックス（コサイン類似度）
+    
+    quantization に int8 / binary を指定した場合は量子化したベクトルで候補を
+    top_k × rescore_factor 件取り、元のfloatベクトルで再スコアして上位を返す。
+    floatベクトルは rescore_path を指定するとメモリではなくファイル（memmap）に置き、
+    候補の行だけを読み込む。rescore_factor=0 の場合は再スコアせず、floatベクトルも保持しない。
+    """
+    
+    def __init__(
+        self,
+        embeddings: List[List[float]],
+        quantization: Quantization = "none",
+        rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+        rescore_path: Optional[str] = None
+    ):
+        matrix = normalize_rows(embeddings)
+        self.count, self.dimensions = matrix.shape
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor if quantization != "none" else 0
+        self.matrix = matrix if quantization == "none" else None
+        self.rescore_matrix = None
+        
+        if quantization == "int8":
+            self.ranges = calibrate_int8(matrix)
+            self.codes = quantize_int8(matrix, self.ranges)
+        elif quantization == "binary":
+            self.codes = pack_binary_codes(matrix)
+        elif quantization != "none":
+            raise ValueError(f"Unknown quantization: {quantization}")
+        
+        if self.rescore_factor:
+            if rescore_path:
+                self.rescore_matrix = np.lib.format.open_memmap(rescore_path, mode="w+", dtype=np.float32, shape=matrix.shape)
+                self.rescore_matrix[:] = matrix
+                self.rescore_matrix.flush()
+            else:
+                self.rescore_matrix = matrix
+    
+    @property
+    def memory_bytes(self) -> int:
+        """検索で走査するインデックスのサイズ（再スコア用のfloatベクトルを除く）"""
+        return quantized_size(self.count, self.dimensions, self.quantization)
+    
+    def search(self, query_embeddings: List[List[float]], top_k: int) -> np.ndarray:
+        """各クエリの上位top_k件のインデックスを類似度順に返す"""
+        
+        queries = normalize_rows(query_embeddings)
+        if self.quantization == "none":
+            return top_k_indices(queries @ self.matrix.T, top_k)
+        
+        # 1. 量子化したベクトルで候補を取得
+        candidates = top_k * self.rescore_factor if self.rescore_factor else top_k
+        if self.quantization == "int8":
+            coarse = int8_scores(queries, self.codes, self.ranges)
+        else:
+            coarse = -hamming_distances(quantize_binary(queries), self.codes).astype(np.float32)
+        ranked = top_k_indices(coarse, candidates)
+        if not self.rescore_factor:
+            return ranked
+        
+        # 2. 候補だけをfloatベクトルで再スコア（memmapの読み込みが連続になるよう行番号順に取得）
+        rescored = []
+        for query, rows in zip(queries, ranked):
+            rows = np.sort(rows)
+            scores = self.rescore_matrix[rows] @ query
+            rescored.append(rows[top_k_indices(scores[None, :], top_k)[0]])
+        return np.asarray(rescored)
+
+
+def embedding_profile_report(
+    doc_embeddings: List[List[float]],
+    query_embeddings: List[List[float]],
+    dimensions: Optional[List[int]] = None,
+    quantizations: Tuple[Quantization, ...] = ("none", "int8", "binary"),
+    top_k: int = 10,
+    rescore_factor: int = DEFAULT_RESCORE_FACTOR
+) -> List[Dict]:
+    """次元数と量子化の組み合わせごとに、recall@k・インデックスサイズ・検索時間を計測
+    
+    recall@k は元の次元のfloatベクトルでの上位top_k件を正解とした割合。
+    次元の削減は先頭の次元を残して再正規化する（APIの dimensions 指定と同じ結果）。
+    """
+    
+    docs = normalize_rows(doc_embeddings)
+    queries = normalize_rows(query_embeddings)
+    full_dimensions = docs.shape[1]
+    truth = LocalIndex(docs).search(queries, top_k)
+    baseline_bytes = quantized_size(len(docs), full_dimensions, "none")
+    
+    report = []
+    for dims in dimensions or [full_dimensions]:
+        reduced_docs = truncate_dimensions(docs, dims)
+        reduced_queries = truncate_dimensions(queries, dims)
+        for quantization in quantizations:
+            for factor in ([0] if quantization == "none" else [0, rescore_factor]):
+                index = LocalIndex(reduced_docs, quantization, factor)
+                start = time.perf_counter()
+                ranked = index.search(reduced_queries, top_k)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                
+                hits = sum(len(set(row) & set(expected)) for row, expected in zip(ranked.tolist(), truth.tolist()))
+                report.append({
+                    "dimensions": dims,
+                    "quantization": quantization,
+                    "rescore_factor": factor,
+                    "recall_at_k": hits / (len(queries) * min(top_k, len(docs))),
+                    "bytes_per_vector": index.memory_bytes / len(docs),
+                    "index_mb": round(index.memory_bytes / (1024 * 1024), 3),
+                    "compression": round(baseline_bytes / index.memory_bytes, 2),
+                    "query_ms": round(elapsed_ms / len(queries), 4)
+                })
+    return report
+
+
+def score_retrieval(
+    chunks: List[Dict],
+    chunk_embeddings: List[List[float]],
+    queries: List[Dict],
+    query_embeddings: List[List[float]],
+    top_k: int = 5
+) -> Dict:
+    """クエリごとに期待テキストを含むチャンクが上位に来るかを評価
+    
+    queries の各要素は {"query": str, "expected": str}。期待テキストを含む
+    チャンクが上位top_k件に入ればヒットとし、recall@k と MRR を返す。
+    """
+    
+    if not chunks or not queries:
+        return {"recall_at_k": 0.0, "mrr": 0.0, "queries": len(queries)}
+    
+    profile = get_embedding_profile()
+    index = LocalIndex(chunk_embeddings, profile["quantization"], profile["rescore_factor"])
+    ranked = index.search(query_embeddings, top_k)
+    texts = [_normalize(c["text"]) for c in chunks]
+    
+    hits = 0
+    reciprocal_ranks = 0.0
+    for query, row in zip(queries, ranked):
+        expected = _normalize(query["expected"])
+        for rank, chunk_index in enumerate(row, start=1):
+            if expected in texts[chunk_index]:
+                hits += 1
+                reciprocal_ranks += 1 / rank
+                break
+    
+    return {
+        "recall_at_k": hits / len(queries),
+        "mrr": reciprocal_ranks / len(queries),
+        "queries": len(queries)
+    }
+
+
+def _normalize(text: str) -> str:
+    """比較用に空白を正規化"""
+    return " ".join(text.split()).lower()
+
+
+async def compare_strategies(
+    content: str,
+    strategies: Optional[List[str]] = None,
+    size_unit: str = "chars",
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    queries: Optional[List[Dict]] = None,
+    top_k: int = 5
+) -> Dict:
+    """複数のチャンク分割戦略を並列に実行して比較
+    
+    queries を指定した場合は、戦略ごとに一時的なローカルインデックスを作成して
+    検索品質（recall@k, MRR）と1msあたりのrecallも計測する。
+    """
+    
+    strategies = strategies or STRATEGIES
+    loop = asyncio.get_running_loop()
+    
+    async def run_strategies() -> List[Tuple[List[Dict], float]]:
+        executor = start_executor()
+        try:
+            return await asyncio.gather(*[
+                loop.run_in_executor(executor, _run_strategy, strategy, content, size_unit, chunk_size, overlap)
+                for strategy in strategies
+            ])
+        except BrokenProcessPool:
+            # ワーカーが強制終了された（OOMなど）プールは使えないため作り直す
+            shutdown_executor(executor)
+            raise
+    
+    # 1. 各戦略をワーカープールで並列に実行（プールが壊れていた場合は作り直して1回だけやり直す）
+    try:
+        outcomes = await run_strategies()
+    except BrokenProcessPool:
+        outcomes = await run_strategies()
+    
+    results = {}
+    for strategy, (chunks, elapsed_ms) in zip(strategies, outcomes):
+        results[strategy] = {
+            **summarize_chunks(chunks),
+            "elapsed_ms": round(elapsed_ms, 2)
+        }
+    
+    if not queries:
+        return results
+    
+    # 2. 検索品質の評価（クエリのベクトル化は全戦略で共有）
+    from services.chunking import embed_texts
+    
+    query_embeddings = await embed_texts([q["query"] for q in queries])
+    
+    async def evaluate(strategy: str, chunks: List[Dict], elapsed_ms: float) -> None:
+        start = time.perf_counter()
+        chunk_embeddings = await embed_texts([c["text"] for c in chunks]) if chunks else []
+        retrieval = score_retrieval(chunks, chunk_embeddings, queries, query_embeddings, top_k)
+        eval_ms = (time.perf_counter() - start) * 1000
+        total_ms = elapsed_ms + eval_ms
+        
+        results[strategy]["retrieval"] = {
+            **retrieval,
+            "eval_ms": round(eval_ms, 2),
+            "recall_per_ms": retrieval["recall_at_k"] / total_ms if total_ms > 0 else 0.0
+        }
+    
+    await asyncio.gather(*[
+        evaluate(strategy, chunks, elapsed_ms)
+        for strategy, (chunks, elapsed_ms) in zip(strategies, outcomes)
+    ])
+    
+    return results
\ No newline at end of file
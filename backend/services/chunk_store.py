@@ -0,0 +1,212 @@
+from typing import List, Dict, Iterable, Tuple
+from sqlalchemy import select, delete, update, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from models import Chunk, ChunkReference
+
+
+def save_chunks(rows: List[Dict]) -> None:
+    """チャンク本文をベクトルID単位でupsert（再インデックス時は上書き）"""
+    
+    from database import SessionLocal
+    
+    if not rows:
+        return
+    stmt = insert(Chunk).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Chunk.id],
+        set_={
+            "document_id": stmt.excluded.document_id,
+            "chunk_index": stmt.excluded.chunk_index,
+            "text": stmt.excluded.text,
+            "extra_metadata": stmt.excluded.extra_metadata,
+            "minhash": stmt.excluded.minhash,
+            "lsh_bands": stmt.excluded.lsh_bands
+        }
+    )
+    with SessionLocal() as db:
+        db.execute(stmt)
+        db.commit()
+
+
+def fetch_chunk_texts(vector_ids: Iterable[str]) -> Dict[str, str]:
+    """検索結果のベクトルIDに対応するチャンク本文を1回のクエリで取得"""
+    
+    from database import SessionLocal
+    
+    vector_ids = list(dict.fromkeys(vector_ids))
+    if not vector_ids:
+        return {}
+    with SessionLocal() as db:
+        rows = db.execute(select(Chunk.id, Chunk.text).where(Chunk.id.in_(vector_ids)))
+        return {row.id: row.text for row in rows}
+
+
+def delete_chunks(document_id: str, keep_chunks: int = 0) -> int:
+    """ドキュメントのチャンク本文を削除（keep_chunksを指定した場合はそれ以降のチャンクのみ）"""
+    
+    from database import SessionLocal
+    
+    stmt = delete(Chunk).where(Chunk.document_id == document_id)
+    references = delete(ChunkReference).where(ChunkReference.document_id == document_id)
+    if keep_chunks:
+        stmt = stmt.where(Chunk.chunk_index >= keep_chunks)
+        references = references.where(ChunkReference.chunk_index >= keep_chunks)
+    with SessionLocal() as db:
+        deleted = db.execute(stmt).rowcount
+        db.execute(references)
+        db.commit()
+    return deleted
+
+
+def delete_chunk_rows(vector_ids: List[str]) -> List[str]:
+    """指定したベクトルIDのチャンク本文を削除し、実際に削除したIDを返す"""
+    
+    from database import SessionLocal
+    
+    if not vector_ids:
+        return []
+    with SessionLocal() as db:
+        deleted = list(db.execute(delete(Chunk).where(Chunk.id.in_(vector_ids)).returning(Chunk.id)).scalars())
+        db.commit()
+    return deleted
+
+
+def find_candidate_chunks(band_keys: Iterable[int], exclude_document_id: str) -> List[Tuple[str, bytes, List[int]]]:
+    """LSHのバンドのハッシュが1つでも一致するチャンク（id, minhash, lsh_bands）を取得"""
+    
+    from database import SessionLocal
+    
+    band_keys = sorted(set(int(key) for key in band_keys))
+    if not band_keys:
+        return []
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(Chunk.id, Chunk.minhash, Chunk.lsh_bands)
+            .where(Chunk.lsh_bands.overlap(band_keys))
+            .where(Chunk.document_id != exclude_document_id)
+        )
+        return [(row.id, row.minhash, row.lsh_bands) for row in rows]
+
+
+def save_chunk_references(rows: List[Dict]) -> None:
+    """重複のため既存のチャンクを共有するチャンクを保存（再インデックス時は上書き）"""
+    
+    from database import SessionLocal
+    
+    if not rows:
+        return
+    stmt = insert(ChunkReference).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ChunkReference.document_id, ChunkReference.chunk_index],
+        set_={
+            "chunk_id": stmt.excluded.chunk_id,
+            "vector_metadata": stmt.excluded.vector_metadata,
+            "extra_metadata": stmt.excluded.extra_metadata
+        }
+    )
+    with SessionLocal() as db:
+        db.execute(stmt)
+        db.commit()
+
+
+def delete_chunk_references(document_id: str, keep_chunks: int = 0) -> List[str]:
+    """ドキュメントが共有しているチャンクへの参照を削除し、参照していたチャンクのIDを返す
+    
+    keep_chunks を指定した場合はそれ以降のチャンクの参照のみ削除する。
+    """
+    
+    from database import SessionLocal
+    
+    stmt = delete(ChunkReference).where(ChunkReference.document_id == document_id)
+    if keep_chunks:
+        stmt = stmt.where(ChunkReference.chunk_index >= keep_chunks)
+    with SessionLocal() as db:
+        chunk_ids = list(db.execute(stmt.returning(ChunkReference.chunk_id)).scalars())
+        db.commit()
+    return list(dict.fromkeys(chunk_ids))
+
+
+def fetch_chunk_document_ids(chunk_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """チャンクごとに、保存しているドキュメントと共有しているドキュメントのIDを取得（保存元が先頭）"""
+    
+    from database import SessionLocal
+    
+    chunk_ids = list(dict.fromkeys(chunk_ids))
+    if not chunk_ids:
+        return {}
+    with SessionLocal() as db:
+        document_ids = {
+            row.id: [row.document_id]
+            for row in db.execute(select(Chunk.id, Chunk.document_id).where(Chunk.id.in_(chunk_ids)))
+        }
+        references = db.execute(
+            select(ChunkReference.chunk_id, ChunkReference.document_id)
+            .where(ChunkReference.chunk_id.in_(list(document_ids)))
+            .order_by(ChunkReference.document_id)
+        )
+        for row in references:
+            if row.document_id not in document_ids[row.chunk_id]:
+                document_ids[row.chunk_id].append(row.document_id)
+    return document_ids
+
+
+def fetch_chunk_references(chunk_ids: Iterable[str], document_ids: Iterable[str]) -> Dict[str, Dict]:
+    """指定したドキュメントからの共有チャンクへの参照を、チャンクIDごとに1件（ベクトルのメタデータ）取得"""
+    
+    from database import SessionLocal
+    
+    chunk_ids, document_ids = list(dict.fromkeys(chunk_ids)), list(dict.fromkeys(document_ids))
+    if not chunk_ids or not document_ids:
+        return {}
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(ChunkReference.chunk_id, ChunkReference.vector_metadata)
+            .where(ChunkReference.chunk_id.in_(chunk_ids))
+            .where(ChunkReference.document_id.in_(document_ids))
+            .order_by(ChunkReference.document_id, ChunkReference.chunk_index)
+        )
+        references = {}
+        for row in rows:
+            references.setdefault(row.chunk_id, row.vector_metadata)
+    return references
+
+
+def fetch_shared_chunks(document_id: str, keep_chunks: int = 0) -> List[Dict]:
+    """ドキュメントのチャンクのうち他のドキュメントが共有しているものを、参照ごとに取得"""
+    
+    from database import SessionLocal
+    
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(
+                ChunkReference.document_id,
+                ChunkReference.chunk_index,
+                ChunkReference.chunk_id,
+                ChunkReference.vector_metadata,
+                ChunkReference.extra_metadata,
+                Chunk.text,
+                Chunk.minhash,
+                Chunk.lsh_bands
+            )
+            .join(Chunk, Chunk.id == ChunkReference.chunk_id)
+            .where(Chunk.document_id == document_id)
+            .where(Chunk.chunk_index >= keep_chunks)
+            .where(ChunkReference.document_id != document_id)
+            .order_by(ChunkReference.chunk_id, ChunkReference.document_id, ChunkReference.chunk_index)
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+def move_chunk_references(moves: Dict[str, str], promoted: List[Tuple[str, int]]) -> None:
+    """共有チャンクの移動を反映（移動先になった参照は削除し、残りの参照は移動先を指すようにする）"""
+    
+    from database import SessionLocal
+    
+    with SessionLocal() as db:
+        if promoted:
+            db.execute(delete(ChunkReference).where(
+                tuple_(ChunkReference.document_id, ChunkReference.chunk_index).in_(promoted)
+            ))
+        for old_id, new_id in moves.items():
+            db.execute(update(ChunkReference).where(ChunkReference.chunk_id == old_id).values(chunk_id=new_id))
+        db.commit()
\ No newline at end of file
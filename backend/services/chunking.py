@@ -1,26 +1,211 @@
-import os
 import re
-from typing import List, Dict, Literal
-from openai import OpenAI
-from pinecone import Pinecone
-from langchain_text_splitters import (
-    RecursiveCharacterTextSplitter,
-    MarkdownHeaderTextSplitter,
+import time
+import asyncio
+from functools import lru_cache, partial
+from typing import List, Dict, Literal, Optional, Iterable, Iterator, Tuple, Callable, Union, TYPE_CHECKING
+from services.clients import get_openai_client, get_index
+from services.chunk_store import (
+    save_chunks, delete_chunks, delete_chunk_rows, save_chunk_references, delete_chunk_references,
+    fetch_shared_chunks, move_chunk_references, fetch_chunk_document_ids
 )
+from services.chunk_dedup import CHUNK_DEDUP_ENABLED, ChunkDeduplicator
+from services.embeddings import embedding_params
+from services.upstream import call_upstream
+from metrics import STAGE_LATENCY, CHUNK_DEDUP, stage_timer, record_token_usage, register_cache
 
-# クライアント初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index(os.getenv("PINECONE_INDEX_NAME"))
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 ChunkStrategy = Literal["fixed", "markdown", "semantic", "hybrid"]
+SizeUnit = Literal["chars", "tokens"]
+
+# 戦略ごとのデフォルトサイズ（chunk_size, overlap）
+DEFAULT_CHAR_SIZES = {
+    "fixed": (500, 50),
+    "markdown": (600, 100),
+    "semantic": (600, 0),
+    "hybrid": (600, 100),
+}
+DEFAULT_TOKEN_SIZES = {
+    "fixed": (256, 32),
+    "markdown": (256, 48),
+    "semantic": (256, 0),
+    "hybrid": (256, 48),
+}
+
+# Markdownヘッダー/コードフェンス/段落区切り
+# 見出しは3つまでの空白でインデントできる（4つ以上はインデントされたコードブロック）
+# 閉じの '#' は空白の後にあるものだけを除く（"# C#" の見出しは "C#" のまま）
+HEADER_PATTERN = re.compile(r"^ {0,3}(#{1,3})\s+(.+?)(?:\s+#+)?\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+PARAGRAPH_PATTERN = re.compile(r"\n\n+")
+
+SEPARATORS = ["\n\n", "\n", "。", "、", " ", ""]
+
+# ストリーミング時に1セクションとして保持する最大文字数
+STREAM_BUFFER_CHARS = 64 * 1024
+
+# 1回のEmbedding API呼び出しでまとめるチャンク数
+EMBEDDING_BATCH_SIZE = 100
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name: str = "cl100k_base"):
+    """tiktokenエンコーダーを取得（キャッシュ済み）"""
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """テキストのトークン数を計算"""
+    return len(get_encoder(encoding_name).encode(text, disallowed_special=()))
+
+
+def _length_function(size_unit: SizeUnit, encoding_name: str) -> Callable[[str], int]:
+    """サイズ単位に応じた長さ関数を取得"""
+    if size_unit == "tokens":
+        return partial(count_tokens, encoding_name=encoding_name)
+    return len
+
+
+@lru_cache(maxsize=64)
+def _get_text_splitter(
+    chunk_size: int,
+    overlap: int,
+    size_unit: SizeUnit,
+    encoding_name: str
+) -> "RecursiveCharacterTextSplitter":
+    """設定ごとに1つだけRecursiveCharacterTextSplitterを作成して再利用"""
+    # LangChainの読み込みは重いため、実際に分割するときまで遅らせる
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=overlap,
+        length_function=_length_function(size_unit, encoding_name),
+        separators=SEPARATORS
+    )
+
+
+@lru_cache(maxsize=64)
+def get_chunker(
+    strategy: ChunkStrategy = "markdown",
+    size_unit: SizeUnit = "chars",
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None
+) -> "DocumentChunker":
+    """設定ごとにキャッシュされたDocumentChunkerを取得（インスタンスは状態を持たない）"""
+    return DocumentChunker(
+        strategy=strategy,
+        size_unit=size_unit,
+        chunk_size=chunk_size,
+        overlap=overlap
+    )
+
+
+register_cache("tiktoken_encoder", get_encoder)
+register_cache("text_splitter", _get_text_splitter)
+register_cache("chunker", get_chunker)
+
+
+def iter_markdown_sections(blocks: Iterable[str]) -> Iterator[Tuple[Dict[str, str], List[str]]]:
+    """行/ブロックのイテラブルをMarkdownセクション（ヘッダー情報, 本文の行）に分割
+    
+    LangChainのDocumentを経由しない純Pythonの実装。h1〜h3で区切り、
+    コードブロック内の '#' はヘッダーとして扱わない。
+    """
+    
+    headers: Dict[str, str] = {}
+    lines: List[str] = []
+    buffered = 0
+    in_code_block = False
+    
+    for block in blocks:
+        # 空文字列の要素は空行として扱う
+        for line in block.splitlines() or [""]:
+            if FENCE_PATTERN.match(line):
+                in_code_block = not in_code_block
+            match = None if in_code_block else HEADER_PATTERN.match(line)
+            
+            if match:
+                # ヘッダーが来たら直前のセクションを確定
+                if lines:
+                    yield headers, lines
+                lines, buffered = [], 0
+                
+                level = len(match.group(1))
+                headers = {k: v for k, v in headers.items() if int(k[1]) < level}
+                headers[f"h{level}"] = match.group(2)
+                continue
+            
+            lines.append(line)
+            buffered += len(line) + 1
+            
+            # 長すぎるセクションは段落境界で先に確定してメモリを抑える
+            if buffered > STREAM_BUFFER_CHARS:
+                cut = _last_paragraph_break(lines)
+                yield headers, lines[:cut]
+                lines = lines[cut:]
+                buffered = sum(len(l) + 1 for l in lines)
+    
+    if lines:
+        yield headers, lines
+
+
+def _last_paragraph_break(lines: List[str]) -> int:
+    """最後の空行の直後の位置を返す（空行がなければ全行）"""
+    
+    for i in range(len(lines) - 1, 0, -1):
+        if not lines[i].strip():
+            return i + 1
+    return len(lines)
 
 
 class DocumentChunker:
     """ドキュメントチャンク分割クラス"""
     
-    def __init__(self, strategy: ChunkStrategy = "markdown"):
+    def __init__(
+        self,
+        strategy: ChunkStrategy = "markdown",
+        size_unit: SizeUnit = "chars",
+        chunk_size: Optional[int] = None,
+        overlap: Optional[int] = None,
+        encoding_name: str = "cl100k_base"
+    ):
+        """
+        Args:
+            strategy: チャンク分割戦略
+            size_unit: サイズの単位（'chars' or 'tokens'）
+            chunk_size: チャンクサイズ（省略時は戦略ごとのデフォルト）
+            overlap: チャンク間のオーバーラップ（省略時は戦略ごとのデフォルト）
+            encoding_name: size_unit='tokens' の場合のtiktokenエンコーディング
+        """
+        if size_unit not in ("chars", "tokens"):
+            raise ValueError(f"Unknown size unit: {size_unit}")
+        
         self.strategy = strategy
+        self.size_unit = size_unit
+        self.encoding_name = encoding_name
+        
+        defaults = DEFAULT_TOKEN_SIZES if size_unit == "tokens" else DEFAULT_CHAR_SIZES
+        default_size, default_overlap = defaults.get(strategy, defaults["markdown"])
+        self.chunk_size = chunk_size if chunk_size is not None else default_size
+        self.overlap = overlap if overlap is not None else default_overlap
+        if self.chunk_size <= 0 or not 0 <= self.overlap < self.chunk_size:
+            raise ValueError(f"Invalid chunk_size/overlap: {self.chunk_size}/{self.overlap}")
+        # このサイズを超えるMarkdownセクションは再分割する
+        self.max_section_size = self.chunk_size + self.chunk_size // 3
+        
+        # 分割器は設定ごとに共有する
+        self._length = _length_function(size_unit, encoding_name)
+        self._splitter = _get_text_splitter(self.chunk_size, self.overlap, size_unit, encoding_name)
+    
+    def _size_metadata(self, text: str) -> Dict:
+        """チャンクサイズのメタデータを作成"""
+        size = self._length(text)
+        metadata = {"chunk_size": size}
+        if self.size_unit == "tokens":
+            metadata["token_count"] = size
+        return metadata
     
     def chunk_text(self, content: str) -> List[Dict[str, any]]:
         """選択された戦略でテキストを分割"""
@@ -36,23 +221,51 @@ class DocumentChunker:
         else:
             raise ValueError(f"Unknown strategy: {self.strategy}")
     
+    def iter_chunks(self, blocks: Iterable[str]) -> Iterator[Dict[str, any]]:
+        """行またはブロックのイテラブルから逐次チャンクを生成
+        
+        ドキュメント全体をメモリに載せず、Markdownヘッダーの文脈を保持したまま
+        セクションが確定するたびにチャンクを返す。各要素は1行以上の完全な行とする。
+        """
+        
+        if self.strategy not in ("fixed", "markdown", "semantic", "hybrid"):
+            raise ValueError(f"Unknown strategy: {self.strategy}")
+        
+        for headers, lines in iter_markdown_sections(blocks):
+            yield from self._flush_section(lines, headers)
+    
+    def _flush_section(self, lines: List[str], headers: Dict[str, str]) -> List[Dict[str, any]]:
+        """ストリーミング中に確定した1セクションを戦略に従って分割"""
+        
+        section = "\n".join(lines).strip()
+        if not section:
+            return []
+        
+        if self.strategy == "fixed":
+            chunks = self._fixed_length_chunking(section)
+        elif self.strategy == "semantic":
+            chunks = self._semantic_chunking(section)
+        else:
+            chunks = self._section_chunks(section, dict(headers))
+            if self.strategy == "hybrid":
+                chunks = self._hybridize(chunks)
+            return chunks
+        
+        for chunk in chunks:
+            chunk["metadata"]["headers"] = dict(headers)
+        return chunks
+    
     def _fixed_length_chunking(self, content: str) -> List[Dict[str, any]]:
         """固定長チャンク分割（シンプル）"""
         
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
-            separators=["\n\n", "\n", "。", "、", " ", ""]
-        )
-        
-        chunks = splitter.split_text(content)
+        chunks = self._splitter.split_text(content)
         
         return [
             {
                 "text": chunk,
                 "metadata": {
                     "strategy": "fixed",
-                    "chunk_size": len(chunk)
+                    **self._size_metadata(chunk)
                 }
             }
             for chunk in chunks
@@ -62,84 +275,64 @@ class DocumentChunker:
         """Markdown構造ベースのチャンク分割"""
         
         # Markdownヘッダーで分割
-        headers_to_split_on = [
-            ("#", "h1"),
-            ("##", "h2"),
-            ("###", "h3"),
-        ]
+        result_chunks = []
+        for headers, lines in iter_markdown_sections([content]):
+            section = "\n".join(lines).strip()
+            if section:
+                result_chunks.extend(self._section_chunks(section, dict(headers)))
         
-        markdown_splitter = MarkdownHeaderTextSplitter(
-            headers_to_split_on=headers_to_split_on
-        )
+        return result_chunks if result_chunks else self._fixed_length_chunking(content)
+    
+    def _section_chunks(self, chunk_text: str, metadata: Dict) -> List[Dict[str, any]]:
+        """1つのMarkdownセクションをヘッダー情報付きのチャンクに変換"""
         
-        # まずヘッダーで分割
-        md_chunks = markdown_splitter.split_text(content)
+        # ヘッダー情報を取得
+        headers = []
+        if "h1" in metadata:
+            headers.append(f"# {metadata['h1']}")
+        if "h2" in metadata:
+            headers.append(f"## {metadata['h2']}")
+        if "h3" in metadata:
+            headers.append(f"### {metadata['h3']}")
+        
+        # 各セクションが長い場合は再分割
+        if self._length(chunk_text) > self.max_section_size:
+            sub_chunks = self._splitter.split_text(chunk_text)
+        else:
+            sub_chunks = [chunk_text]
         
         result_chunks = []
-        for md_chunk in md_chunks:
-            chunk_text = md_chunk.page_content
-            metadata = md_chunk.metadata
-            
-            # ヘッダー情報を取得
-            headers = []
-            if "h1" in metadata:
-                headers.append(f"# {metadata['h1']}")
-            if "h2" in metadata:
-                headers.append(f"## {metadata['h2']}")
-            if "h3" in metadata:
-                headers.append(f"### {metadata['h3']}")
-            
-            # 各セクションが長い場合は再分割
-            if len(chunk_text) > 800:
-                sub_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=600,
-                    chunk_overlap=100,
-                    separators=["\n\n", "\n", "。", "、", " ", ""]
-                )
-                sub_chunks = sub_splitter.split_text(chunk_text)
-                
-                for sub_chunk in sub_chunks:
-                    # ヘッダー情報を含める
-                    full_text = "\n".join(headers) + "\n\n" + sub_chunk if headers else sub_chunk
-                    result_chunks.append({
-                        "text": full_text,
-                        "metadata": {
-                            "strategy": "markdown",
-                            "headers": metadata,
-                            "chunk_size": len(full_text)
-                        }
-                    })
-            else:
-                # ヘッダー情報を含める
-                full_text = "\n".join(headers) + "\n\n" + chunk_text if headers else chunk_text
-                result_chunks.append({
-                    "text": full_text,
-                    "metadata": {
-                        "strategy": "markdown",
-                        "headers": metadata,
-                        "chunk_size": len(full_text)
-                    }
-                })
+        for sub_chunk in sub_chunks:
+            # ヘッダー情報を含める
+            full_text = "\n".join(headers) + "\n\n" + sub_chunk if headers else sub_chunk
+            result_chunks.append({
+                "text": full_text,
+                "metadata": {
+                    "strategy": "markdown",
+                    "headers": metadata,
+                    **self._size_metadata(full_text)
+                }
+            })
         
-        return result_chunks if result_chunks else self._fixed_length_chunking(content)
+        return result_chunks
     
     def _semantic_chunking(self, content: str) -> List[Dict[str, any]]:
         """セマンティックチャンク分割（意味的なまとまりで分割）"""
         
         # 段落で分割
-        paragraphs = re.split(r'\n\n+', content)
+        paragraphs = PARAGRAPH_PATTERN.split(content)
         
         chunks = []
         current_chunk = []
         current_length = 0
-        max_chunk_size = 600
+        max_chunk_size = self.chunk_size
         
         for para in paragraphs:
             para = para.strip()
             if not para:
                 continue
             
-            para_length = len(para)
+            para_length = self._length(para)
             
             # 現在のチャンクに追加できるか判定
             if current_length + para_length < max_chunk_size:
@@ -148,14 +341,7 @@ class DocumentChunker:
             else:
                 # 現在のチャンクを確定
                 if current_chunk:
-                    chunks.append({
-                        "text": "\n\n".join(current_chunk),
-                        "metadata": {
-                            "strategy": "semantic",
-                            "paragraphs": len(current_chunk),
-                            "chunk_size": current_length
-                        }
-                    })
+                    chunks.append(self._semantic_chunk(current_chunk, current_length))
                 
                 # 新しいチャンク開始
                 current_chunk = [para]
@@ -163,27 +349,35 @@ class DocumentChunker:
         
         # 最後のチャンク
         if current_chunk:
-            chunks.append({
-                "text": "\n\n".join(current_chunk),
-                "metadata": {
-                    "strategy": "semantic",
-                    "paragraphs": len(current_chunk),
-                    "chunk_size": current_length
-                }
-            })
+            chunks.append(self._semantic_chunk(current_chunk, current_length))
         
         return chunks if chunks else self._fixed_length_chunking(content)
     
+    def _semantic_chunk(self, paragraphs: List[str], length: int) -> Dict[str, any]:
+        """段落のリストからセマンティックチャンクを作成"""
+        
+        metadata = {
+            "strategy": "semantic",
+            "paragraphs": len(paragraphs),
+            "chunk_size": length
+        }
+        if self.size_unit == "tokens":
+            metadata["token_count"] = length
+        
+        return {"text": "\n\n".join(paragraphs), "metadata": metadata}
+    
     def _hybrid_chunking(self, content: str) -> List[Dict[str, any]]:
         """ハイブリッド戦略（Markdown構造 + セマンティック）"""
         
         # まずMarkdown構造で分割
-        md_chunks = self._markdown_structure_chunking(content)
+        return self._hybridize(self._markdown_structure_chunking(content))
+    
+    def _hybridize(self, md_chunks: List[Dict[str, any]]) -> List[Dict[str, any]]:
+        """Markdownチャンクのうち大きすぎるものをセマンティック分割"""
         
-        # 各チャンクが大きすぎる場合はセマンティック分割
         result_chunks = []
         for chunk in md_chunks:
-            if chunk["metadata"]["chunk_size"] > 800:
+            if chunk["metadata"]["chunk_size"] > self.max_section_size:
                 # セマンティック分割を適用
                 semantic_chunks = self._semantic_chunking(chunk["text"])
                 for sc in semantic_chunks:
@@ -197,70 +391,210 @@ class DocumentChunker:
         return result_chunks
 
 
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """テキストのリストをバッチ単位でベクトル化（入力順を保持）"""
+    
+    embeddings = []
+    for batch in _batched(texts, EMBEDDING_BATCH_SIZE):
+        response = await call_upstream(
+            "openai", "embed_batch", get_openai_client().embeddings.create,
+            timeout_arg="timeout",
+            **embedding_params(),
+            input=batch
+        )
+        record_token_usage(embedding_params()["model"], response.usage)
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+    return embeddings
+
+
+def _split_metadata(metadata: Dict) -> Tuple[Dict, Dict]:
+    """チャンクのメタデータを、Pineconeに保存するスカラー値と、チャンクストアに保存する辞書の値に分ける"""
+    
+    scalars, nested = {}, {}
+    for key, value in metadata.items():
+        (nested if isinstance(value, dict) else scalars)[key] = value
+    return scalars, nested
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    """イテラブルを指定サイズのリストに分割"""
+    
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 async def chunk_and_embed(
     document_id: str,
     title: str,
-    content: str,
-    strategy: ChunkStrategy = "markdown"
+    content: Union[str, Iterable[str]],
+    strategy: ChunkStrategy = "markdown",
+    size_unit: SizeUnit = "chars",
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None
 ) -> Dict:
-    """ドキュメントをチャンクに分割し、ベクトル化してPineconeに保存"""
+    """ドキュメントをチャンクに分割し、ベクトル化してPineconeに保存
+    
+    contentに行/ブロックのイテラブルを渡した場合は、チャンク分割と並行して
+    バッチ単位でベクトル化・保存する（total_chunksはメタデータに含めない）。
+    progressを指定した場合はバッチごとに（保存済みチャンク数, 総チャンク数）で呼び出す。
+    既存のチャンクとほぼ同じチャンク（定型文など）はベクトル化せず、既存のチャンクを共有する。
+    """
     
     # 1. チャンク分割
-    chunker = DocumentChunker(strategy=strategy)
-    chunks = chunker.chunk_text(content)
+    chunker = get_chunker(
+        strategy=strategy,
+        size_unit=size_unit,
+        chunk_size=chunk_size,
+        overlap=overlap
+    )
     
-    if not chunks:
-        raise ValueError("No chunks created from document")
+    if isinstance(content, str):
+        # 大きなドキュメントの分割でイベントループを止めないようスレッドで実行
+        with stage_timer("chunk_and_embed", "chunk"):
+            chunks = await asyncio.to_thread(chunker.chunk_text, content)
+        if not chunks:
+            raise ValueError("No chunks created from document")
+        total_chunks = len(chunks)
+    else:
+        chunks = chunker.iter_chunks(content)
+        total_chunks = None
+    
+    deduplicator = None
+    # 参照を追加・削除した共有チャンク（最後にベクトルの document_ids をそろえる）
+    referenced_chunks = []
+    if CHUNK_DEDUP_ENABLED:
+        # 上書きする前に、他のドキュメントが共有しているチャンクをそのドキュメントへ移す
+        with stage_timer("chunk_and_embed", "release_shared"):
+            await release_shared_chunks(document_id)
+        referenced_chunks.extend(await asyncio.to_thread(delete_chunk_references, document_id))
+        deduplicator = ChunkDeduplicator(document_id)
     
-    # 2. 各チャンクをベクトル化
-    vectors = []
-    for i, chunk_data in enumerate(chunks):
-        chunk_text = chunk_data["text"]
-        chunk_metadata = chunk_data["metadata"]
+    chunk_sizes = []
+    deduplicated = 0
+    # イテラブル入力ではチャンク分割がバッチ取得時に行われるため、その時間を合計して記録
+    chunk_seconds = 0.0
+    batches = _batched(chunks, EMBEDDING_BATCH_SIZE)
+    while True:
+        start = time.perf_counter()
+        if total_chunks is None:
+            # イテラブル入力は行の取得（Notionのブロック取得など）とチャンク分割がここで行われるためスレッドで実行
+            batch = await asyncio.to_thread(next, batches, None)
+        else:
+            batch = next(batches, None)
+        chunk_seconds += time.perf_counter() - start
+        if batch is None:
+            break
         
-        # OpenAI Embeddingで埋め込みベクトル作成
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=chunk_text
-        )
-        embedding = response.data[0].embedding
-        
-        # メタデータ統合
-        full_metadata = {
-            "document_id": document_id,
-            "title": title,
-            "chunk_text": chunk_text,
-            "chunk_index": i,
-            "total_chunks": len(chunks),
-            "strategy": strategy,
-            **chunk_metadata
-        }
+        vector_ids = [f"{document_id}_chunk_{len(chunk_sizes) + j}" for j in range(len(batch))]
+        duplicate_of = [None] * len(batch)
+        signatures, band_keys = [None] * len(batch), [None] * len(batch)
+        if deduplicator is not None:
+            with stage_timer("chunk_and_embed", "dedup"):
+                result = await asyncio.to_thread(
+                    deduplicator.match, vector_ids, [chunk_data["text"] for chunk_data in batch]
+                )
+            duplicate_of, signatures, band_keys = result.duplicate_of, result.signatures, result.band_keys
         
-        # メタデータのサイズ制限（Pineconeの制限対策）
-        if len(str(full_metadata)) > 40000:
-            # chunk_textを短縮
-            full_metadata["chunk_text"] = chunk_text[:1000] + "..."
+        # 2. 重複でないチャンクだけをバッチ単位でベクトル化
+        unique = [chunk_data for chunk_data, shared in zip(batch, duplicate_of) if shared is None]
+        with stage_timer("chunk_and_embed", "embed"):
+            embeddings = iter(await embed_texts([chunk_data["text"] for chunk_data in unique]) if unique else [])
         
-        # ベクトル準備
-        vectors.append({
-            "id": f"{document_id}_chunk_{i}",
-            "values": embedding,
-            "metadata": full_metadata
-        })
+        vectors = []
+        rows = []
+        references = []
+        for chunk_data, vector_id, shared, signature, keys in zip(batch, vector_ids, duplicate_of, signatures, band_keys):
+            i = len(chunk_sizes)
+            scalars, nested = _split_metadata(chunk_data["metadata"])
+            
+            # Pineconeにはフィルタ用の小さな値だけを保存し、本文と見出しはチャンクストアに保存
+            # document_ids は共有しているドキュメントを含めたフィルタ用のID
+            full_metadata = {
+                "document_id": document_id,
+                "document_ids": [document_id],
+                "title": title,
+                "chunk_index": i,
+                "strategy": strategy,
+                **scalars
+            }
+            if total_chunks is not None:
+                full_metadata["total_chunks"] = total_chunks
+            chunk_sizes.append(scalars["chunk_size"])
+            
+            if shared is not None:
+                # 共有元が削除された場合にこのドキュメントのベクトルとして保存し直せるよう、メタデータを残す
+                references.append({
+                    "document_id": document_id,
+                    "chunk_index": i,
+                    "chunk_id": shared,
+                    "vector_metadata": full_metadata,
+                    "extra_metadata": nested or None
+                })
+                continue
+            
+            vectors.append({
+                "id": vector_id,
+                "values": next(embeddings),
+                "metadata": full_metadata
+            })
+            rows.append({
+                "id": vector_id,
+                "document_id": document_id,
+                "chunk_index": i,
+                "text": chunk_data["text"],
+                "extra_metadata": nested or None,
+                "minhash": signature,
+                "lsh_bands": keys
+            })
+        
+        # 3. 本文を保存してからPineconeに保存（検索でヒットしたベクトルの本文が必ず取得できるように）
+        #    チャンクストアは同期のセッションを使うため、スレッドで呼び出してイベントループを止めない
+        with stage_timer("chunk_and_embed", "store"):
+            await asyncio.to_thread(save_chunks, rows)
+            await asyncio.to_thread(save_chunk_references, references)
+        if vectors:
+            with stage_timer("chunk_and_embed", "upsert"):
+                # ベクトルIDが決まっているため、再試行しても重複しない
+                await call_upstream("pinecone", "upsert", get_index().upsert, vectors=vectors)
+        if references:
+            # 再インデックスで共有に変わったチャンクの古いベクトルを削除
+            stale = await asyncio.to_thread(
+                delete_chunk_rows, [vector_ids[j] for j, shared in enumerate(duplicate_of) if shared is not None]
+            )
+            if stale:
+                await call_upstream("pinecone", "delete", get_index().delete, ids=stale)
+            deduplicated += len(references)
+            referenced_chunks.extend(reference["chunk_id"] for reference in references)
+            CHUNK_DEDUP.labels("duplicate").inc(len(references))
+        CHUNK_DEDUP.labels("unique").inc(len(vectors))
+        if progress is not None:
+            progress(len(chunk_sizes), total_chunks)
+    
+    if total_chunks is None:
+        STAGE_LATENCY.labels("chunk_and_embed", "chunk").observe(chunk_seconds)
     
-    # 3. Pineconeに保存（バッチ処理）
-    batch_size = 100
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i:i + batch_size]
-        index.upsert(vectors=batch)
+    if not chunk_sizes:
+        raise ValueError("No chunks created from document")
     
-    # 4. 統計情報を返す
-    chunk_sizes = [c["metadata"]["chunk_size"] for c in chunks]
+    # 4. 共有チャンクのベクトルで、このドキュメントでも絞り込めるようにする
+    if referenced_chunks:
+        with stage_timer("chunk_and_embed", "sync_shared"):
+            await sync_shared_document_ids(referenced_chunks)
     
+    # 5. 統計情報を返す
     return {
         "document_id": document_id,
         "strategy": strategy,
-        "chunks_created": len(chunks),
+        "size_unit": size_unit,
+        "chunks_created": len(chunk_sizes),
+        "chunks_deduplicated": deduplicated,
         "average_chunk_size": sum(chunk_sizes) / len(chunk_sizes),
         "min_chunk_size": min(chunk_sizes),
         "max_chunk_size": max(chunk_sizes),
@@ -268,15 +602,99 @@ async def chunk_and_embed(
     }
 
 
-async def delete_document_chunks(document_id: str) -> Dict:
-    """ドキュメントに関連するすべてのチャンクを削除"""
+async def release_shared_chunks(document_id: str, keep_chunks: int = 0) -> int:
+    """ドキュメントのチャンクのうち他のドキュメントが共有しているものを、共有しているドキュメントへ移す
+    
+    ドキュメントの上書き・削除の前に呼ぶ。ベクトルはPineconeから取得して埋め込み直さずに保存し、
+    最初に共有したドキュメントのチャンクとして保存する（残りの参照は移動先を指すようにする）。
+    """
+    
+    shared = await asyncio.to_thread(fetch_shared_chunks, document_id, keep_chunks)
+    if not shared:
+        return 0
+    
+    # 共有チャンクごとに最初の参照を移動先にする
+    owners = {}
+    for reference in shared:
+        owners.setdefault(reference["chunk_id"], reference)
+    
+    fetched = await call_upstream("pinecone", "fetch", get_index().fetch, ids=list(owners))
+    values = {vector_id: list(vector.values) for vector_id, vector in fetched.vectors.items()}
+    # Pineconeにないベクトル（手動で削除された場合など）は本文から埋め込み直す
+    missing = [old_id for old_id in owners if old_id not in values]
+    if missing:
+        values.update(zip(missing, await embed_texts([owners[old_id]["text"] for old_id in missing])))
+    
+    # 移動先のベクトルの document_ids には、残りの参照のドキュメントも含める
+    sharing = {}
+    for reference in shared:
+        sharing.setdefault(reference["chunk_id"], [])
+        if reference["document_id"] not in sharing[reference["chunk_id"]]:
+            sharing[reference["chunk_id"]].append(reference["document_id"])
+    
+    vectors, rows, moves = [], [], {}
+    for old_id, owner in owners.items():
+        new_id = f"{owner['document_id']}_chunk_{owner['chunk_index']}"
+        metadata = {**owner["vector_metadata"], "document_ids": sharing[old_id]}
+        vectors.append({"id": new_id, "values": values[old_id], "metadata": metadata})
+        rows.append({
+            "id": new_id,
+            "document_id": owner["document_id"],
+            "chunk_index": owner["chunk_index"],
+            "text": owner["text"],
+            "extra_metadata": owner["extra_metadata"],
+            "minhash": owner["minhash"],
+            "lsh_bands": owner["lsh_bands"]
+        })
+        moves[old_id] = new_id
+    
+    # 本文とベクトルを保存してから参照を移す（検索でヒットしたベクトルの本文が必ず取得できるように）
+    await asyncio.to_thread(save_chunks, rows)
+    for batch in _batched(vectors, EMBEDDING_BATCH_SIZE):
+        await call_upstream("pinecone", "upsert", get_index().upsert, vectors=batch)
+    await asyncio.to_thread(move_chunk_references, moves, [(row["document_id"], row["chunk_index"]) for row in rows])
+    return len(moves)
+
+
+async def sync_shared_document_ids(chunk_ids: Iterable[str]) -> None:
+    """共有チャンクのベクトルのメタデータ document_ids を、保存元と共有しているドキュメントのIDにそろえる
+    
+    document_ids で絞り込んだ検索で、共有しているドキュメントの定型文もヒットするようにする。
+    """
+    
+    document_ids = await asyncio.to_thread(fetch_chunk_document_ids, chunk_ids)
+    index = get_index()
+    for chunk_id, ids in document_ids.items():
+        await call_upstream("pinecone", "update", index.update, id=chunk_id, set_metadata={"document_ids": ids})
+
+
+async def delete_document_chunks(document_id: str, keep_chunks: int = 0) -> Dict:
+    """ドキュメントに関連するチャンクを削除（keep_chunksを指定した場合はそれ以降のチャンクのみ）"""
+    
+    # 他のドキュメントが共有しているチャンクは削除せずに移す（失敗した場合は削除しない）
+    if CHUNK_DEDUP_ENABLED:
+        await release_shared_chunks(document_id, keep_chunks)
+    
+    metadata_filter = {"document_id": document_id}
+    if keep_chunks:
+        metadata_filter["chunk_index"] = {"$gte": keep_chunks}
     
     # Pineconeから削除
     try:
-        index.delete(filter={"document_id": document_id})
+        await call_upstream("pinecone", "delete", get_index().delete, filter=metadata_filter)
     except Exception as e:
         print(f"Error deleting from Pinecone: {e}")
     
+    # ベクトルを削除した後でチャンク本文を削除
+    try:
+        referenced_chunks = await asyncio.to_thread(delete_chunk_references, document_id, keep_chunks)
+        await asyncio.to_thread(delete_chunks, document_id, keep_chunks)
+        # 共有していたチャンクのベクトルの document_ids からこのドキュメントを除く
+        if referenced_chunks:
+            await sync_shared_document_ids(referenced_chunks)
+    except Exception as e:
+        print(f"Error deleting chunk texts: {e}")
+    
     return {
         "document_id": document_id,
         "message": "Document chunks deleted successfully"
@@ -0,0 +1,78 @@
+import os
+import time
+import importlib
+from functools import lru_cache
+from typing import Dict
+
+# 外部APIクライアントはプロセス内で1つずつ共有し、最初に必要になった時点で作成する
+# （モジュールのimport時にネットワーク処理を行わない）
+
+# 再試行は services.upstream で行うため、SDK側の再試行は設定できる範囲で無効にする
+# （PineconeのREST版データプレーン（Index）はSDK内部の再試行を変更できない）
+# OpenAIの1リクエストのタイムアウト（秒、リクエストの期限が短い場合はそちらを使う）
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+
+# 起動時に読み込んでおく重いモジュール（ルート内で遅延importしているもの）
+WARMUP_MODULES = ["services.search", "services.qa", "services.chunking", "langchain_text_splitters"]
+
+
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """OpenAIクライアントを取得"""
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, timeout=OPENAI_TIMEOUT_SECONDS)
+
+
+@lru_cache(maxsize=1)
+def get_pinecone_client():
+    """Pineconeクライアントを取得"""
+    from pinecone import Pinecone
+    try:
+        from pinecone import RetryConfig
+    except ImportError:
+        # RetryConfigのない古いSDKはそのまま使う
+        return Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    return Pinecone(api_key=os.getenv("PINECONE_API_KEY"), retry_config=RetryConfig(max_retries=0))
+
+
+@lru_cache(maxsize=1)
+def get_index():
+    """Pineconeインデックスを取得
+    
+    PINECONE_INDEX_HOST を指定した場合はそのホストに直接接続する（ホスト解決の通信が不要になる）。
+    未指定の場合は作成時にインデックス名からホストを解決する。
+    """
+    host = os.getenv("PINECONE_INDEX_HOST")
+    if host:
+        return get_pinecone_client().Index(host=host)
+    return get_pinecone_client().Index(os.getenv("PINECONE_INDEX_NAME"))
+
+
+def warmup() -> Dict[str, float]:
+    """起動時にクライアントを作成しておき、最初のリクエストの遅延をなくす
+    
+    失敗してもアプリの起動は止めず、最初に使われた時点で再度作成を試みる。
+    戻り値はクライアントごとの作成時間(ms)。
+    """
+    
+    timings = {}
+    start = time.perf_counter()
+    for module in WARMUP_MODULES:
+        importlib.import_module(module)
+    timings["imports"] = round((time.perf_counter() - start) * 1000, 2)
+    
+    for name, factory in (("openai", get_openai_client), ("pinecone_index", get_index)):
+        start = time.perf_counter()
+        try:
+            factory()
+            timings[name] = round((time.perf_counter() - start) * 1000, 2)
+        except Exception as e:
+            print(f"Failed to warm up {name} client: {e}")
+    return timings
+
+
+def reset_clients() -> None:
+    """作成済みのクライアントを破棄（設定変更時やテスト用）"""
+    get_index.cache_clear()
+    get_pinecone_client.cache_clear()
+    get_openai_client.cache_clear()
\ No newline at end of file
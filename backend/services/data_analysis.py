@@ -1,38 +1,298 @@
 import pandas as pd
 import numpy as np
 import io
+import os
 import base64
-from typing import Dict, List, Optional
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Literal, Optional, Union, Callable
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import json
 
+FileType = Literal["csv", "excel", "parquet", "feather"]
+SheetName = Union[str, int, List[Union[str, int]], None]
+
+# シートごとの分析を並行に行うスレッド数の上限
+SHEET_ANALYSIS_WORKERS = int(os.getenv("SHEET_ANALYSIS_WORKERS", "4"))
+
+# openpyxlのストリーミング読み込みで、一度にDataFrameへ変換する行数（Pythonオブジェクトの保持量を抑える）
+EXCEL_BLOCK_ROWS = 50_000
+
+
+def default_excel_engine() -> str:
+    """python-calamine（Rust製のパーサー）があれば使い、なければopenpyxlのストリーミング読み込み"""
+    
+    try:
+        import python_calamine  # noqa: F401
+        return 'calamine'
+    except ImportError:
+        return 'openpyxl'
+
+
+def _excel_columns(header: tuple) -> List[str]:
+    """ヘッダー行から列名を作成（空のセルは pandas と同じ Unnamed: n）"""
+    
+    columns = []
+    for i, value in enumerate(header):
+        columns.append(f'Unnamed: {i}' if value is None else str(value))
+    return columns
+
+
+def read_excel_streaming(
+    source: io.BytesIO,
+    sheet_name: SheetName = 0,
+    max_rows: Optional[int] = None
+) -> Dict[str, pd.DataFrame]:
+    """openpyxlの読み取り専用モードで行の値だけを順に読み、シートごとのDataFrameを作成
+    
+    セルオブジェクトを作らず（values_only）、EXCEL_BLOCK_ROWS 行ごとにDataFrameへ変換して連結する。
+    max_rows を指定した場合はその行数でシートの読み込みをやめる。
+    """
+    
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        names = workbook.sheetnames
+        if sheet_name is None:
+            selected = names
+        else:
+            selected = sheet_name if isinstance(sheet_name, list) else [sheet_name]
+        
+        frames = {}
+        for sheet in selected:
+            if isinstance(sheet, int):
+                if not 0 <= sheet < len(names):
+                    raise ValueError(f"Worksheet index {sheet} is invalid, {len(names)} worksheets found")
+                sheet = names[sheet]
+            elif sheet not in names:
+                raise ValueError(f"Worksheet named '{sheet}' not found")
+            
+            rows = workbook[sheet].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                frames[sheet] = pd.DataFrame()
+                continue
+            # 書式だけが設定された末尾の空の列を除く
+            width = len(header)
+            while width and header[width - 1] is None:
+                width -= 1
+            columns = _excel_columns(header[:width])
+            if max_rows is not None:
+                rows = islice(rows, max_rows)
+            
+            blocks = []
+            while True:
+                block = [row[:width] for row in islice(rows, EXCEL_BLOCK_ROWS)]
+                if not block:
+                    break
+                blocks.append(pd.DataFrame(block, columns=columns))
+            df = pd.concat(blocks, ignore_index=True) if blocks else pd.DataFrame(columns=columns)
+            # 書式だけが設定された末尾の空の行を除く
+            filled = df.notna().any(axis=1).to_numpy()
+            frames[sheet] = df.iloc[:int(np.flatnonzero(filled)[-1]) + 1 if filled.any() else 0]
+        return frames
+    finally:
+        workbook.close()
+
 
 class DataAnalyzer:
     """データ分析クラス"""
     
-    def __init__(self, file_content: bytes, file_type: str):
+    def __init__(
+        self,
+        file_content: bytes,
+        file_type: FileType,
+        use_arrow: bool = False,
+        optimize_dtypes: bool = False,
+        category_threshold: float = 0.5,
+        sheet_name: SheetName = 0,
+        max_rows: Optional[int] = None,
+        excel_engine: Optional[str] = None
+    ):
         """
         Args:
             file_content: ファイルのバイナリデータ
-            file_type: 'csv' or 'excel'
+            file_type: 'csv', 'excel', 'parquet' or 'feather'
+            use_arrow: pyarrowエンジン + Arrowバックエンドのdtypeで読み込む
+            optimize_dtypes: 低カーディナリティ列のカテゴリ化と数値型のダウンキャスト
+            category_threshold: カテゴリ化するユニーク値の割合の上限
+            sheet_name: Excelのシート（名前・番号・そのリスト、Noneで全シート）
+            max_rows: 先頭からこの行数だけを読み込む（大きなファイルのプレビュー用）
+            excel_engine: 'calamine' or 'openpyxl'（省略時はcalamineがあれば使う）
         """
         self.file_type = file_type
-        self.df = self._load_data(file_content)
+        self.use_arrow = use_arrow
+        self.optimize_dtypes = optimize_dtypes
+        self.category_threshold = category_threshold
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows
+        self.excel_engine = excel_engine or default_excel_engine()
+        
+        # シートごとのDataFrame（Excel以外は1つ）。df は最初のシート
+        self.sheets = self._load_sheets(file_content)
+        # max_rows で読み込みを打ち切ったシート（1行多く読み、残りの行があるかで判定する）
+        self.truncated_sheets = set()
+        if max_rows is not None:
+            self.truncated_sheets = {name for name, df in self.sheets.items() if len(df) > max_rows}
+            self.sheets = {
+                name: df.iloc[:max_rows].copy() if name in self.truncated_sheets else df
+                for name, df in self.sheets.items()
+            }
+        self.truncated = bool(self.truncated_sheets)
+        if optimize_dtypes:
+            self.sheets = {name: self._optimize_dtypes(df) for name, df in self.sheets.items()}
+        self.df = next(iter(self.sheets.values()))
+    
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, **kwargs) -> "DataAnalyzer":
+        """読み込み済みのDataFrameを分析（シートごとの分析用）"""
+        
+        analyzer = cls.__new__(cls)
+        analyzer.file_type = kwargs.get('file_type', 'dataframe')
+        analyzer.use_arrow = kwargs.get('use_arrow', False)
+        analyzer.optimize_dtypes = False
+        analyzer.category_threshold = kwargs.get('category_threshold', 0.5)
+        analyzer.sheet_name = 0
+        analyzer.max_rows = kwargs.get('max_rows')
+        analyzer.excel_engine = None
+        analyzer.sheets = {'data': df}
+        analyzer.df = df
+        # 読み込み時に打ち切ったかは呼び出し側が渡す（DataFrameの行数からは判定できない）
+        analyzer.truncated = kwargs.get('truncated', False)
+        analyzer.truncated_sheets = {'data'} if analyzer.truncated else set()
+        return analyzer
+    
+    @classmethod
+    def from_path(cls, path: str, file_type: str, **kwargs) -> "DataAnalyzer":
+        """ファイルパスから読み込み（Parquet/Featherはメモリマップで読み込む）"""
+        
+        if file_type in ('parquet', 'feather'):
+            import pyarrow as pa
+            
+            # メモリマップしたバッファをゼロコピーで渡す
+            source = pa.memory_map(path, 'r')
+            return cls(source.read_buffer(), file_type, **kwargs)
+        
+        with open(path, 'rb') as f:
+            return cls(f.read(), file_type, **kwargs)
+    
+    @property
+    def _row_limit(self) -> Optional[int]:
+        """読み込む行数（max_rows で打ち切ったかを判定するため1行多く読む）"""
+        return None if self.max_rows is None else self.max_rows + 1
+    
+    def _load_sheets(self, file_content: bytes) -> Dict[str, pd.DataFrame]:
+        """ファイルをシート名ごとのDataFrameとして読み込み"""
+        
+        if self.file_type != 'excel':
+            return {'data': self._load_data(file_content)}
+        
+        if self.excel_engine == 'calamine':
+            frames = pd.read_excel(
+                io.BytesIO(file_content),
+                sheet_name=self.sheet_name,
+                engine='calamine',
+                nrows=self._row_limit
+            )
+            if isinstance(frames, pd.DataFrame):
+                frames = {self.sheet_name: frames}
+            # 数値のシート番号は名前に置き換える（pandasは番号をキーにした辞書を返すため）
+            names = pd.ExcelFile(io.BytesIO(file_content), engine='calamine').sheet_names
+            frames = {names[key] if isinstance(key, int) else key: df for key, df in frames.items()}
+        elif self.excel_engine == 'openpyxl':
+            frames = read_excel_streaming(io.BytesIO(file_content), self.sheet_name, self._row_limit)
+        else:
+            raise ValueError(f"Unsupported Excel engine: {self.excel_engine}")
+        
+        if not frames:
+            raise ValueError("No worksheets selected")
+        if self.use_arrow:
+            frames = {name: df.convert_dtypes(dtype_backend='pyarrow') for name, df in frames.items()}
+        return frames
     
     def _load_data(self, file_content: bytes) -> pd.DataFrame:
-        """ファイルをDataFrameとして読み込み"""
+        """ファイルをDataFrameとして読み込み（Excelは _load_sheets で読み込む）"""
         
         if self.file_type == 'csv':
             # CSVの場合
-            return pd.read_csv(io.BytesIO(file_content))
-        elif self.file_type == 'excel':
-            # Excelの場合
-            return pd.read_excel(io.BytesIO(file_content))
+            if self.use_arrow:
+                # pyarrowエンジンは nrows に対応していないため、読み込み後に切り詰める
+                df = pd.read_csv(
+                    io.BytesIO(file_content),
+                    engine='pyarrow',
+                    dtype_backend='pyarrow'
+                )
+                return df if self._row_limit is None else df.head(self._row_limit)
+            return pd.read_csv(io.BytesIO(file_content), nrows=self._row_limit)
+        elif self.file_type in ('parquet', 'feather'):
+            # Parquet/Featherの場合（バッファをコピーせずにArrowで読み込む）
+            import pyarrow as pa
+            
+            reader = pa.BufferReader(file_content)
+            if self.file_type == 'parquet':
+                import pyarrow.parquet as pq
+                if self._row_limit is None:
+                    table = pq.read_table(reader, memory_map=True)
+                else:
+                    # 先頭のバッチだけをデコードする
+                    batches = pq.ParquetFile(reader).iter_batches(batch_size=min(self._row_limit, 65_536))
+                    table = pa.Table.from_batches(list(self._take_rows(batches, self._row_limit)))
+            else:
+                import pyarrow.feather as feather
+                table = feather.read_table(reader, memory_map=True)
+                if self._row_limit is not None:
+                    table = table.slice(0, self._row_limit)
+            
+            if self.use_arrow:
+                return table.to_pandas(types_mapper=pd.ArrowDtype)
+            return table.to_pandas()
         else:
             raise ValueError(f"Unsupported file type: {self.file_type}")
     
+    @staticmethod
+    def _take_rows(batches, max_rows: int):
+        """RecordBatchを先頭から max_rows 行分だけ取り出す"""
+        
+        remaining = max_rows
+        for batch in batches:
+            if remaining <= 0:
+                break
+            yield batch.slice(0, remaining)
+            remaining -= batch.num_rows
+    
+    def _optimize_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
+        """カテゴリ化と数値型のダウンキャストでメモリ使用量を削減"""
+        
+        categorical_cols = set(self._categorical_columns(df))
+        
+        for col in df.columns:
+            series = df[col]
+            
+            if pd.api.types.is_bool_dtype(series):
+                continue
+            
+            if pd.api.types.is_integer_dtype(series):
+                df[col] = pd.to_numeric(series, downcast='integer')
+            elif pd.api.types.is_float_dtype(series):
+                # 精度が失われない場合のみfloat32に変換
+                downcast = pd.to_numeric(series, downcast='float')
+                if downcast.dtype != series.dtype and downcast.astype(series.dtype).equals(series):
+                    df[col] = downcast
+            elif col in categorical_cols:
+                if len(series) > 0 and series.nunique() / len(series) <= self.category_threshold:
+                    df[col] = series.astype('category')
+        
+        return df
+    
+    @staticmethod
+    def _categorical_columns(df: pd.DataFrame) -> List[str]:
+        """カテゴリ列（object/string/category）の列名を取得"""
+        
+        return df.select_dtypes(include=['object', 'string', 'category']).columns.tolist()
+    
     def get_basic_info(self) -> Dict:
         """基本情報取得"""
         
@@ -42,7 +302,8 @@ class DataAnalyzer:
             "column_names": self.df.columns.tolist(),
             "dtypes": {col: str(dtype) for col, dtype in self.df.dtypes.items()},
             "missing_values": self.df.isnull().sum().to_dict(),
-            "memory_usage": f"{self.df.memory_usage(deep=True).sum() / 1024:.2f} KB"
+            "memory_usage": f"{self.df.memory_usage(deep=True).sum() / 1024:.2f} KB",
+            "truncated": self.truncated
         }
     
     def get_summary_statistics(self) -> Dict:
@@ -57,7 +318,7 @@ class DataAnalyzer:
             numeric_stats = stats_df.to_dict()
         
         # カテゴリ列の統計
-        categorical_cols = self.df.select_dtypes(include=['object']).columns.tolist()
+        categorical_cols = self._categorical_columns(self.df)
         categorical_stats = {}
         
         for col in categorical_cols:
@@ -102,7 +363,7 @@ class DataAnalyzer:
                 visualizations[f'histogram_{col}'] = json.loads(fig.to_json())
         
         # カテゴリ列の棒グラフ
-        categorical_cols = self.df.select_dtypes(include=['object']).columns.tolist()
+        categorical_cols = self._categorical_columns(self.df)
         
         if len(categorical_cols) > 0:
             for col in categorical_cols[:3]:  # 最初の3列のみ
@@ -164,7 +425,7 @@ class DataAnalyzer:
                 })
         
         # カテゴリ列の偏りチェック
-        categorical_cols = self.df.select_dtypes(include=['object']).columns
+        categorical_cols = self._categorical_columns(self.df)
         for col in categorical_cols:
             top_value_count = self.df[col].value_counts().iloc[0]
             pct = (top_value_count / len(self.df)) * 100
@@ -196,13 +457,66 @@ class DataAnalyzer:
             "visualizations": self.create_visualizations(),
             "insights": self.generate_insights()
         }
+    
+    def analyze_sheets(
+        self,
+        max_workers: Optional[int] = None,
+        progress: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Dict]:
+        """読み込んだシートごとに完全分析を並行して実行
+        
+        集計の多くはNumPy/pandasの中でGILを解放するため、スレッドで並行に処理する。
+        plotlyの図の作成はスレッドセーフではないため、集計が終わったシートから順に
+        呼び出し元のスレッドで作成する。
+        progress を指定すると、シートの分析が終わるたびにシート名を渡して呼び出す。
+        """
+        
+        analyzers = {
+            name: DataAnalyzer.from_dataframe(
+                df,
+                file_type=self.file_type,
+                use_arrow=self.use_arrow,
+                category_threshold=self.category_threshold,
+                max_rows=self.max_rows,
+                truncated=name in self.truncated_sheets
+            )
+            for name, df in self.sheets.items()
+        }
+        workers = max(1, min(max_workers or SHEET_ANALYSIS_WORKERS, len(analyzers)))
+        
+        def statistics(analyzer: "DataAnalyzer") -> Dict:
+            return {
+                "basic_info": analyzer.get_basic_info(),
+                "statistics": analyzer.get_summary_statistics(),
+                "preview": analyzer.get_data_preview(),
+                "insights": analyzer.generate_insights()
+            }
+        
+        results = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(statistics, analyzer) for name, analyzer in analyzers.items()}
+            # ブックの順序で待ち、図は他のシートの集計と並行してこのスレッドで作成する
+            for name, future in futures.items():
+                result = future.result()
+                results[name] = {
+                    "basic_info": result["basic_info"],
+                    "statistics": result["statistics"],
+                    "preview": result["preview"],
+                    "visualizations": analyzers[name].create_visualizations(),
+                    "insights": result["insights"]
+                }
+                if progress:
+                    progress(name)
+        return results
 
 
-async def analyze_file(file_content: bytes, file_type: str) -> Dict:
+async def analyze_file(file_content: bytes, file_type: str, **options) -> Dict:
     """ファイル分析のメイン関数"""
     
     try:
-        analyzer = DataAnalyzer(file_content, file_type)
+        analyzer = DataAnalyzer(file_content, file_type, **options)
+        if len(analyzer.sheets) > 1:
+            return {"sheet_names": list(analyzer.sheets), "sheets": analyzer.analyze_sheets()}
         result = analyzer.run_full_analysis()
         return result
     except Exception as e:
@@ -3,6 +3,7 @@ from typing import Dict, List, Optional, Literal
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.engine import Engine
 import pandas as pd
+from metrics import CONNECTOR_CONNECTIONS, CONNECTOR_OPEN, CONNECTOR_LATENCY
 
 DBType = Literal["postgresql", "oracle", "sqlserver"]
 
@@ -30,18 +31,22 @@ class DatabaseConnector:
         connection_string = self._build_connection_string(config)
         
         try:
-            engine = create_engine(
-                connection_string,
-                pool_pre_ping=True,  # 接続チェック
-                pool_recycle=3600,   # 1時間で接続リサイクル
-                echo=False
-            )
-            # 接続テスト
-            with engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            with CONNECTOR_LATENCY.labels(self.db_type, "connect").time():
+                engine = create_engine(
+                    connection_string,
+                    pool_pre_ping=True,  # 接続チェック
+                    pool_recycle=3600,   # 1時間で接続リサイクル
+                    echo=False
+                )
+                # 接続テスト
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
             
+            CONNECTOR_CONNECTIONS.labels(self.db_type, "success").inc()
+            CONNECTOR_OPEN.labels(self.db_type).inc()
             return engine
         except Exception as e:
+            CONNECTOR_CONNECTIONS.labels(self.db_type, "failure").inc()
             raise Exception(f"Failed to connect to {self.db_type}: {str(e)}")
     
     def _get_default_config(self) -> Dict:
@@ -116,8 +121,9 @@ class DatabaseConnector:
         """テーブル一覧取得"""
         
         try:
-            inspector = inspect(self.engine)
-            tables = inspector.get_table_names()
+            with CONNECTOR_LATENCY.labels(self.db_type, "get_tables").time():
+                inspector = inspect(self.engine)
+                tables = inspector.get_table_names()
             return tables
         except Exception as e:
             raise Exception(f"Failed to get tables: {str(e)}")
@@ -158,7 +164,8 @@ class DatabaseConnector:
                         query = f"{query} LIMIT {limit}"
             
             # DataFrameとして取得
-            df = pd.read_sql(query, self.engine)
+            with CONNECTOR_LATENCY.labels(self.db_type, "query").time():
+                df = pd.read_sql(query, self.engine)
             
             return {
                 "columns": df.columns.tolist(),
@@ -179,6 +186,8 @@ class DatabaseConnector:
         """接続クローズ"""
         if self.engine:
             self.engine.dispose()
+            self.engine = None
+            CONNECTOR_OPEN.labels(self.db_type).dec()
 
 
 async def test_db_connection(db_type: DBType, custom_config: Optional[Dict] = None) -> Dict:
@@ -0,0 +1,162 @@
+import os
+from functools import lru_cache
+from typing import Dict, Literal, Tuple
+import numpy as np
+
+Quantization = Literal["none", "int8", "binary"]
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# 埋め込みプロファイル（dimensions: APIで次元を削減, quantization: ローカルインデックスの量子化）
+# Pineconeのインデックスは dimensions と同じ次元で作成しておくこと
+EMBEDDING_PROFILES = {
+    "full": {"dimensions": None, "quantization": "none"},
+    "compact": {"dimensions": 512, "quantization": "int8"},
+    "binary": {"dimensions": 1024, "quantization": "binary"},
+}
+
+# 量子化したインデックスで候補を top_k × この倍数だけ取り、floatで再スコアする
+DEFAULT_RESCORE_FACTOR = 4
+
+# int8への変換・スコア計算を行う行数（一時的なfloat配列のサイズを抑える）
+SCORE_BLOCK_ROWS = 16384
+
+# 0〜255の各値のビット数（numpy 2未満で使う）
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+@lru_cache(maxsize=1)
+def get_embedding_profile() -> Dict:
+    """環境変数から埋め込みプロファイルを取得（個別の環境変数で上書き可能）"""
+    
+    name = os.getenv("EMBEDDING_PROFILE", "full")
+    if name not in EMBEDDING_PROFILES:
+        raise ValueError(f"Unknown embedding profile: {name}")
+    
+    profile = {
+        "name": name,
+        "model": os.getenv("EMBEDDING_MODEL", EMBEDDING_MODEL),
+        **EMBEDDING_PROFILES[name],
+        "rescore_factor": int(os.getenv("LOCAL_INDEX_RESCORE_FACTOR", str(DEFAULT_RESCORE_FACTOR)))
+    }
+    if os.getenv("EMBEDDING_DIMENSIONS"):
+        profile["dimensions"] = int(os.getenv("EMBEDDING_DIMENSIONS")) or None
+    if os.getenv("LOCAL_INDEX_QUANTIZATION"):
+        profile["quantization"] = os.getenv("LOCAL_INDEX_QUANTIZATION")
+    if profile["quantization"] not in ("none", "int8", "binary"):
+        raise ValueError(f"Unknown quantization: {profile['quantization']}")
+    return profile
+
+
+def embedding_params() -> Dict:
+    """Embedding APIに渡すモデルと次元数"""
+    
+    profile = get_embedding_profile()
+    params = {"model": profile["model"]}
+    if profile["dimensions"]:
+        params["dimensions"] = profile["dimensions"]
+    return params
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """各行をL2正規化"""
+    
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def truncate_dimensions(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    """先頭の次元だけを残して再正規化（text-embedding-3 の dimensions 指定と同じ結果）"""
+    return normalize_rows(np.asarray(matrix, dtype=np.float32)[:, :dimensions])
+
+
+def calibrate_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """次元ごとの最小値と刻み幅（int8の256段階）をコーパスから求める"""
+    
+    minimum = matrix.min(axis=0)
+    step = np.maximum(matrix.max(axis=0) - minimum, 1e-12) / 255
+    return minimum.astype(np.float32), step.astype(np.float32)
+
+
+def quantize_int8(matrix: np.ndarray, ranges: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """floatのベクトルを次元ごとのレンジでint8に量子化"""
+    
+    minimum, step = ranges
+    codes = np.rint((matrix - minimum) / step) - 128
+    return np.clip(codes, -128, 127).astype(np.int8)
+
+
+def int8_scores(queries: np.ndarray, codes: np.ndarray, ranges: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """floatのクエリとint8ベクトルの内積（復元したベクトルとの内積と同じ値）
+    
+    x = minimum + step * (code + 128) なので q·x = q·minimum + (q * step)·(code + 128)。
+    コードはブロックごとにfloatへ変換し、全体のfloat行列は作らない。
+    """
+    
+    minimum, step = ranges
+    scaled = queries * step
+    offset = queries @ minimum + 128 * scaled.sum(axis=1)
+    scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+        block = codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+        scores[:, start:start + len(block)] = scaled @ block.T
+    return scores + offset[:, None]
+
+
+def quantize_binary(matrix: np.ndarray) -> np.ndarray:
+    """各次元の符号を1ビットにしてパック（1ベクトルあたり 次元数/8 バイト、8バイト単位に切り上げ）"""
+    
+    bits = np.packbits(np.asarray(matrix) > 0, axis=-1)
+    padding = -bits.shape[-1] % 8
+    if padding:
+        bits = np.pad(bits, [(0, 0)] * (bits.ndim - 1) + [(0, padding)])
+    return np.ascontiguousarray(bits)
+
+
+def pack_binary_codes(matrix: np.ndarray) -> np.ndarray:
+    """インデックス用に2値化したベクトルを64ビット単位・ワード優先（ワード数 × ベクトル数）で保持"""
+    return np.ascontiguousarray(quantize_binary(matrix).view(np.uint64).T)
+
+
+def hamming_distances(query_bits: np.ndarray, code_words: np.ndarray) -> np.ndarray:
+    """パック済みのクエリと pack_binary_codes のベクトルとのハミング距離（クエリ数 × ベクトル数）
+    
+    ワードごとに全ベクトルをまとめてXORしてビット数を加算する（連続したメモリを走査する）。
+    """
+    
+    count = code_words.shape[1]
+    distances = np.zeros((len(query_bits), count), dtype=np.uint16)
+    xor = np.empty(count, dtype=np.uint64)
+    for row, words in zip(distances, query_bits.view(np.uint64)):
+        for codes, word in zip(code_words, words):
+            np.bitwise_xor(codes, word, out=xor)
+            row += _popcount(xor)
+    return distances
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """64ビット整数ごとのビット数（numpy 2未満は1バイトずつ表を引く）"""
+    
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return _POPCOUNT[words.view(np.uint8)].reshape(len(words), 8).sum(axis=1, dtype=np.uint8)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """各行のスコア上位k件のインデックスをスコア順に返す"""
+    
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def quantized_size(count: int, dimensions: int, quantization: Quantization) -> int:
+    """量子化したインデックスのサイズ（バイト）"""
+    
+    if quantization == "int8":
+        # コードと次元ごとのレンジ（最小値・刻み幅）
+        return count * dimensions + 2 * 4 * dimensions
+    if quantization == "binary":
+        return count * ((dimensions + 63) // 64) * 8
+    return count * dimensions * 4
\ No newline at end of file
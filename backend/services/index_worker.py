@@ -0,0 +1,206 @@
+import os
+import asyncio
+from datetime import timedelta
+from typing import List, Dict, Optional
+from sqlalchemy import select, update, delete, insert, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Document, IndexOutbox
+
+# 最後の変更からこの秒数が経つまで反映を待つ（連続した編集をまとめる）
+DEBOUNCE_SECONDS = float(os.getenv("INDEX_DEBOUNCE_SECONDS", "2"))
+
+# 未処理の変更を確認する間隔（秒）
+POLL_INTERVAL = float(os.getenv("INDEX_POLL_INTERVAL", "1"))
+
+# 1回の処理で扱うドキュメント数と同時実行数
+BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "20"))
+CONCURRENCY = int(os.getenv("INDEX_CONCURRENCY", "4"))
+
+# リトライ設定
+MAX_ATTEMPTS = int(os.getenv("INDEX_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 300.0
+
+# 複数プロセスで起動した場合に1つのワーカーだけが処理するためのアドバイザリロックのキー
+ADVISORY_LOCK_KEY = 734501
+
+
+def enqueue_reindex(db: AsyncSession, document_id: int, action: str = "upsert", strategy: str = "markdown") -> None:
+    """ドキュメントの変更を記録（コミットは呼び出し側のトランザクションで行う）"""
+    db.add(IndexOutbox(document_id=document_id, action=action, strategy=strategy))
+
+
+async def enqueue_reindex_many(db: AsyncSession, document_ids: List[int], strategy: str = "markdown") -> None:
+    """複数ドキュメントの変更をまとめて記録"""
+    if document_ids:
+        await db.execute(insert(IndexOutbox).values([
+            {"document_id": document_id, "action": "upsert", "strategy": strategy}
+            for document_id in document_ids
+        ]))
+
+
+def backoff_seconds(attempts: int) -> float:
+    """失敗回数に応じた次の再試行までの待ち時間（指数バックオフ）"""
+    return min(BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), BACKOFF_MAX_SECONDS)
+
+
+async def claim_ready(db: AsyncSession, limit: int = BATCH_SIZE) -> List[Dict]:
+    """反映可能なドキュメントを取得
+    
+    同じドキュメントへの未処理の変更は1件にまとめ、最後の変更から
+    DEBOUNCE_SECONDS 経過していて、バックオフ中でないものだけを返す。
+    """
+    
+    ready = (
+        select(
+            IndexOutbox.document_id,
+            func.max(IndexOutbox.id).label("last_id"),
+            func.max(IndexOutbox.attempts).label("attempts")
+        )
+        .where(IndexOutbox.failed_at.is_(None))
+        .group_by(IndexOutbox.document_id)
+        .having(func.max(IndexOutbox.created_at) <= func.now() - timedelta(seconds=DEBOUNCE_SECONDS))
+        .having(func.max(IndexOutbox.available_at) <= func.now())
+        .order_by(func.min(IndexOutbox.id))
+        .limit(limit)
+        .subquery()
+    )
+    # 最後の変更の戦略で反映する
+    result = await db.execute(
+        select(ready.c.document_id, ready.c.last_id, ready.c.attempts, IndexOutbox.strategy)
+        .join(IndexOutbox, IndexOutbox.id == ready.c.last_id)
+    )
+    return [dict(row._mapping) for row in result]
+
+
+async def reindex_document(document_id: int, title: Optional[str], content: Optional[str], strategy: str) -> Dict:
+    """ドキュメントの現在の状態をベクトルインデックスに反映（content=Noneは削除済み）"""
+    
+    from services.chunking import chunk_and_embed, delete_document_chunks
+    
+    # 削除済み・本文が空の場合はチャンクを削除するだけ
+    if not (content or "").strip():
+        return await delete_document_chunks(str(document_id))
+    
+    # 先に新しいチャンクを上書きし、余ったチャンクだけを削除する（検索結果が空になる時間を作らない）
+    stats = await chunk_and_embed(str(document_id), title or "", content, strategy=strategy)
+    await delete_document_chunks(str(document_id), keep_chunks=stats["chunks_created"])
+    return stats
+
+
+class IndexWorker:
+    """アウトボックスを監視し、ドキュメントの変更をベクトルインデックスに反映するワーカー"""
+    
+    def __init__(self, poll_interval: float = POLL_INTERVAL, batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+    
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+    
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                print(f"Index worker error: {e}")
+                processed = 0
+            # 処理が残っている可能性がある場合はすぐに次のバッチへ
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+    
+    async def run_once(self) -> int:
+        """反映可能な変更を1バッチ処理し、処理したドキュメント数を返す"""
+        
+        from database import async_engine, AsyncSessionLocal
+        
+        async with async_engine.connect() as lock_conn:
+            # 他のプロセスのワーカーが処理中ならスキップ
+            locked = await lock_conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            if not locked:
+                return 0
+            try:
+                async with AsyncSessionLocal() as db:
+                    items = await claim_ready(db, self.batch_size)
+                if not items:
+                    return 0
+                
+                semaphore = asyncio.Semaphore(self.concurrency)
+                
+                async def process(item: Dict) -> None:
+                    async with semaphore:
+                        await self._process(item)
+                
+                await asyncio.gather(*[process(item) for item in items])
+                return len(items)
+            finally:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                await lock_conn.commit()
+    
+    async def _process(self, item: Dict) -> None:
+        from database import AsyncSessionLocal
+        
+        pending = (
+            (IndexOutbox.document_id == item["document_id"])
+            & (IndexOutbox.id <= item["last_id"])
+            & IndexOutbox.failed_at.is_(None)
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(Document.title, Document.content).where(Document.id == item["document_id"])
+                )
+                row = result.first()
+            # 外部APIの呼び出しは非同期、チャンクストアはスレッドで呼ぶため、アプリのイベントループでそのまま実行する
+            # （別のループを作るとサーキットブレーカーなどの状態をアプリと共有できない）
+            await reindex_document(
+                item["document_id"],
+                row.title if row else None,
+                row.content if row else None,
+                item["strategy"]
+            )
+        except Exception as e:
+            attempts = item["attempts"] + 1
+            print(f"Failed to reindex document {item['document_id']} (attempt {attempts}): {e}")
+            values = {"attempts": attempts, "last_error": str(e)}
+            if attempts >= MAX_ATTEMPTS:
+                values["failed_at"] = func.now()
+            else:
+                values["available_at"] = func.now() + timedelta(seconds=backoff_seconds(attempts))
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(IndexOutbox).where(pending).values(**values))
+                await db.commit()
+            return
+        
+        # 反映済みの変更を削除（処理中に追加された変更は次回に反映）
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(IndexOutbox).where(pending))
+            await db.commit()
+
+
+async def outbox_stats(db: AsyncSession) -> Dict:
+    """アウトボックスの滞留状況を取得"""
+    
+    result = await db.execute(
+        select(
+            func.count().filter(IndexOutbox.failed_at.is_(None)).label("pending"),
+            func.count(func.distinct(IndexOutbox.document_id)).filter(IndexOutbox.failed_at.is_(None)).label("pending_documents"),
+            func.count().filter(IndexOutbox.failed_at.is_not(None)).label("failed"),
+            func.min(IndexOutbox.created_at).filter(IndexOutbox.failed_at.is_(None)).label("oldest_pending_at")
+        )
+    )
+    return dict(result.one()._mapping)
\ No newline at end of file
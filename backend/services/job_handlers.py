@@ -0,0 +1,109 @@
+import asyncio
+from typing import Dict, Callable, List
+from services.jobs import JobContext
+
+
+def handle_chunk(payload: Dict, ctx: JobContext) -> Dict:
+    """大きなドキュメントのチャンク分割・ベクトル化"""
+    
+    from services.chunking import chunk_and_embed
+    
+    def progress(done: int, total) -> None:
+        ctx.report(done / total if total else 0.0, f"{done}/{total} chunks embedded")
+    
+    ctx.report(0.0, "chunking", force=True)
+    return ctx.run(chunk_and_embed(
+        document_id=payload["document_id"],
+        title=payload["title"],
+        content=payload["content"],
+        strategy=payload.get("strategy", "markdown"),
+        size_unit=payload.get("size_unit", "chars"),
+        chunk_size=payload.get("chunk_size"),
+        overlap=payload.get("overlap"),
+        progress=progress
+    ))
+
+
+def handle_notion_import(payload: Dict, ctx: JobContext) -> Dict:
+    """Notionページ（page_id と page_ids）を取得してドキュメントとして登録し、ベクトル化"""
+    
+    from services.notion_import import import_notion_pages, unique_page_ids
+    
+    # APIのルートと同じく page_id と page_ids をまとめる
+    page_ids = unique_page_ids(payload.get("page_ids", []) + ([payload["page_id"]] if payload.get("page_id") else []))
+    if not page_ids:
+        raise ValueError("page_id or page_ids is required")
+    
+    async def run() -> List[Dict]:
+        pages = []
+        async for event in import_notion_pages(page_ids, payload.get("chunk_strategy", "markdown"), payload.get("concurrency")):
+            if event["status"] in ("done", "error"):
+                pages.append(event)
+                await asyncio.to_thread(ctx.report, len(pages) / len(page_ids), f"{len(pages)}/{len(page_ids)} pages imported")
+            elif event["status"] == "indexing" and len(page_ids) == 1:
+                # ブロックは取得しながらチャンク分割するため総数は不明
+                await asyncio.to_thread(ctx.report, 0.2, f"{event['blocks']} blocks fetched, {event['chunks']} chunks embedded")
+        return pages
+    
+    ctx.report(0.0, "fetching Notion pages", force=True)
+    pages = ctx.run(run())
+    failed = [page for page in pages if page["status"] == "error"]
+    if len(page_ids) == 1 and failed:
+        # 1ページだけのインポートは失敗として再試行する
+        raise RuntimeError(failed[0]["error"])
+    return {"pages": pages, "imported": len(pages) - len(failed), "failed": len(failed)}
+
+
+def handle_analyze(payload: Dict, ctx: JobContext) -> Dict:
+    """アップロードされたCSV/Excel等の分析"""
+    
+    from services.data_analysis import DataAnalyzer
+    
+    ctx.report(0.0, "loading file", force=True)
+    analyzer = DataAnalyzer(ctx.load_input(), payload["file_type"], **payload.get("options", {}))
+    
+    if len(analyzer.sheets) > 1:
+        # 複数シートはシートごとに並行して分析
+        names = list(analyzer.sheets)
+        done = []
+        
+        def progress(name: str) -> None:
+            done.append(name)
+            ctx.report(0.1 + 0.9 * len(done) / len(names), f"{len(done)}/{len(names)} sheets analyzed ({name})")
+        
+        ctx.report(0.1, f"analyzing {len(names)} sheets", force=True)
+        return {"sheet_names": names, "sheets": analyzer.analyze_sheets(progress=progress)}
+    
+    steps = [
+        ("basic_info", analyzer.get_basic_info),
+        ("statistics", analyzer.get_summary_statistics),
+        ("preview", analyzer.get_data_preview),
+        ("visualizations", analyzer.create_visualizations),
+        ("insights", analyzer.generate_insights),
+    ]
+    result = {}
+    for i, (name, step) in enumerate(steps):
+        ctx.report(0.1 + 0.9 * i / len(steps), name, force=True)
+        result[name] = step()
+    return result
+
+
+def handle_dedup_report(payload: Dict, ctx: JobContext) -> Dict:
+    """コーパス全体のほぼ同じチャンクの集計"""
+    
+    from services.chunk_dedup import build_dedup_report
+    
+    ctx.report(0.0, "computing signatures", force=True)
+    return build_dedup_report(
+        threshold=payload.get("threshold"),
+        top=payload.get("top", 20),
+        progress=ctx.report
+    )
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict, JobContext], Dict]] = {
+    "chunk": handle_chunk,
+    "notion_import": handle_notion_import,
+    "analyze": handle_analyze,
+    "dedup_report": handle_dedup_report,
+}
\ No newline at end of file
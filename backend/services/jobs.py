@@ -0,0 +1,276 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from datetime import timedelta
+from typing import Dict, Optional, Any, Coroutine, TypeVar
+from sqlalchemy import select, update, func, Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models import Job
+
+# ジョブの種類ごとの既定の同時実行数（ワーカープロセスあたり）
+DEFAULT_CONCURRENCY = {
+    "chunk": 2,
+    "notion_import": 2,
+    "analyze": 1,
+    "dedup_report": 1,
+}
+
+JOB_TYPES = list(DEFAULT_CONCURRENCY)
+
+# 進捗の書き込み間隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+# ハートビートがこの秒数途絶えた実行中ジョブは再投入する
+STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+
+RETRY_BACKOFF_SECONDS = 10.0
+RETRY_BACKOFF_MAX_SECONDS = 600.0
+
+
+T = TypeVar("T")
+
+
+def start_event_loop() -> asyncio.AbstractEventLoop:
+    """ワーカープロセスのジョブが共有するイベントループをバックグラウンドのスレッドで開始
+    
+    ジョブごとに asyncio.run で別のループを作ると、ループに結び付いた状態（非同期エンジンの接続など）を
+    ジョブ間で共有できないため、1つのループを使い続ける。
+    """
+    
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="job-event-loop", daemon=True).start()
+    return loop
+
+
+class JobCancelled(Exception):
+    """ジョブのキャンセルが要求された"""
+
+
+def job_to_dict(job: Job) -> Dict:
+    return {
+        "job_id": job.id,
+        "type": job.type,
+        "status": job.status,
+        "progress": job.progress,
+        "progress_message": job.progress_message,
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "cancel_requested": job.cancel_requested,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+
+def parse_concurrency(value: Optional[str]) -> Dict[str, int]:
+    """"chunk=2,analyze=1" 形式の設定を種類ごとの同時実行数に変換"""
+    
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        job_type, _, count = item.partition("=")
+        job_type = job_type.strip()
+        if job_type not in DEFAULT_CONCURRENCY:
+            raise ValueError(f"Unknown job type: {job_type}")
+        concurrency[job_type] = int(count)
+    return {job_type: count for job_type, count in concurrency.items() if count > 0}
+
+
+def retry_delay(attempts: int) -> float:
+    """失敗回数に応じた再実行までの待ち時間（指数バックオフ）"""
+    return min(RETRY_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0)), RETRY_BACKOFF_MAX_SECONDS)
+
+
+def to_json(value: Any) -> Any:
+    """結果をJSONとして保存できる形に変換（NaN/InfはNone、その他の型は文字列）"""
+    
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, (int, str)):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if hasattr(value, "item"):
+        # numpyのスカラー
+        return to_json(value.item())
+    return str(value)
+
+
+# === API側（非同期） ===
+
+async def submit_job(
+    db: AsyncSession,
+    job_type: str,
+    payload: Optional[Dict] = None,
+    input_data: Optional[bytes] = None,
+    max_attempts: int = 3
+) -> Job:
+    if job_type not in DEFAULT_CONCURRENCY:
+        raise ValueError(f"Unknown job type: {job_type}")
+    
+    job = Job(type=job_type, payload=payload or {}, input_data=input_data, max_attempts=max_attempts)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def get_job(db: AsyncSession, job_id: int) -> Optional[Job]:
+    return await db.get(Job, job_id)
+
+
+async def cancel_job(db: AsyncSession, job_id: int) -> Optional[Job]:
+    """実行待ちのジョブは即座にキャンセルし、実行中のジョブにはキャンセルを要求する"""
+    
+    job = await db.get(Job, job_id, with_for_update=True)
+    if job is None:
+        return None
+    if job.status == "queued":
+        job.status = "cancelled"
+        job.finished_at = func.now()
+    elif job.status == "running":
+        job.cancel_requested = True
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+# === ワーカー側（同期） ===
+
+def claim_job(db: Session, job_type: str, worker_id: str) -> Optional[Row]:
+    """実行待ちのジョブを1件取得して実行中にする（他のワーカーがロック中の行は飛ばす）"""
+    
+    next_job = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.type == job_type, Job.run_after <= func.now())
+        .order_by(Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    job = db.execute(
+        update(Job)
+        .where(Job.id == next_job)
+        .values(
+            status="running",
+            attempts=Job.attempts + 1,
+            worker_id=worker_id,
+            started_at=func.now(),
+            heartbeat_at=func.now(),
+            cancel_requested=False
+        )
+        .returning(Job.id, Job.type, Job.payload, Job.attempts, Job.max_attempts)
+    ).one_or_none()
+    db.commit()
+    return job
+
+
+def load_input_data(db: Session, job_id: int) -> Optional[bytes]:
+    return db.execute(select(Job.input_data).where(Job.id == job_id)).scalar_one_or_none()
+
+
+def finish_job(db: Session, job_id: int, result: Any) -> None:
+    db.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(status="succeeded", result=to_json(result), progress=1.0, error=None, finished_at=func.now())
+    )
+    db.commit()
+
+
+def mark_cancelled(db: Session, job_id: int) -> None:
+    db.execute(update(Job).where(Job.id == job_id).values(status="cancelled", finished_at=func.now()))
+    db.commit()
+
+
+def fail_job(db: Session, job: Row, error: str) -> None:
+    """失敗したジョブをバックオフ後に再投入、上限に達していれば失敗にする"""
+    
+    if job.attempts < job.max_attempts:
+        values = {
+            "status": "queued",
+            "error": error,
+            "run_after": func.now() + timedelta(seconds=retry_delay(job.attempts))
+        }
+    else:
+        values = {"status": "failed", "error": error, "finished_at": func.now()}
+    db.execute(update(Job).where(Job.id == job.id).values(**values))
+    db.commit()
+
+
+def heartbeat(db: Session, worker_id: str) -> None:
+    """このワーカーが実行中のジョブの生存時刻を更新"""
+    db.execute(
+        update(Job)
+        .where(Job.worker_id == worker_id, Job.status == "running")
+        .values(heartbeat_at=func.now())
+    )
+    db.commit()
+
+
+def requeue_stale_jobs(db: Session) -> int:
+    """ハートビートが途絶えたジョブ（ワーカーが落ちた場合など）を再投入"""
+    
+    stale = (Job.status == "running") & (Job.heartbeat_at < func.now() - timedelta(seconds=STALE_SECONDS))
+    requeued = db.execute(
+        update(Job)
+        .where(stale, Job.attempts < Job.max_attempts)
+        .values(status="queued", error="Worker heartbeat lost")
+    ).rowcount
+    db.execute(
+        update(Job)
+        .where(stale)
+        .values(status="failed", error="Worker heartbeat lost", finished_at=func.now())
+    )
+    db.commit()
+    return requeued
+
+
+class JobContext:
+    """ジョブハンドラーに渡す、進捗報告とキャンセル確認のためのコンテキスト"""
+    
+    def __init__(self, session_factory, job_id: int, loop: asyncio.AbstractEventLoop):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.loop = loop
+        self._last_report = 0.0
+    
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """コルーチンをワーカーのイベントループで実行し、結果を待つ（ジョブのスレッドから呼び出す）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def report(self, progress: float, message: Optional[str] = None, force: bool = False) -> None:
+        """進捗(0〜1)を記録し、キャンセルが要求されていればJobCancelledを送出"""
+        
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        
+        with self.session_factory() as db:
+            cancel_requested = db.execute(
+                update(Job)
+                .where(Job.id == self.job_id)
+                .values(progress=max(0.0, min(progress, 1.0)), progress_message=message, heartbeat_at=func.now())
+                .returning(Job.cancel_requested)
+            ).scalar_one()
+            db.commit()
+        if cancel_requested:
+            raise JobCancelled()
+    
+    def load_input(self) -> Optional[bytes]:
+        with self.session_factory() as db:
+            return load_input_data(db, self.job_id)
+    
+    def check_cancelled(self) -> None:
+        with self.session_factory() as db:
+            if db.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar_one():
+                raise JobCancelled()
\ No newline at end of file
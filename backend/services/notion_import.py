@@ -0,0 +1,212 @@
+import os
+import re
+import asyncio
+from typing import List, Dict, Tuple, Optional, Callable, AsyncIterator
+from sqlalchemy import text, func, select, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Document
+
+# 同時にインポートするページ数（NotionのAPIレート制限は平均3リクエスト/秒）
+IMPORT_CONCURRENCY = int(os.getenv("NOTION_IMPORT_CONCURRENCY", "3"))
+
+# 1リクエストでインポートできるページ数の上限
+MAX_PAGES_PER_REQUEST = int(os.getenv("NOTION_IMPORT_MAX_PAGES", "100"))
+
+ProgressCallback = Callable[[Dict], None]
+
+
+def ensure_notion_columns(engine: Engine) -> None:
+    """既存のdocumentsテーブルにNotionページIDのカラムとupsert用のインデックスを追加（PostgreSQLのみ）"""
+    
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS notion_page_id VARCHAR"))
+    for index in Document.__table__.indexes:
+        if index.name == "ix_documents_notion_page_id":
+            index.create(bind=engine, checkfirst=True)
+
+
+def normalize_page_id(page_id: str) -> str:
+    """ページURLやハイフン付き/なしのIDを、ハイフンなしの32桁のIDに揃える"""
+    
+    page_id = page_id.strip()
+    lowered = page_id.lower()
+    match = re.search(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", lowered)
+    if match:
+        return match.group(0).replace("-", "")
+    # URLはタイトルの後ろにIDが付く（例: Setup-Guide-<32桁>）
+    candidates = re.findall(r"[0-9a-f]{32}(?![0-9a-f])", lowered)
+    return candidates[-1] if candidates else page_id
+
+
+def unique_page_ids(page_ids: List[str]) -> List[str]:
+    """正規化したページIDの重複を順序を保って除く"""
+    return list(dict.fromkeys(normalize_page_id(page_id) for page_id in page_ids if page_id.strip()))
+
+
+async def reserve_document_id(db: AsyncSession, page_id: str) -> Tuple[int, bool]:
+    """Notionページに対応するドキュメントのIDを取得し、なければ新しいIDを予約して (ID, 新規か) を返す
+    
+    行は作成もロックもしない（チャンクのIDに使うIDだけを先に決め、行はインデックス反映後に保存する）。
+    """
+    
+    existing = await db.scalar(select(Document.id).where(Document.notion_page_id == page_id))
+    if existing is not None:
+        return existing, False
+    reserved = await db.scalar(select(func.nextval(func.pg_get_serial_sequence("documents", "id"))))
+    return reserved, True
+
+
+async def upsert_notion_document(db: AsyncSession, document_id: int, page_id: str, title: str, content: str) -> Tuple[int, bool]:
+    """Notionページに対応するドキュメントを作成または更新し、(ID, 新規作成か) を返す（コミットは呼び出し側）"""
+    
+    stmt = insert(Document).values(id=document_id, notion_page_id=page_id, title=title, content=content)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Document.notion_page_id],
+        index_where=Document.notion_page_id.isnot(None),
+        set_={"title": stmt.excluded.title, "content": stmt.excluded.content, "updated_at": func.now()}
+    ).returning(Document.id, literal_column("(xmax = 0)").label("inserted"))
+    row = (await db.execute(stmt)).one()
+    return row.id, row.inserted
+
+
+async def import_notion_page(page_id: str, chunk_strategy: str = "markdown", progress: Optional[ProgressCallback] = None) -> Dict:
+    """Notionページを取得し、チャンク分割・ベクトル化とドキュメントのupsertを1回のパスで行う
+    
+    ブロックは100件ずつ（スレッドで）取得しながらチャンク分割・ベクトル化に流すため、ページ全体の
+    取得完了を待たない。インデックス反映中はDB接続も行ロックも保持せず、反映が終わってから
+    本文を短いトランザクションで保存する。
+    """
+    
+    from database import AsyncSessionLocal
+    from services.notion_service import get_notion_page_metadata, iter_page_markdown
+    from services.chunking import chunk_and_embed, delete_document_chunks
+    from services.index_worker import enqueue_reindex
+    
+    report = progress or (lambda event: None)
+    page_id = normalize_page_id(page_id)
+    report({"page_id": page_id, "status": "fetching"})
+    page = await asyncio.to_thread(get_notion_page_metadata, page_id)
+    
+    parts: List[str] = []
+    
+    def blocks():
+        for markdown in iter_page_markdown(page_id):
+            parts.append(markdown)
+            yield markdown
+    
+    def on_batch(done: int, total) -> None:
+        report({"page_id": page_id, "status": "indexing", "blocks": len(parts), "chunks": done})
+    
+    async with AsyncSessionLocal() as db:
+        document_id, reserved = await reserve_document_id(db, page_id)
+    report({"page_id": page_id, "status": "indexing", "document_id": document_id, "blocks": 0, "chunks": 0})
+    try:
+        try:
+            stats = await chunk_and_embed(
+                document_id=str(document_id),
+                title=page["title"],
+                content=blocks(),
+                strategy=chunk_strategy,
+                progress=on_batch
+            )
+            chunks_created = stats["chunks_created"]
+        except ValueError:
+            # 空のページはチャンクなしとして登録する
+            if "".join(parts).strip():
+                raise
+            chunks_created = 0
+        # 新しいチャンクを上書きした後で、余ったチャンクだけを削除
+        await delete_document_chunks(str(document_id), keep_chunks=chunks_created)
+        
+        async with AsyncSessionLocal() as db:
+            saved_id, created = await upsert_notion_document(
+                db, document_id, page_id, page["title"], "".join(parts).strip()
+            )
+            if saved_id != document_id:
+                # 同じページの別のインポートが先に行を作成した場合は、その行のインデックスを作り直す
+                enqueue_reindex(db, saved_id)
+            await db.commit()
+    except (Exception, asyncio.CancelledError):
+        await _recover_failed_import(document_id, reserved)
+        raise
+    
+    if saved_id != document_id:
+        await delete_document_chunks(str(document_id))
+        document_id = saved_id
+    
+    result = {
+        "page_id": page_id,
+        "status": "done",
+        "document_id": document_id,
+        "created": created,
+        "title": page["title"],
+        "url": page["url"],
+        "blocks": len(parts),
+        "chunks": chunks_created
+    }
+    report(result)
+    return result
+
+
+async def _recover_failed_import(document_id: int, reserved: bool) -> None:
+    """途中で失敗したインポートでPineconeに書き込んだチャンクを元の状態に戻す"""
+    
+    from database import AsyncSessionLocal
+    from services.chunking import delete_document_chunks
+    from services.index_worker import enqueue_reindex
+    
+    try:
+        if reserved:
+            # 行は保存していないため、書き込んだチャンクも削除
+            await delete_document_chunks(str(document_id))
+        else:
+            # 既存ドキュメントは保存済みの本文でインデックスを作り直す
+            async with AsyncSessionLocal() as db:
+                enqueue_reindex(db, document_id)
+                await db.commit()
+    except Exception as e:
+        print(f"Failed to clean up import of document {document_id}: {e}")
+
+
+async def import_notion_pages(
+    page_ids: List[str],
+    chunk_strategy: str = "markdown",
+    concurrency: Optional[int] = None
+) -> AsyncIterator[Dict]:
+    """複数ページを同時実行数を制限してインポートし、進捗イベントを発生順に返す
+    
+    各ページは fetching → indexing（バッチごと）→ done / error の順にイベントを返し、
+    最後に全体の集計（status=complete）を返す。
+    """
+    
+    page_ids = unique_page_ids(page_ids)
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(concurrency or IMPORT_CONCURRENCY, 1))
+    
+    async def run(page_id: str) -> None:
+        async with semaphore:
+            try:
+                await import_notion_page(page_id, chunk_strategy, queue.put_nowait)
+            except Exception as e:
+                queue.put_nowait({"page_id": page_id, "status": "error", "error": str(e)})
+    
+    tasks = [asyncio.create_task(run(page_id)) for page_id in page_ids]
+    imported = failed = 0
+    try:
+        while imported + failed < len(page_ids):
+            event = await queue.get()
+            if event["status"] == "done":
+                imported += 1
+            elif event["status"] == "error":
+                failed += 1
+            yield event
+    finally:
+        # クライアントが切断した場合は未開始のページを取り消す
+        for task in tasks:
+            task.cancel()
+    
+    yield {"status": "complete", "pages": len(page_ids), "imported": imported, "failed": failed}
\ No newline at end of file
@@ -1,10 +1,10 @@
 import os
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 from notion_client import Client
 from markdownify import markdownify as md
 
-# Notionクライアント初期化
-notion = Client(auth=os.getenv("NOTION_TOKEN"))
+# Notionクライアント初期化（NOTION_BASE_URLはベンチマーク用のフェイクサーバー向け）
+notion = Client(auth=os.getenv("NOTION_TOKEN"), base_url=os.getenv("NOTION_BASE_URL", "https://api.notion.com"))
 
 
 def block_to_markdown(block: Dict) -> str:
@@ -96,48 +96,64 @@ def extract_rich_text(rich_text_array: List[Dict]) -> str:
     return result
 
 
+def _page_title(page: Dict) -> str:
+    """ページのプロパティからタイトルを取得"""
+    
+    for prop_name, prop_value in page.get("properties", {}).items():
+        if prop_value.get("type") == "title" and prop_value.get("title"):
+            return extract_rich_text(prop_value["title"])
+    return ""
+
+
+def get_notion_page_metadata(page_id: str) -> Dict:
+    """ページ情報（タイトル・URL・更新日時）のみを取得"""
+    
+    page = notion.pages.retrieve(page_id=page_id)
+    return {
+        "title": _page_title(page) or "Untitled",
+        "page_id": page_id,
+        "url": page.get("url", ""),
+        "created_time": page.get("created_time", ""),
+        "last_edited_time": page.get("last_edited_time", "")
+    }
+
+
+def iter_page_markdown(page_id: str) -> Iterator[str]:
+    """ページのブロックを100件ずつ取得しながら、ブロックごとのMarkdownを逐次返す"""
+    
+    has_more = True
+    start_cursor = None
+    
+    while has_more:
+        response = notion.blocks.children.list(
+            block_id=page_id,
+            start_cursor=start_cursor,
+            page_size=100
+        )
+        for block in response["results"]:
+            markdown = block_to_markdown(block)
+            if markdown:
+                yield markdown
+        has_more = response["has_more"]
+        start_cursor = response.get("next_cursor")
+
+
 async def get_notion_page_as_markdown(page_id: str) -> Dict:
     """NotionページをMarkdownとして取得"""
     
     try:
-        # ページ情報取得
-        page = notion.pages.retrieve(page_id=page_id)
-        
-        # タイトル取得
-        title = ""
-        if "properties" in page:
-            for prop_name, prop_value in page["properties"].items():
-                if prop_value.get("type") == "title" and prop_value.get("title"):
-                    title = extract_rich_text(prop_value["title"])
-                    break
-        
-        # ブロック取得（再帰的に全て取得）
-        blocks = []
-        has_more = True
-        start_cursor = None
-        
-        while has_more:
-            response = notion.blocks.children.list(
-                block_id=page_id,
-                start_cursor=start_cursor,
-                page_size=100
-            )
-            blocks.extend(response["results"])
-            has_more = response["has_more"]
-            start_cursor = response.get("next_cursor")
+        page = get_notion_page_metadata(page_id)
         
-        # Markdownに変換
-        markdown_content = ""
-        for block in blocks:
-            markdown_content += block_to_markdown(block)
+        # ブロックを全て取得してMarkdownに変換
+        markdown_content = "".join(iter_page_markdown(page_id))
         
         return {
-            "title": title or "Untitled",
+            "title": page["title"],
             "content": markdown_content.strip(),
             "page_id": page_id,
-            "url": page.get("url", ""),
-            "created_time": page.get("created_time", ""),
-            "last_edited_time": page.get("last_edited_time", "")
+            "url": page["url"],
+            "created_time": page["created_time"],
+            "last_edited_time": page["last_edited_time"]
         }
     
     except Exception as e:
@@ -1,55 +1,93 @@
-import os
-from typing import List, Dict, Optional
-from openai import OpenAI
-from pinecone import Pinecone
+import asyncio
+from typing import List, Dict, Optional, Tuple, AsyncIterator
+from services.clients import get_openai_client, get_index
+from services.chunk_store import fetch_chunk_texts, fetch_chunk_references
+from services.embeddings import embedding_params
+from services.rerank import query_params, rerank_matches, merge_adjacent_chunks
+from services.upstream import call_upstream
+from metrics import stage_timer, record_token_usage
 
-# クライアント初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index(os.getenv("PINECONE_INDEX_NAME"))
+SYSTEM_PROMPT = """あなたは技術ドキュメントのアシスタントです。
+提供されたコンテキストに基づいて、ユーザーの質問に正確に答えてください。
+コンテキストに情報がない場合は、「提供された情報では回答できません」と答えてください。"""
 
-async def answer_question(question: str, document_ids: Optional[List[str]] = None) -> Dict:
-    """RAG (Retrieval-Augmented Generation) で質問に回答"""
+# コンテキストに使うチャンク数
+CONTEXT_CHUNKS = 5
+
+async def _retrieve_context(question: str, document_ids: Optional[List[str]], diversify: bool = False) -> Tuple[List[str], List[Dict]]:
+    """質問に関連するチャンクを検索し、コンテキストと出典を返す
     
-    # 1. 質問をベクトル化
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=question
-    )
+    diversify を指定すると、重複の多いチャンクを除き、連続するチャンクを結合してコンテキストにする。
+    """
+    
+    # 1. 質問をベクトル化（同期クライアントはスレッドで呼び、イベントループを止めない）
+    with stage_timer("ask", "embed"):
+        response = await call_upstream(
+            "openai", "embed", get_openai_client().embeddings.create,
+            hedge=True,
+            timeout_arg="timeout",
+            **embedding_params(),
+            input=question
+        )
+    record_token_usage(embedding_params()["model"], response.usage)
     query_embedding = response.data[0].embedding
     
-    # 2. 関連チャンクを検索
+    # 2. 関連チャンクを検索（共有チャンクは document_ids に共有しているドキュメントも含む）
     filter_dict = {}
     if document_ids:
-        filter_dict = {"document_id": {"$in": document_ids}}
-    
-    results = index.query(
-        vector=query_embedding,
-        top_k=5,
-        include_metadata=True,
-        filter=filter_dict if filter_dict else None
-    )
-    
-    # 3. コンテキストを構築
-    context_chunks = []
-    sources = []
-    for match in results.matches:
-        chunk_text = match.metadata.get("chunk_text", "")
-        title = match.metadata.get("title", "")
-        context_chunks.append(f"[{title}]\n{chunk_text}")
-        sources.append({
-            "document_id": match.metadata.get("document_id"),
-            "title": title,
+        filter_dict = {"$or": [
+            {"document_id": {"$in": document_ids}},
+            {"document_ids": {"$in": document_ids}}
+        ]}
+    
+    with stage_timer("ask", "vector_query"):
+        results = await call_upstream(
+            "pinecone", "query", get_index().query,
+            hedge=True,
+            vector=query_embedding,
+            include_metadata=True,
+            filter=filter_dict if filter_dict else None,
+            **query_params(CONTEXT_CHUNKS, diversify)
+        )
+    
+    matches = results.matches
+    if diversify:
+        with stage_timer("ask", "rerank"):
+            matches = rerank_matches(query_embedding, matches, CONTEXT_CHUNKS)
+    
+    # 3. チャンク本文をベクトルIDでまとめて取得し、コンテキストを構築
+    with stage_timer("ask", "chunk_lookup"):
+        texts = await asyncio.to_thread(fetch_chunk_texts, [match.id for match in matches])
+        # 指定したドキュメントが共有しているチャンクは、そのドキュメントのチャンクとして扱う
+        shared = [match.id for match in matches if document_ids and match.metadata.get("document_id") not in document_ids]
+        references = await asyncio.to_thread(fetch_chunk_references, shared, document_ids) if shared else {}
+    
+    chunks = []
+    for match in matches:
+        # 共有が解除された後に古いメタデータでヒットしたチャンクは除く
+        if match.id in shared and match.id not in references:
+            continue
+        metadata = references.get(match.id, match.metadata)
+        chunks.append({
+            "document_id": metadata.get("document_id"),
+            "title": metadata.get("title", ""),
+            "chunk_text": texts.get(match.id, match.metadata.get("chunk_text", "")),
+            "chunk_index": metadata.get("chunk_index"),
             "score": match.score
         })
+    if diversify:
+        chunks = merge_adjacent_chunks(chunks)
     
-    context = "\n\n".join(context_chunks)
-    
-    # 4. GPT-4で回答生成
-    system_prompt = """あなたは技術ドキュメントのアシスタントです。
-提供されたコンテキストに基づいて、ユーザーの質問に正確に答えてください。
-コンテキストに情報がない場合は、「提供された情報では回答できません」と答えてください。"""
+    context_chunks = [f"[{chunk['title']}]\n{chunk['chunk_text']}" for chunk in chunks]
+    sources = [
+        {"document_id": chunk["document_id"], "title": chunk["title"], "score": chunk["score"]}
+        for chunk in chunks
+    ]
+    return context_chunks, sources
 
+
+def _build_messages(question: str, context_chunks: List[str]) -> List[Dict]:
+    context = "\n\n".join(context_chunks)
     user_prompt = f"""コンテキスト:
 {context}
 
@@ -57,15 +95,29 @@ async def answer_question(question: str, document_ids: Optional[List[str]] = Non
 
 上記のコンテキストに基づいて、質問に答えてください。"""
 
-    chat_response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.3,
-        max_tokens=500
-    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+async def answer_question(question: str, document_ids: Optional[List[str]] = None, diversify: bool = False) -> Dict:
+    """RAG (Retrieval-Augmented Generation) で質問に回答"""
+    
+    context_chunks, sources = await _retrieve_context(question, document_ids, diversify)
+    
+    # 4. GPT-4で回答生成
+    with stage_timer("ask", "generate"):
+        # 生成は高価なためヘッジせず、再試行のみ行う
+        chat_response = await call_upstream(
+            "openai", "chat", get_openai_client().chat.completions.create,
+            timeout_arg="timeout",
+            model="gpt-4",
+            messages=_build_messages(question, context_chunks),
+            temperature=0.3,
+            max_tokens=500
+        )
+    record_token_usage("gpt-4", chat_response.usage)
     
     answer = chat_response.choices[0].message.content
     
@@ -74,4 +126,42 @@ async def answer_question(question: str, document_ids: Optional[List[str]] = Non
         "answer": answer,
         "sources": sources,
         "context_used": len(context_chunks)
-    }
\ No newline at end of file
+    }
+
+
+async def stream_answer(question: str, document_ids: Optional[List[str]] = None, diversify: bool = False) -> AsyncIterator[Dict]:
+    """回答をトークン単位で生成しながら返す
+    
+    最初に出典（type=sources）、続いて生成されたテキスト（type=token）、
+    最後に完了（type=done）を返す。
+    """
+    
+    context_chunks, sources = await _retrieve_context(question, document_ids, diversify)
+    yield {"type": "sources", "question": question, "sources": sources, "context_used": len(context_chunks)}
+    
+    # 同期クライアントのストリームは1チャンクずつスレッドで読み、イベントループを止めない
+    with stage_timer("ask", "generate"):
+        # 再試行するのはストリームの開始まで（トークンを返し始めた後は再試行しない）
+        stream = await call_upstream(
+            "openai", "chat_stream", get_openai_client().chat.completions.create,
+            model="gpt-4",
+            messages=_build_messages(question, context_chunks),
+            temperature=0.3,
+            max_tokens=500,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        chunks = iter(stream)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk.usage is not None:
+                    record_token_usage("gpt-4", chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield {"type": "token", "content": chunk.choices[0].delta.content}
+        finally:
+            stream.close()
+    
+    yield {"type": "done"}
\ No newline at end of file
@@ -0,0 +1,338 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from limits import parse as parse_rate_limit
+from slowapi.util import get_remote_address
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.requests import Request
+from metrics import RATE_LIMIT_DECISIONS
+
+# コストの単位: gpt-4のプロンプト1トークン相当（Embeddingは価格比でおよそ1/1000）
+MODEL_WEIGHTS = {"embedding": 0.001, "prompt": 1.0, "completion": 2.0}
+
+# 1リクエスト（バッチ検索は1クエリ）の最小コスト（PineconeやDBの呼び出し分）
+MIN_REQUEST_COST = 1.0
+
+# 質問応答のコンテキスト（検索した5チャンクとシステムプロンプト）と回答の最大トークン数
+ASK_CONTEXT_TOKENS = int(os.getenv("RATE_LIMIT_ASK_CONTEXT_TOKENS", "2500"))
+ASK_MAX_COMPLETION_TOKENS = 500
+
+# Notionの1ページあたりの推定トークン数
+NOTION_PAGE_TOKENS = int(os.getenv("RATE_LIMIT_NOTION_PAGE_TOKENS", "4000"))
+
+# ユーザー・ルートごとの予算（コスト/期間）。容量まで一度に使え、期間をかけて補充される
+ROUTE_BUDGETS = {
+    "search": os.getenv("RATE_LIMIT_SEARCH", "10/minute"),
+    "search_batch": os.getenv("SEARCH_BATCH_RATE_LIMIT", "3000/minute"),
+    "ask": os.getenv("RATE_LIMIT_ASK", "100000/hour"),
+    "chunk": os.getenv("RATE_LIMIT_CHUNK", "5000/hour"),
+    "notion_import": os.getenv("RATE_LIMIT_NOTION_IMPORT", "2000/hour"),
+    # Embeddingを使わないバックグラウンドジョブ（分析・重複レポート）は1件ずつ数える
+    "jobs": os.getenv("RATE_LIMIT_JOBS", "60/hour"),
+}
+# ユーザーごとの全ルート合計の予算
+USER_BUDGET = os.getenv("RATE_LIMIT_USER_BUDGET", "200000/hour")
+
+# 認証済みのユーザーIDをゲートウェイが付与する場合のみヘッダーを信頼する（それ以外はIPアドレス単位）
+USER_HEADER = os.getenv("RATE_LIMIT_USER_HEADER", "X-User-Id")
+TRUST_USER_HEADER = os.getenv("RATE_LIMIT_TRUST_USER_HEADER", "false").lower() == "true"
+
+# 使われていないバケットを削除する間隔と、削除するまでの未使用期間（最長の補充期間より長くする）
+PRUNE_INTERVAL_SECONDS = 600
+PRUNE_IDLE_SECONDS = int(os.getenv("RATE_LIMIT_PRUNE_IDLE_SECONDS", "86400"))
+
+# プロセス内の推定値を保持するバケット数の上限
+MAX_LOCAL_ESTIMATES = 100_000
+
+
+@dataclass(frozen=True)
+class Budget:
+    """トークンバケットの容量と補充速度（コスト/秒）"""
+    capacity: float
+    rate: float
+    
+    @classmethod
+    def parse(cls, limit_value: str) -> "Budget":
+        """「3000/minute」形式の表記から作成"""
+        item = parse_rate_limit(limit_value)
+        return cls(float(item.amount), item.amount / item.get_expiry())
+    
+    def refill(self, tokens: float, elapsed: float) -> float:
+        return min(self.capacity, tokens + max(elapsed, 0.0) * self.rate)
+
+
+@dataclass
+class Decision:
+    """消費の結果（retry_after が None の拒否は、待っても予算内に収まらないコスト）"""
+    allowed: bool
+    # バケットごとの残り（拒否した場合は消費前の値）
+    tokens: Dict[str, float]
+    retry_after: Optional[float] = None
+    
+    @property
+    def remaining(self) -> float:
+        return min(self.tokens.values()) if self.tokens else 0.0
+
+
+Buckets = List[Tuple[str, Budget]]
+
+
+def _decide(buckets: Buckets, levels: Dict[str, float], cost: float) -> Decision:
+    """消費前の残りから、全バケットで消費できるか判定"""
+    
+    short = [(cost - levels[key]) / budget.rate for key, budget in buckets if levels[key] < cost]
+    if not short:
+        return Decision(True, {key: levels[key] - cost for key, _ in buckets})
+    return Decision(False, levels, max(short))
+
+
+class MemoryBucketStore:
+    """プロセス内のトークンバケット（単一プロセスでの運用・開発用、DB障害時の代替）"""
+    
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+    
+    async def consume(self, buckets: Buckets, cost: float) -> Decision:
+        now = time.monotonic()
+        with self._lock:
+            levels = {}
+            for key, budget in buckets:
+                tokens, updated_at = self._buckets.get(key, (budget.capacity, now))
+                levels[key] = budget.refill(tokens, now - updated_at)
+            decision = _decide(buckets, levels, cost)
+            for key, tokens in decision.tokens.items():
+                self._buckets[key] = (tokens, now)
+        return decision
+    
+    async def prune(self, idle_seconds: float) -> None:
+        cutoff = time.monotonic() - idle_seconds
+        with self._lock:
+            for key in [key for key, (_, updated_at) in self._buckets.items() if updated_at < cutoff]:
+                del self._buckets[key]
+
+
+# 補充と消費を1文で行う（足りない場合は更新せず行を返さない）。時刻はDBの時計で揃える
+_CONSUME_SQL = text("""
+    WITH params AS (
+        SELECT CAST(:capacity AS float8) AS capacity, CAST(:rate AS float8) AS rate, CAST(:cost AS float8) AS cost
+    )
+    INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at)
+    SELECT :key, capacity - cost, clock_timestamp() FROM params
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = (SELECT LEAST(capacity, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at)::float8 * rate) - cost FROM params),
+        updated_at = clock_timestamp()
+    WHERE (SELECT LEAST(capacity, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at)::float8 * rate) >= cost FROM params)
+    RETURNING tokens
+""")
+
+_LEVELS_SQL = text("""
+    SELECT key, tokens, EXTRACT(EPOCH FROM clock_timestamp() - updated_at)::float8 AS elapsed
+    FROM rate_limit_buckets WHERE key = ANY(CAST(:keys AS varchar[]))
+""")
+
+
+class PostgresBucketStore:
+    """PostgreSQLのトークンバケット（全ワーカー・レプリカで共有）
+    
+    複数のバケット（ルートとユーザー全体）は1トランザクションで消費し、
+    どれかが足りない場合はロールバックしてどのバケットも消費しない。
+    """
+    
+    def __init__(self, engine: AsyncEngine):
+        self._engine = engine
+    
+    async def consume(self, buckets: Buckets, cost: float) -> Decision:
+        async with self._engine.connect() as conn:
+            consumed = {}
+            # 行ロックを取る順序を揃えてデッドロックを防ぐ
+            for key, budget in sorted(buckets, key=lambda bucket: bucket[0]):
+                row = (await conn.execute(_CONSUME_SQL, {
+                    "key": key, "capacity": budget.capacity, "rate": budget.rate, "cost": cost
+                })).first()
+                if row is None:
+                    break
+                consumed[key] = float(row.tokens)
+            if len(consumed) == len(buckets):
+                await conn.commit()
+                return Decision(True, consumed)
+            await conn.rollback()
+            
+            rows = (await conn.execute(_LEVELS_SQL, {"keys": [key for key, _ in buckets]})).all()
+            stored = {row.key: (float(row.tokens), float(row.elapsed)) for row in rows}
+            levels = {
+                key: budget.refill(*stored[key]) if key in stored else budget.capacity
+                for key, budget in buckets
+            }
+            return _decide(buckets, levels, cost)
+    
+    async def prune(self, idle_seconds: float) -> None:
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM rate_limit_buckets WHERE updated_at < clock_timestamp() - make_interval(secs => CAST(:idle AS float8))"),
+                {"idle": idle_seconds}
+            )
+
+
+class TokenBucketLimiter:
+    """ユーザー・ルートごとの予算を推定コストで消費するレート制限
+    
+    共有ストアに問い合わせる前に、プロセス内に残した各バケットの推定値で判定する。
+    推定値は最後に確認した残りに補充分を足したもので、他のプロセスの消費は含まないため
+    実際の残りの上限になる。推定値でも足りない場合はストアに問い合わせずに拒否する。
+    推定値の読み書きは辞書の要素の置き換えのみで、ロックは取らない。
+    """
+    
+    def __init__(
+        self,
+        store,
+        route_budgets: Optional[Dict[str, str]] = None,
+        user_budget: Optional[str] = None,
+        fallback: Optional[MemoryBucketStore] = None
+    ):
+        self.store = store
+        self.fallback = fallback or MemoryBucketStore()
+        self.route_budgets = {
+            route: Budget.parse(limit_value) for route, limit_value in (route_budgets or ROUTE_BUDGETS).items()
+        }
+        self.user_budget = Budget.parse(user_budget or USER_BUDGET)
+        self._estimates: Dict[str, Tuple[float, float]] = {}
+        self._last_prune = time.monotonic()
+    
+    def buckets(self, user: str, route: str) -> Buckets:
+        return [(f"route:{route}:{user}", self.route_budgets[route]), (f"user:{user}", self.user_budget)]
+    
+    async def charge(self, user: str, route: str, cost: float) -> Decision:
+        """ユーザーのルートごとの予算と全体の予算からコストを消費"""
+        
+        buckets = self.buckets(user, route)
+        cost = max(cost, 0.0)
+        if any(cost > budget.capacity for _, budget in buckets):
+            RATE_LIMIT_DECISIONS.labels(route, "too_large").inc()
+            return Decision(False, {key: budget.capacity for key, budget in buckets})
+        
+        # プロセス内の推定値で足りなければ共有ストアに問い合わせずに拒否
+        started = time.monotonic()
+        levels = {key: self._estimate(key, budget, started) for key, budget in buckets}
+        local = _decide(buckets, levels, cost)
+        if not local.allowed:
+            RATE_LIMIT_DECISIONS.labels(route, "local_rejected").inc()
+            return local
+        
+        try:
+            decision = await self.store.consume(buckets, cost)
+        except Exception as e:
+            # 共有ストアが使えない間はプロセス内の制限で代替する（制限は無効にしない）
+            print(f"Rate limit store unavailable, using local buckets: {e}")
+            RATE_LIMIT_DECISIONS.labels(route, "store_error").inc()
+            decision = await self.fallback.consume(buckets, cost)
+        
+        # ストアに問い合わせる前の時刻で記録し、推定値が実際の残りを下回らないようにする
+        if len(self._estimates) > MAX_LOCAL_ESTIMATES:
+            self._estimates = {}
+        for key, tokens in decision.tokens.items():
+            self._estimates[key] = (tokens, started)
+        RATE_LIMIT_DECISIONS.labels(route, "allowed" if decision.allowed else "rejected").inc()
+        self._maybe_prune()
+        return decision
+    
+    def _estimate(self, key: str, budget: Budget, now: float) -> float:
+        estimate = self._estimates.get(key)
+        if estimate is None:
+            return budget.capacity
+        tokens, updated_at = estimate
+        return budget.refill(tokens, now - updated_at)
+    
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        
+        async def prune():
+            try:
+                await self.store.prune(PRUNE_IDLE_SECONDS)
+                await self.fallback.prune(PRUNE_IDLE_SECONDS)
+            except Exception as e:
+                print(f"Failed to prune rate limit buckets: {e}")
+        
+        asyncio.get_running_loop().create_task(prune())
+
+
+def create_rate_limiter() -> TokenBucketLimiter:
+    """RATE_LIMIT_STORE（postgres / memory）に応じたレート制限を作成"""
+    
+    if os.getenv("RATE_LIMIT_STORE", "postgres").lower() == "memory":
+        return TokenBucketLimiter(MemoryBucketStore())
+    from database import async_engine
+    return TokenBucketLimiter(PostgresBucketStore(async_engine))
+
+
+def rate_limit_user(request: Request) -> str:
+    """レート制限の単位となるユーザー（信頼できるユーザーIDがなければIPアドレス）"""
+    
+    if TRUST_USER_HEADER:
+        user = request.headers.get(USER_HEADER)
+        if user:
+            return f"id:{user}"
+    return f"ip:{get_remote_address(request)}"
+
+
+# === 推定コスト ===
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（英数字は4文字、マルチバイト文字は1文字で1トークン）"""
+    
+    # UTF-8で増えたバイト数から、マルチバイト文字（日本語は3バイト）の数を見積もる
+    multibyte = (len(text.encode("utf-8")) - len(text)) // 2
+    return max(1, math.ceil((len(text) - multibyte) / 4) + multibyte)
+
+
+def search_cost(queries: List[str]) -> float:
+    """クエリのEmbeddingとベクトル検索（1クエリあたり最小コスト）"""
+    return sum(max(MIN_REQUEST_COST, estimate_tokens(query) * MODEL_WEIGHTS["embedding"]) for query in queries)
+
+
+def ask_cost(question: str) -> float:
+    """質問のEmbeddingと、コンテキストを含むプロンプト・最大長の回答"""
+    
+    tokens = estimate_tokens(question)
+    return (
+        tokens * MODEL_WEIGHTS["embedding"]
+        + (tokens + ASK_CONTEXT_TOKENS) * MODEL_WEIGHTS["prompt"]
+        + ASK_MAX_COMPLETION_TOKENS * MODEL_WEIGHTS["completion"]
+    )
+
+
+def chunk_cost(content: str) -> float:
+    """ドキュメント全体のEmbedding"""
+    return max(MIN_REQUEST_COST, estimate_tokens(content) * MODEL_WEIGHTS["embedding"])
+
+
+def notion_import_cost(pages: int) -> float:
+    """ページごとの取得とEmbedding（本文の長さは取得するまでわからないため推定値）"""
+    return pages * max(MIN_REQUEST_COST, NOTION_PAGE_TOKENS * MODEL_WEIGHTS["embedding"])
+
+
+def compare_cost(content: str, strategies: int, queries: Optional[List[str]] = None) -> float:
+    """チャンク分割戦略の比較（クエリを指定した場合は戦略ごとに全チャンクとクエリのEmbedding）"""
+    
+    if not queries:
+        return MIN_REQUEST_COST
+    return strategies * chunk_cost(content) + search_cost(queries)
+
+
+def job_cost(job_type: str, payload: Dict) -> Tuple[str, float]:
+    """バックグラウンドジョブを同期のAPIと同じ予算で数えるための（ルート, 推定コスト）"""
+    
+    if job_type == "chunk":
+        return "chunk", chunk_cost(payload.get("content") or "")
+    if job_type == "notion_import":
+        pages = len(set(payload.get("page_ids") or [])) or 1
+        return "notion_import", notion_import_cost(pages)
+    return "jobs", MIN_REQUEST_COST
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+from typing import List, Dict, Optional, Sequence
+import numpy as np
+from services.embeddings import normalize_rows
+
+# 多様化する場合に Pinecone から取る候補数（top_k × この倍数、上限あり）
+RERANK_OVERSAMPLE = int(os.getenv("RERANK_OVERSAMPLE", "4"))
+RERANK_MAX_CANDIDATES = int(os.getenv("RERANK_MAX_CANDIDATES", "100"))
+
+# MMRの関連度の重み（1.0で関連度のみ、0.0で多様性のみ）
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# 1つのドキュメントから返すチャンク数の上限（0で無制限）
+MAX_CHUNKS_PER_DOCUMENT = int(os.getenv("MAX_CHUNKS_PER_DOCUMENT", "2"))
+
+# 隣接チャンクの結合で重複とみなす最小・最大の文字数（チャンクのオーバーラップ分）
+MIN_MERGE_OVERLAP = 10
+MAX_MERGE_OVERLAP = 2000
+
+
+def candidate_count(top_k: int) -> int:
+    """多様化の前に取得する候補数"""
+    return max(top_k, min(top_k * RERANK_OVERSAMPLE, RERANK_MAX_CANDIDATES))
+
+
+def query_params(top_k: int, diversify: bool) -> Dict:
+    """Pineconeへの検索パラメータ（多様化する場合は多めの候補とベクトル値を取得）"""
+    if not diversify:
+        return {"top_k": top_k}
+    return {"top_k": candidate_count(top_k), "include_values": True}
+
+
+def mmr_select(
+    query: Sequence[float],
+    candidates: Sequence[Sequence[float]],
+    k: int,
+    lambda_mult: float = MMR_LAMBDA,
+    groups: Optional[Sequence] = None,
+    max_per_group: int = 0
+) -> List[int]:
+    """MMR (Maximal Marginal Relevance) で候補からk件を選び、選んだ順のインデックスを返す
+    
+    各ステップで λ·sim(q, d) − (1−λ)·max sim(d, 選択済み) が最大の候補を選ぶ。
+    類似度行列は最初に1回だけ計算し、選択済みとの最大類似度はベクトル演算で更新する。
+    groups（ドキュメントID）を指定した場合は、1グループあたり max_per_group 件までにする。
+    """
+    
+    vectors = normalize_rows(np.asarray(candidates, dtype=np.float32))
+    if len(vectors) == 0 or k <= 0:
+        return []
+    query_vector = normalize_rows(np.asarray(query, dtype=np.float32)[None, :])[0]
+    relevance = vectors @ query_vector
+    similarity = vectors @ vectors.T
+    
+    # コサイン類似度の最小値で初期化（最初の1件は関連度だけで決まる）
+    redundancy = np.full(len(vectors), -1.0, dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    if groups is not None and max_per_group > 0:
+        _, group_ids = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+        group_counts = np.zeros(group_ids.max() + 1, dtype=np.int64)
+    else:
+        group_ids = None
+    
+    selected = []
+    for _ in range(min(k, len(vectors))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not available[best]:
+            break
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        if group_ids is not None:
+            group_counts[group_ids[best]] += 1
+            if group_counts[group_ids[best]] >= max_per_group:
+                available[group_ids == group_ids[best]] = False
+    return selected
+
+
+def rerank_matches(
+    query: Sequence[float],
+    matches: List,
+    top_k: int,
+    lambda_mult: Optional[float] = None,
+    max_per_document: Optional[int] = None
+) -> List:
+    """Pineconeの検索結果（include_values=True）をMMRとドキュメントごとの上限で並べ替える"""
+    
+    # 値のない結果（include_values なし）は並べ替えずに上位を返す
+    if not matches or any(not match.values for match in matches):
+        return list(matches)[:top_k]
+    
+    order = mmr_select(
+        query,
+        [match.values for match in matches],
+        top_k,
+        lambda_mult=MMR_LAMBDA if lambda_mult is None else lambda_mult,
+        groups=[(match.metadata or {}).get("document_id") for match in matches],
+        max_per_group=MAX_CHUNKS_PER_DOCUMENT if max_per_document is None else max_per_document
+    )
+    return [matches[i] for i in order]
+
+
+def merge_adjacent_chunks(chunks: List[Dict]) -> List[Dict]:
+    """同じドキュメントの連続するチャンク（chunk_index が隣り合うもの）を1件に結合
+    
+    オーバーラップ部分は重複させずにつなぎ、スコアは最大値にする。
+    結合した結果は、含まれるチャンクのうち最も上位の位置に置く。
+    """
+    
+    by_document: Dict[str, List[int]] = {}
+    for position, chunk in enumerate(chunks):
+        if chunk.get("chunk_index") is not None:
+            by_document.setdefault(chunk.get("document_id"), []).append(position)
+    
+    # 連続するチャンクの位置をまとめ、最も上位の位置を代表にする
+    head_of: Dict[int, int] = {}
+    runs: Dict[int, List[int]] = {}
+    for positions in by_document.values():
+        positions.sort(key=lambda p: int(chunks[p]["chunk_index"]))
+        run = [positions[0]]
+        for position in positions[1:] + [None]:
+            if position is not None and int(chunks[position]["chunk_index"]) == int(chunks[run[-1]]["chunk_index"]) + 1:
+                run.append(position)
+                continue
+            runs[min(run)] = run
+            head_of.update({p: min(run) for p in run})
+            run = [position]
+    
+    results = []
+    for position, chunk in enumerate(chunks):
+        if position not in head_of:
+            results.append(chunk)
+        elif head_of[position] == position:
+            run = runs[position]
+            results.append(chunk if len(run) == 1 else _merge_run([chunks[p] for p in run]))
+    return results
+
+
+def _merge_run(run: List[Dict]) -> Dict:
+    text = run[0].get("chunk_text") or ""
+    for chunk in run[1:]:
+        text = join_overlapping(text, chunk.get("chunk_text") or "")
+    return {
+        **run[0],
+        "chunk_text": text,
+        "score": max(chunk["score"] for chunk in run),
+        "chunk_indices": [chunk["chunk_index"] for chunk in run]
+    }
+
+
+def join_overlapping(first: str, second: str) -> str:
+    """前のチャンクの末尾と次のチャンクの先頭の重複を除いて結合"""
+    
+    tail = first[-MAX_MERGE_OVERLAP:]
+    prefix = second[:MIN_MERGE_OVERLAP]
+    # 次のチャンクの先頭が現れる位置のうち、最も前（重複が最も長い）ものから確認する
+    start = tail.find(prefix) if len(prefix) == MIN_MERGE_OVERLAP else -1
+    while start != -1:
+        if second.startswith(tail[start:]):
+            return first + second[len(tail) - start:]
+        start = tail.find(prefix, start + 1)
+    # 重複が見つからない場合（区切りで空白が落ちた場合など）は段落として結合
+    return f"{first}\n\n{second}"
\ No newline at end of file
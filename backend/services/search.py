@@ -1,39 +1,131 @@
 import os
+import asyncio
 from typing import List, Dict
-from openai import OpenAI
-from pinecone import Pinecone
+from services.clients import get_openai_client, get_index
+from services.chunk_store import fetch_chunk_texts
+from services.embeddings import embedding_params
+from services.rerank import query_params, rerank_matches, merge_adjacent_chunks
+from services.upstream import call_upstream
+from metrics import stage_timer, record_token_usage
 
-# クライアント初期化
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index(os.getenv("PINECONE_INDEX_NAME"))
+# 1回のEmbedding API呼び出しで送れる入力数の上限
+EMBEDDING_MAX_INPUTS = 2048
 
-async def search_similar_chunks(query: str, top_k: int = 5) -> List[Dict]:
-    """クエリに類似するチャンクを検索"""
-    
-    # 1. クエリをベクトル化
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=query
-    )
+# バッチ検索でPineconeに同時に送るクエリ数
+BATCH_QUERY_CONCURRENCY = int(os.getenv("SEARCH_BATCH_CONCURRENCY", "16"))
+
+async def search_similar_chunks(query: str, top_k: int = 5, diversify: bool = False) -> List[Dict]:
+    """クエリに類似するチャンクを検索
+    
+    diversify を指定すると、多めに取った候補をMMRとドキュメントごとの上限で選び直し、
+    連続するチャンクを1件に結合して返す。
+    """
+    
+    # 1. クエリをベクトル化（同期クライアントはスレッドで呼び、イベントループを止めない）
+    with stage_timer("search", "embed"):
+        response = await call_upstream(
+            "openai", "embed", get_openai_client().embeddings.create,
+            hedge=True,
+            timeout_arg="timeout",
+            **embedding_params(),
+            input=query
+        )
+    record_token_usage(embedding_params()["model"], response.usage)
     query_embedding = response.data[0].embedding
     
     # 2. Pineconeで類似検索
-    results = index.query(
-        vector=query_embedding,
-        top_k=top_k,
-        include_metadata=True
-    )
+    with stage_timer("search", "vector_query"):
+        results = await call_upstream(
+            "pinecone", "query", get_index().query,
+            hedge=True,
+            vector=query_embedding,
+            include_metadata=True,
+            **query_params(top_k, diversify)
+        )
+    
+    matches = results.matches
+    if diversify:
+        with stage_timer("search", "rerank"):
+            matches = rerank_matches(query_embedding, matches, top_k)
+    
+    # 3. チャンク本文をベクトルIDでまとめて取得
+    with stage_timer("search", "chunk_lookup"):
+        texts = await asyncio.to_thread(fetch_chunk_texts, [match.id for match in matches])
+    
+    # 4. 結果を整形
+    return _format_matches(matches, texts, diversify)
+
+
+async def search_similar_chunks_batch(queries: List[str], top_k: int = 5, diversify: bool = False) -> List[List[Dict]]:
+    """複数クエリをまとめて検索し、クエリと同じ順序で結果を返す
+    
+    ベクトル化は1回のAPI呼び出しにまとめ（同じクエリは1回だけ）、Pineconeへの検索は
+    同時実行数を制限して並行に行い、チャンク本文は全クエリ分を1回で取得する。
+    """
+    
+    unique_queries = list(dict.fromkeys(queries))
+    
+    # 1. クエリをまとめてベクトル化
+    with stage_timer("search_batch", "embed"):
+        embeddings = {}
+        for start in range(0, len(unique_queries), EMBEDDING_MAX_INPUTS):
+            batch = unique_queries[start:start + EMBEDDING_MAX_INPUTS]
+            response = await call_upstream(
+                "openai", "embed", get_openai_client().embeddings.create,
+                hedge=True,
+                timeout_arg="timeout",
+                **embedding_params(),
+                input=batch
+            )
+            record_token_usage(embedding_params()["model"], response.usage)
+            for item in response.data:
+                embeddings[batch[item.index]] = item.embedding
+    
+    # 2. Pineconeで並行に類似検索
+    index = get_index()
+    semaphore = asyncio.Semaphore(BATCH_QUERY_CONCURRENCY)
+    
+    async def query(text: str):
+        async with semaphore:
+            return await call_upstream(
+                "pinecone", "query", index.query,
+                hedge=True, vector=embeddings[text], include_metadata=True, **query_params(top_k, diversify)
+            )
+    
+    with stage_timer("search_batch", "vector_query"):
+        results = dict(zip(unique_queries, await asyncio.gather(*[query(text) for text in unique_queries])))
+    
+    matches = {text: result.matches for text, result in results.items()}
+    if diversify:
+        with stage_timer("search_batch", "rerank"):
+            matches = {text: rerank_matches(embeddings[text], found, top_k) for text, found in matches.items()}
+    
+    # 3. 全クエリのチャンク本文を1回で取得
+    with stage_timer("search_batch", "chunk_lookup"):
+        texts = await asyncio.to_thread(
+            fetch_chunk_texts, [match.id for found in matches.values() for match in found]
+        )
+    
+    return [_format_matches(matches[text], texts, diversify) for text in queries]
+
+
+def _format_matches(matches, texts: Dict[str, str], merge_adjacent: bool = False) -> List[Dict]:
+    """検索結果を整形（移行前のベクトルはメタデータの本文を使う）
+    
+    重複のため複数のドキュメントが共有しているチャンクは、shared_with に他のドキュメントのIDを含める。
+    """
     
-    # 3. 結果を整形
     chunks = []
-    for match in results.matches:
-        chunks.append({
+    for match in matches:
+        chunk = {
             "document_id": match.metadata.get("document_id"),
             "title": match.metadata.get("title"),
-            "chunk_text": match.metadata.get("chunk_text"),
+            "chunk_text": texts.get(match.id, match.metadata.get("chunk_text")),
             "chunk_index": match.metadata.get("chunk_index"),
             "score": match.score
-        })
-    
-    return chunks
\ No newline at end of file
+        }
+        shared_with = [i for i in match.metadata.get("document_ids") or [] if i != chunk["document_id"]]
+        if shared_with:
+            chunk["shared_with"] = shared_with
+        chunks.append(chunk)
+    return merge_adjacent_chunks(chunks) if merge_adjacent else chunks
\ No newline at end of file
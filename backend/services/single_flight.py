@@ -0,0 +1,149 @@
+import json
+import asyncio
+import contextvars
+import unicodedata
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+from services.upstream import DeadlineExceeded, detached_deadline_context, remaining_time
+from metrics import SINGLE_FLIGHT
+
+T = TypeVar("T")
+
+
+def normalize_text(text: str) -> str:
+    """全角/半角と空白の違いを吸収（同じ質問として扱うため）"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def request_key(**fields: Any) -> str:
+    """リクエストの内容から単一実行のキーを作成（文字列は正規化、リストは順序を無視）"""
+    
+    normalized = {}
+    for name, value in fields.items():
+        if isinstance(value, str):
+            value = normalize_text(value)
+        elif isinstance(value, (list, tuple)):
+            value = sorted(normalize_text(v) if isinstance(v, str) else v for v in value)
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+class Broadcast:
+    """1つの非同期ストリームを複数の購読者に配信する
+    
+    途中から購読した場合も、それまでに生成された要素から順に受け取る。
+    購読者が全員いなくなった場合は元のストリームを中断する。
+    """
+    
+    def __init__(
+        self,
+        source: AsyncIterator,
+        on_done: Optional[Callable[[], None]] = None,
+        context: Optional[contextvars.Context] = None
+    ):
+        self.items: List = []
+        self.done = False
+        # 購読者がいなくなって中断した（新しい購読者は受け付けない）
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Condition()
+        self._on_done = on_done
+        self._task = asyncio.create_task(self._pump(source), context=context)
+    
+    async def _pump(self, source: AsyncIterator) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                async with self._changed:
+                    self._changed.notify_all()
+        except asyncio.CancelledError:
+            # 中断後に購読を始めたリクエストには途中までの結果で終わらせずエラーにする
+            self.error = RuntimeError("stream was cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            if self._on_done is not None:
+                self._on_done()
+            async with self._changed:
+                self._changed.notify_all()
+    
+    async def subscribe(self) -> AsyncIterator:
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(self.items):
+                    yield self.items[position]
+                    position += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self.done or position < len(self.items))
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.closed = True
+                self._task.cancel()
+
+
+class SingleFlight:
+    """同じキーで実行中の処理を1つにまとめる（プロセス内）
+    
+    同時に届いた同じリクエストは最初のリクエスト（leader）の処理結果を共有する。
+    処理が終わるとキーは削除されるため、結果のキャッシュにはならない。
+    共有する処理は leader の期限を引き継がず deadline_seconds を期限にして実行し、
+    各リクエストは自分の期限までだけ結果を待つ（短い期限のリクエストが他を巻き込まない）。
+    """
+    
+    def __init__(self, operation: str, deadline_seconds: Optional[float] = None):
+        self.operation = operation
+        self.deadline_seconds = deadline_seconds
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, Broadcast] = {}
+    
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """実行中の同じキーの処理があればその結果を待ち、なければ実行する"""
+        
+        future = self._calls.get(key)
+        if future is None:
+            SINGLE_FLIGHT.labels(self.operation, "leader").inc()
+            future = asyncio.create_task(func(), context=detached_deadline_context(self.deadline_seconds))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(self._calls, key, f))
+        else:
+            SINGLE_FLIGHT.labels(self.operation, "follower").inc()
+        # 1つのリクエストが切断・期限切れになっても共有している処理は取り消さない
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=remaining_time())
+        except TimeoutError as e:
+            raise DeadlineExceeded(self.operation, "deadline exceeded while waiting for the shared request") from e
+    
+    def stream(self, key: str, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """実行中の同じキーのストリームがあれば生成済みの要素から購読し、なければ開始する"""
+        
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.done or broadcast.closed:
+            SINGLE_FLIGHT.labels(self.operation, "leader").inc()
+            broadcast = Broadcast(
+                factory(),
+                on_done=lambda: self._forget(self._streams, key, broadcast),
+                context=detached_deadline_context(self.deadline_seconds)
+            )
+            self._streams[key] = broadcast
+        else:
+            SINGLE_FLIGHT.labels(self.operation, "follower").inc()
+        return broadcast.subscribe()
+    
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+    
+    @staticmethod
+    def _forget(calls: Dict, key: str, value: Any) -> None:
+        # 後から同じキーで始まった処理は消さない
+        if calls.get(key) is value:
+            del calls[key]
\ No newline at end of file
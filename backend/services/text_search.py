@@ -0,0 +1,162 @@
+import re
+from typing import List, Dict, Optional, Tuple
+from sqlalchemy import text, func, select, or_, and_, case, literal
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from models import Document, SEARCH_VECTOR_EXPRESSION
+
+TEXT_SEARCH_CONFIG = "simple"
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+# pg_trgm拡張が使えるか（初回検索時に確認）
+_trigram_enabled: Optional[bool] = None
+
+# 'simple' 設定は空白・記号でしか単語を区切らないため、日本語（かな・漢字）を含む語は
+# 文中の一部として一致しない（「設定」で「Dockerの設定方法」が見つからない）。
+# こうした語は tsvector ではなく部分一致で検索する。
+CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿ｦ-ﾟ]")
+
+# 部分一致のスコア（ts_rank_cd の既定の重み A=1.0, B=0.4 に合わせる）
+TITLE_MATCH_WEIGHT = 1.0
+CONTENT_MATCH_WEIGHT = 0.4
+# 部分一致のスニペットで一致箇所の前後に含める文字数
+SNIPPET_CONTEXT_CHARS = 60
+
+
+def ensure_text_search(engine: Engine) -> None:
+    """全文検索用のカラムとトライグラムインデックスを作成（PostgreSQLのみ）"""
+    global _trigram_enabled
+    
+    if engine.dialect.name != "postgresql":
+        return
+    
+    # 既存テーブルには生成カラムを後から追加
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE documents ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ({SEARCH_VECTOR_EXPRESSION}) STORED"
+        ))
+    
+    # タイトルのあいまい検索（pg_trgmがない環境では無効化）
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_documents_title_trgm "
+                "ON documents USING gin (title gin_trgm_ops)"
+            ))
+            # 日本語の部分一致（3文字以上の語の ILIKE）用
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_documents_content_trgm "
+                "ON documents USING gin (content gin_trgm_ops)"
+            ))
+        _trigram_enabled = True
+    except Exception as e:
+        print(f"pg_trgm is not available, fuzzy title search disabled: {e}")
+        _trigram_enabled = False
+
+
+def _has_trigram(db: Session) -> bool:
+    """pg_trgm拡張がインストール済みか確認"""
+    global _trigram_enabled
+    
+    if _trigram_enabled is None:
+        installed = db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+        _trigram_enabled = installed is not None
+    return _trigram_enabled
+
+
+def split_query(query: str) -> Tuple[str, List[str]]:
+    """クエリを tsvector で検索する部分と、部分一致で検索する日本語の語に分ける"""
+    
+    words, cjk_terms = [], []
+    for word in query.split():
+        if CJK_PATTERN.search(word):
+            term = word.strip('"')
+            if term:
+                cjk_terms.append(term)
+        else:
+            words.append(word)
+    return " ".join(words), cjk_terms
+
+
+def _substring_score(term: str):
+    """部分一致のスコア（タイトルに含まれるか + 本文中の出現回数）"""
+    
+    term = term.lower()
+    content = func.lower(func.coalesce(Document.content, ""))
+    occurrences = (func.length(content) - func.length(func.replace(content, term, ""))) / len(term)
+    title_match = case((func.strpos(func.lower(func.coalesce(Document.title, "")), term) > 0, TITLE_MATCH_WEIGHT), else_=0.0)
+    return title_match + CONTENT_MATCH_WEIGHT * func.ln(1 + occurrences)
+
+
+def _substring_snippet(term: str):
+    """本文中の最初の一致箇所の前後を切り出し、一致した語を強調したスニペット"""
+    
+    position = func.strpos(func.lower(Document.content), term.lower())
+    start = func.greatest(position - SNIPPET_CONTEXT_CHARS, 1)
+    fragment = func.substr(Document.content, start, len(term) + 2 * SNIPPET_CONTEXT_CHARS)
+    return func.regexp_replace(fragment, re.escape(term), "<mark>\\&</mark>", "gi")
+
+
+def search_documents_text(db: Session, query: str, top_k: int = 10, fuzzy: bool = True) -> List[Dict]:
+    """tsvector全文検索 + タイトルのトライグラム検索でドキュメントを検索
+    
+    日本語（かな・漢字）を含む語は 'simple' 設定の tsvector では文中の一部として一致しないため、
+    タイトル・本文の部分一致で検索する（すべての語を含むドキュメントが対象）。
+    """
+    
+    words, cjk_terms = split_query(query)
+    tsquery = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, words)
+    if words or not cjk_terms:
+        score = func.ts_rank_cd(Document.search_vector, tsquery)
+        conditions = [Document.search_vector.op("@@")(tsquery)]
+    else:
+        score = literal(0.0)
+        conditions = []
+    for term in cjk_terms:
+        score = score + _substring_score(term)
+        conditions.append(or_(
+            Document.title.icontains(term, autoescape=True),
+            Document.content.icontains(term, autoescape=True)
+        ))
+    condition = and_(*conditions)
+    
+    if fuzzy and _has_trigram(db):
+        score = score + func.similarity(Document.title, query)
+        condition = or_(condition, Document.title.op("%")(query))
+    
+    # まず上位top_k件のIDだけを決め、ハイライトはその件数分だけ作成
+    ranked = (
+        select(Document.id, score.label("score"))
+        .where(condition)
+        .order_by(score.desc(), Document.id.desc())
+        .limit(top_k)
+        .subquery()
+    )
+    if words or not cjk_terms:
+        snippet = func.ts_headline(TEXT_SEARCH_CONFIG, Document.content, tsquery, HEADLINE_OPTIONS)
+    else:
+        snippet = _substring_snippet(cjk_terms[0])
+    stmt = (
+        select(
+            Document.id,
+            Document.title,
+            Document.created_at,
+            ranked.c.score,
+            snippet.label("snippet")
+        )
+        .join(ranked, ranked.c.id == Document.id)
+        .order_by(ranked.c.score.desc(), Document.id.desc())
+    )
+    
+    return [
+        {
+            "document_id": row.id,
+            "title": row.title,
+            "snippet": row.snippet,
+            "score": float(row.score),
+            "created_at": row.created_at
+        }
+        for row in db.execute(stmt)
+    ]
\ No newline at end of file
@@ -0,0 +1,382 @@
+import os
+import time
+import random
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple, TypeVar
+from metrics import UPSTREAM_CALLS, UPSTREAM_CIRCUIT_STATE, UPSTREAM_LATENCY
+
+T = TypeVar("T")
+
+# 1回の呼び出しの最大試行回数（初回を含む）
+MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+
+# 指数バックオフの基準と上限（秒）。待ち時間は 0〜min(上限, 基準×2^n) から一様に選ぶ
+BACKOFF_BASE_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_BASE_SECONDS", "0.2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MAX_SECONDS", "5"))
+
+# ヘッジ: p95を超えても応答がない呼び出しに2つ目のリクエストを送る（冪等な呼び出しのみ）
+HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "true").lower() == "true"
+# ヘッジの遅延を決めるのに必要な成功レイテンシのサンプル数と、保持するサンプル数
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+# ヘッジで増えるリクエストの上限（呼び出し数に対する割合）
+HEDGE_MAX_RATIO = float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.1"))
+
+# サーキットブレーカー: 連続失敗回数で開き、一定時間後に1件だけ試行を通す
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+
+# 再試行の対象とするHTTPステータス
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """外部APIの一時的な障害で呼び出しを完了できなかった"""
+    
+    def __init__(self, dependency: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{dependency}: {message}")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+
+class DeadlineExceeded(UpstreamError):
+    """リクエストの期限までに呼び出しが終わらなかった"""
+
+
+# === 期限 ===
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """この中の外部API呼び出しに期限を設定（外側の期限より長くはしない）
+    
+    期限はcontextvarsで保持するため、asyncio.to_thread やタスクにも引き継がれる。
+    """
+    
+    current = _deadline.get()
+    deadline = current
+    if seconds is not None:
+        deadline = time.monotonic() + seconds
+        if current is not None:
+            deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def detached_deadline_context(seconds: Optional[float]) -> contextvars.Context:
+    """呼び出し元の期限を引き継がず、seconds 秒後を期限にしたコンテキスト
+    
+    複数のリクエストで共有する処理（単一実行）を、最初のリクエストの短い期限で打ち切らないようにする。
+    """
+    
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None if seconds is None else time.monotonic() + seconds)
+    return context
+
+
+def remaining_time() -> Optional[float]:
+    """期限までの残り秒数（期限がなければNone）"""
+    
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# === エラーの分類 ===
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for name in ("status_code", "status"):
+        value = getattr(error, name, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """再試行で成功する可能性のあるエラーか（429・5xx・接続エラー・タイムアウト）"""
+    
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    # SDKごとの接続エラー（openai.APIConnectionError、urllib3の例外など）
+    return any("Connection" in cls.__name__ or "Timeout" in cls.__name__ for cls in type(error).__mro__)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """レスポンスの Retry-After（秒数またはHTTP日付）、retry-after-ms を秒で返す"""
+    
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    lowered = {str(key).lower(): value for key, value in headers.items()}
+    try:
+        if lowered.get("retry-after-ms"):
+            return float(lowered["retry-after-ms"]) / 1000
+        value = lowered.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """attempt回目（1始まり）の失敗後の待ち時間（フルジッター、Retry-Afterがあればそれ以上待つ）"""
+    
+    if retry_after is not None:
+        # 同時に待っていたリクエストが一斉に再送しないよう、少しずらす
+        return retry_after + random.uniform(0, BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+# === サーキットブレーカー ===
+
+class CircuitBreaker:
+    """依存先ごとのサーキットブレーカー
+    
+    closed: 通常どおり呼び出す。再試行可能なエラー（429を除く）が連続すると open にする。
+    open: 呼び出さずに CircuitOpenError にする。reset_seconds 経過後は half_open。
+    half_open: 1件だけ試行を通し、成功すれば closed、失敗すれば再び open にする。
+    """
+    
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+    
+    def __init__(
+        self,
+        dependency: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS
+    ):
+        self.dependency = dependency
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._set_state("closed")
+    
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+    
+    def before_call(self) -> None:
+        """呼び出してよいか確認（開いている場合は CircuitOpenError）"""
+        
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            self._set_state("half_open")
+            return
+        retry_after = max(self.opened_at + self.reset_seconds - time.monotonic(), 0.0)
+        raise CircuitOpenError(self.dependency, "circuit breaker is open", retry_after or None)
+    
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.opened_at is not None:
+            self.opened_at = None
+            self._probing = False
+            self._set_state("closed")
+    
+    def release_probe(self) -> None:
+        """試行がキャンセルされた場合は結果が分からないため、次の呼び出しで試行し直す"""
+        self._probing = False
+    
+    def record_failure(self, error: BaseException) -> None:
+        # レート制限はサービスの障害ではないため数えない
+        if not is_retryable(error) or _status_code(error) == 429:
+            if self._probing:
+                self.record_success()
+            return
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._probing = False
+            self._set_state("open")
+    
+    def _set_state(self, state: str) -> None:
+        UPSTREAM_CIRCUIT_STATE.labels(self.dependency).set(self.STATES[state])
+
+
+# === ヘッジ用のレイテンシ ===
+
+class LatencyTracker:
+    """成功した呼び出しの直近のレイテンシからp95を求め、ヘッジの回数を制限する"""
+    
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+    
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+    
+    def hedge_delay(self) -> Optional[float]:
+        """ヘッジを送るまでの待ち時間（サンプル不足・ヘッジの上限に達した場合はNone）"""
+        
+        if len(self.samples) < HEDGE_MIN_SAMPLES or self.hedges >= self.calls * HEDGE_MAX_RATIO:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[Tuple[str, str], LatencyTracker] = {}
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    if dependency not in _breakers:
+        _breakers[dependency] = CircuitBreaker(dependency)
+    return _breakers[dependency]
+
+
+def _get_latency(dependency: str, operation: str) -> LatencyTracker:
+    key = (dependency, operation)
+    if key not in _latencies:
+        _latencies[key] = LatencyTracker()
+    return _latencies[key]
+
+
+def reset_upstream_state() -> None:
+    """サーキットブレーカーとレイテンシの記録を破棄（テスト用）"""
+    _breakers.clear()
+    _latencies.clear()
+
+
+# === 呼び出し ===
+
+async def call_upstream(
+    dependency: str,
+    operation: str,
+    func: Callable[..., T],
+    *args: Any,
+    hedge: bool = False,
+    timeout_arg: Optional[str] = None,
+    **kwargs: Any
+) -> T:
+    """外部APIの同期関数をスレッドで呼び出す（再試行・ヘッジ・サーキットブレーカー・期限付き）
+    
+    429・5xx・接続エラーは Retry-After を守りつつジッター付きの指数バックオフで再試行する。
+    hedge=True は冪等な呼び出し（Embedding、検索クエリ）にのみ指定し、直近のp95を
+    超えても応答がない場合に同じリクエストをもう1つ送って早い方の結果を使う。
+    再試行しても失敗した場合は UpstreamError、期限切れは DeadlineExceeded を送出する。
+    再試行しないエラー（400など）はそのまま送出する。
+    timeout_arg を指定した場合は、期限までの残り時間をその名前の引数で関数にも渡す
+    （期限を過ぎたリクエストをクライアント側でも打ち切る）。
+    """
+    
+    breaker = get_breaker(dependency)
+    latency = _get_latency(dependency, operation)
+    latency.calls += 1
+    
+    attempt = 0
+    while True:
+        attempt += 1
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            UPSTREAM_CALLS.labels(dependency, operation, "deadline_exceeded").inc()
+            raise DeadlineExceeded(dependency, f"deadline exceeded before {operation}")
+        breaker.before_call()
+        if timeout_arg is not None and remaining is not None:
+            kwargs[timeout_arg] = remaining
+        try:
+            result = await asyncio.wait_for(
+                _attempt(dependency, operation, latency, func, args, kwargs, hedge and HEDGE_ENABLED),
+                timeout=remaining
+            )
+        except asyncio.CancelledError:
+            # CancelledError は Exception ではないため、ここで試行中の状態を戻す
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if isinstance(e, TimeoutError) and remaining is not None and remaining_time() <= 0:
+                breaker.record_failure(e)
+                UPSTREAM_CALLS.labels(dependency, operation, "deadline_exceeded").inc()
+                raise DeadlineExceeded(dependency, f"{operation} did not finish before the deadline") from e
+            breaker.record_failure(e)
+            if not is_retryable(e):
+                UPSTREAM_CALLS.labels(dependency, operation, "error").inc()
+                raise
+            retry_after = retry_after_seconds(e)
+            delay = backoff_delay(attempt, retry_after)
+            remaining = remaining_time()
+            if attempt >= MAX_ATTEMPTS or (remaining is not None and delay >= remaining):
+                UPSTREAM_CALLS.labels(dependency, operation, "error").inc()
+                raise UpstreamError(dependency, f"{operation} failed after {attempt} attempts: {e}", retry_after) from e
+            UPSTREAM_CALLS.labels(dependency, operation, "retry").inc()
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        UPSTREAM_CALLS.labels(dependency, operation, "success").inc()
+        return result
+
+
+async def _attempt(
+    dependency: str,
+    operation: str,
+    latency: LatencyTracker,
+    func: Callable[..., T],
+    args: tuple,
+    kwargs: Dict,
+    hedge: bool
+) -> T:
+    """1回の試行（遅い場合はヘッジを送り、先に成功した方を返す）"""
+    
+    async def run() -> T:
+        start = time.perf_counter()
+        result = await asyncio.to_thread(func, *args, **kwargs)
+        elapsed = time.perf_counter() - start
+        latency.record(elapsed)
+        UPSTREAM_LATENCY.labels(dependency, operation).observe(elapsed)
+        return result
+    
+    primary = asyncio.ensure_future(run())
+    delay = latency.hedge_delay() if hedge else None
+    if delay is None:
+        return await primary
+    
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    
+    latency.hedges += 1
+    UPSTREAM_CALLS.labels(dependency, operation, "hedge").inc()
+    secondary = asyncio.ensure_future(run())
+    pending = {primary, secondary}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is secondary:
+                        UPSTREAM_CALLS.labels(dependency, operation, "hedge_won").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # 遅い方の結果は使わない（スレッドは完了まで動くが待たない）
+        for task in pending:
+            task.cancel()
\ No newline at end of file
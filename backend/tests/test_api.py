@@ -7,6 +7,22 @@ def test_health_check(client):
     assert response.status_code == 200
     assert response.json() == {"status": "healthy"}
 
+def test_db_pool_stats(client):
+    """コネクションプール統計エンドポイントのテスト"""
+    response = client.get("/health/db/pool")
+    assert response.status_code == 200
+    data = response.json()
+    assert {"sync", "async"} <= set(data)
+    assert all("utilization" in stats for stats in data.values())
+
+def test_metrics_endpoint(client):
+    """Prometheusメトリクスエンドポイントのテスト"""
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in response.text
+    assert "db_pool_utilization" in response.text
+
 def test_root_endpoint(client):
     """ルートエンドポイントのテスト"""
     response = client.get("/")
@@ -22,8 +38,8 @@ class TestChunkingAPI:
         # ここでは構造テストのみ
         response = client.post("/api/chunk", json=sample_document)
         
-        # 環境変数が設定されていない場合は500エラー
-        if response.status_code == 500:
+        # 環境変数が設定されていない場合は500エラー、外部APIに接続できない場合は503エラー
+        if response.status_code in (500, 503):
             assert "detail" in response.json()
         else:
             assert response.status_code == 200
@@ -35,6 +51,21 @@ class TestChunkingAPI:
             # title, content が欠如
         })
         assert response.status_code == 422  # Validation error
+    
+    def test_chunk_document_invalid_size_unit(self, client, sample_document):
+        """不正なサイズ単位のテスト"""
+        response = client.post("/api/chunk", json={**sample_document, "size_unit": "words"})
+        assert response.status_code == 422
+    
+    @pytest.mark.parametrize("sizes", [
+        {"chunk_size": 0},
+        {"overlap": -1},
+        {"chunk_size": 100, "overlap": 100},
+    ])
+    def test_chunk_document_invalid_sizes(self, client, sample_document, sizes):
+        """チャンクサイズ・オーバーラップが不正な場合は422になることのテスト"""
+        response = client.post("/api/chunk", json={**sample_document, **sizes})
+        assert response.status_code == 422
 
 class TestSearchAPI:
     """検索APIのテスト"""
@@ -43,6 +74,19 @@ class TestSearchAPI:
         """クエリ欠如のテスト"""
         response = client.post("/api/search", json={})
         assert response.status_code == 422
+    
+    def test_text_search_missing_query(self, client):
+        """全文検索のクエリ欠如のテスト"""
+        response = client.post("/api/search/text", json={})
+        assert response.status_code == 422
+    
+    def test_batch_search_validation(self, client):
+        """バッチ検索のクエリ数の検証テスト"""
+        assert client.post("/api/search/batch", json={"queries": []}).status_code == 400
+        
+        from main import SEARCH_BATCH_MAX_QUERIES
+        response = client.post("/api/search/batch", json={"queries": ["q"] * (SEARCH_BATCH_MAX_QUERIES + 1)})
+        assert response.status_code == 400
 
 class TestNotionAPI:
     """Notion APIのテスト"""
@@ -64,6 +108,58 @@ class TestNotionAPI:
         else:
             assert "pages" in response.json()
 
+class TestJobsAPI:
+    """ジョブ投入APIの検証のテスト"""
+    
+    @pytest.mark.parametrize("body", [
+        {"type": "unknown", "payload": {}},
+        {"type": "analyze", "payload": {"file_type": "csv"}},
+        {"type": "chunk", "payload": {"document_id": "doc-1"}},
+        {"type": "notion_import", "payload": {"chunk_strategy": "markdown"}},
+        {"type": "dedup_report", "payload": {"threshold": 2}},
+        {"type": "notion_import", "payload": {"page_id": "p"}, "max_attempts": 0},
+        {"type": "notion_import", "payload": {"page_id": "p"}, "max_attempts": 10000},
+    ])
+    def test_invalid_jobs_are_rejected(self, client, body):
+        """ジョブの種類・ペイロード・試行回数が不正な場合は投入時に422になることのテスト"""
+        response = client.post("/api/jobs", json=body)
+        assert response.status_code == 422
+    
+    def test_payload_error_location(self, client):
+        """ペイロードのエラー位置が返ることのテスト"""
+        response = client.post("/api/jobs", json={"type": "chunk", "payload": {"document_id": "doc-1", "title": "t"}})
+        
+        assert response.status_code == 422
+        assert ["body", "chunk", "payload", "content"] in [error["loc"] for error in response.json()["detail"]]
+    
+    def test_analyze_job_rejects_unknown_file_type(self, client):
+        """分析ジョブで未対応のファイル形式を指定すると422になることのテスト"""
+        response = client.post("/api/jobs/analyze", params={"file_type": "pdf"}, content=b"a,b\n1,2\n")
+        assert response.status_code == 422
+    
+    def test_analyze_job_rejects_large_file(self, client, monkeypatch):
+        """分析ジョブで上限を超えるファイルが413になることのテスト（Content-Lengthなしでも）"""
+        import main
+        monkeypatch.setattr(main, "ANALYZE_MAX_UPLOAD_BYTES", 10)
+        
+        response = client.post("/api/jobs/analyze", params={"file_type": "csv"}, content=b"a,b\n" * 10)
+        assert response.status_code == 413
+        
+        def chunks():
+            for _ in range(10):
+                yield b"a,b\n"
+        
+        response = client.post("/api/jobs/analyze", params={"file_type": "csv"}, content=chunks())
+        assert response.status_code == 413
+    
+    def test_analyze_file_types_match_data_analysis(self):
+        """APIの分析ファイル形式がDataAnalyzerの対応形式と一致することのテスト"""
+        from typing import get_args
+        import main
+        from services.data_analysis import FileType
+        
+        assert get_args(main.AnalyzeFileType) == get_args(FileType)
+
 class TestDatabaseAPI:
     """データベース接続APIのテスト"""
     
@@ -77,4 +173,72 @@ class TestDatabaseAPI:
         data = response.json()
         assert "status" in data
         assert "message" in data
-        assert "db_type" in data
\ No newline at end of file
+        assert "db_type" in data
+
+class TestDocumentListAPI:
+    """ドキュメント一覧APIのテスト"""
+    
+    def test_cursor_roundtrip(self):
+        """カーソルのエンコード/デコードのテスト"""
+        from datetime import datetime, timezone
+        from pagination import encode_cursor, decode_cursor
+        
+        created_at = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+    
+    def test_invalid_cursor(self, client):
+        """不正なカーソルのテスト"""
+        response = client.get("/documents", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+    
+    def test_unknown_field(self, client):
+        """存在しないフィールド指定のテスト"""
+        response = client.get("/documents", params={"fields": "title,secret"})
+        assert response.status_code == 400
+    
+    def test_invalid_view(self, client):
+        """不正なビュー指定のテスト"""
+        response = client.get("/documents", params={"view": "everything"})
+        assert response.status_code == 422
+    
+    def test_bulk_import_invalid_strategy(self, client):
+        """一括登録で不正なチャンク戦略を指定すると422になることのテスト"""
+        response = client.post(
+            "/documents/bulk",
+            params={"strategy": "nope"},
+            content=b'{"title": "A", "content": "B"}\n',
+            headers={"content-type": "application/x-ndjson"}
+        )
+        assert response.status_code == 422
+
+class TestDocumentETag:
+    """ドキュメントのETagのテスト"""
+    
+    def test_etag_changes_on_update(self):
+        """更新日時が変わるとETagが変わることのテスト"""
+        from datetime import datetime, timezone
+        from etag import document_etag
+        
+        created_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        updated_at = datetime(2025, 1, 2, tzinfo=timezone.utc)
+        assert document_etag(1, created_at, None) != document_etag(1, created_at, updated_at)
+        assert document_etag(1, created_at, None).startswith('"')
+    
+    def test_list_etag_depends_on_query(self):
+        """一覧のETagがクエリ条件に依存することのテスト"""
+        from datetime import datetime, timezone
+        from etag import list_etag
+        
+        rows = [(1, datetime(2025, 1, 1, tzinfo=timezone.utc), None)]
+        assert list_etag(rows, "full") == list_etag(rows, "full")
+        assert list_etag(rows, "full") != list_etag(rows, "summary")
+    
+    def test_conditional_headers(self):
+        """If-None-Match / If-Match の比較のテスト"""
+        from etag import if_none_match, if_match
+        
+        assert if_none_match('"a", W/"b"', '"b"')
+        assert not if_none_match(None, '"b"')
+        assert if_match(None, '"b"')
+        assert if_match("*", '"b"')
+        assert not if_match('W/"b"', '"b"')
\ No newline at end of file
@@ -0,0 +1,61 @@
+import base64
+import numpy as np
+from fastapi.testclient import TestClient
+from benchmarks.fake_servers import create_app, fake_embedding, FakeServerConfig, FaultConfig
+from benchmarks.run import summarize_latencies
+
+class TestFakeServers:
+    """ベンチマーク用フェイクサーバーのテスト"""
+    
+    def test_embeddings_are_deterministic(self):
+        """同じテキストから同じベクトルが作られることのテスト"""
+        assert np.array_equal(fake_embedding("setup guide"), fake_embedding("setup guide"))
+        assert float(fake_embedding("setup guide") @ fake_embedding("setup guide step")) > 0.5
+    
+    def test_embeddings_base64(self):
+        """base64形式のレスポンスのテスト"""
+        client = TestClient(create_app())
+        response = client.post("/v1/embeddings", json={"input": ["a b"], "model": "m", "encoding_format": "base64"})
+        vector = np.frombuffer(base64.b64decode(response.json()["data"][0]["embedding"]), dtype="<f4")
+        
+        assert np.allclose(vector, fake_embedding("a b"))
+    
+    def test_vector_query_with_filter(self):
+        """メタデータフィルタ付き検索のテスト"""
+        client = TestClient(create_app())
+        client.post("/vectors/upsert", json={"vectors": [
+            {"id": "1_chunk_0", "values": [1.0, 0.0], "metadata": {"document_id": "1", "chunk_index": 0}},
+            {"id": "2_chunk_0", "values": [1.0, 0.1], "metadata": {"document_id": "2", "chunk_index": 0}},
+        ]})
+        response = client.post("/query", json={
+            "vector": [1.0, 0.0], "topK": 5, "includeMetadata": True, "filter": {"document_id": {"$in": ["2"]}}
+        })
+        
+        assert [m["id"] for m in response.json()["matches"]] == ["2_chunk_0"]
+    
+    def test_error_injection(self):
+        """エラー注入のテスト"""
+        config = FakeServerConfig(notion=FaultConfig(error_rate=1.0, error_status=429))
+        client = TestClient(create_app(config))
+        
+        assert client.get("/v1/pages/abc").status_code == 429
+        assert client.post("/query", json={"vector": [1.0], "topK": 1}).status_code == 200
+    
+    def test_notion_block_pagination(self):
+        """Notionブロック取得のページングのテスト"""
+        client = TestClient(create_app(FakeServerConfig(notion_blocks=150)))
+        first = client.get("/v1/blocks/page-1/children", params={"page_size": 100}).json()
+        second = client.get("/v1/blocks/page-1/children", params={"start_cursor": first["next_cursor"]}).json()
+        
+        assert first["has_more"] is True
+        assert len(first["results"]) + len(second["results"]) == 150
+        assert second["has_more"] is False
+
+def test_summarize_latencies():
+    """レイテンシ集計のテスト"""
+    summary = summarize_latencies([0.01] * 99 + [1.0], elapsed=2.0, errors=1)
+    
+    assert summary["p50_ms"] == 10.0
+    assert summary["max_ms"] == 1000.0
+    assert summary["requests"] == 101
+    assert summary["throughput_rps"] == 50.0
\ No newline at end of file
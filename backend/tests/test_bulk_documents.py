@@ -0,0 +1,129 @@
+import io
+import tarfile
+import zipfile
+import pytest
+from services import bulk_documents
+from services.bulk_documents import aiter_lines, parse_ndjson_line, markdown_title, iter_archive_documents
+
+class TestNdjson:
+    """NDJSON読み込みのテスト"""
+    
+    def test_parse_line(self):
+        """1行のパースのテスト"""
+        document = parse_ndjson_line('{"title": "A", "content": "B", "extra": 1}', 1)
+        
+        assert document == {"title": "A", "content": "B"}
+    
+    def test_invalid_line_reports_line_number(self):
+        """不正な行で行番号が報告されることのテスト"""
+        with pytest.raises(ValueError, match="line 3"):
+            parse_ndjson_line("{bad", 3)
+        with pytest.raises(ValueError, match="Line 4"):
+            parse_ndjson_line('{"title": "A"}', 4)
+    
+    @pytest.mark.asyncio
+    async def test_lines_split_across_chunks(self):
+        """チャンク境界をまたぐ行の結合のテスト"""
+        async def chunks():
+            for chunk in [b'{"a":', b' 1}\n{"b"', b': 2}\n', b'{"c": 3}']:
+                yield chunk
+        
+        lines = [line async for line in aiter_lines(chunks())]
+        
+        assert lines == ['{"a": 1}', '{"b": 2}', '{"c": 3}']
+    
+    @pytest.mark.asyncio
+    async def test_line_split_into_many_chunks(self):
+        """多数の小さなチャンクに分かれた行と、1チャンク内の複数行のテスト"""
+        async def chunks():
+            for i in range(10000):
+                yield b"x"
+            yield b"\n\ny\nz"
+        
+        lines = [line async for line in aiter_lines(chunks())]
+        
+        assert lines == ["x" * 10000, "", "y", "z"]
+    
+    @pytest.mark.asyncio
+    async def test_line_size_limit(self):
+        """最大サイズを超える行がエラーになることのテスト"""
+        async def chunks():
+            yield b"short\n"
+            for i in range(10):
+                yield b"0123456789"
+        
+        lines = aiter_lines(chunks(), max_line_bytes=50)
+        
+        assert await lines.__anext__() == "short"
+        with pytest.raises(ValueError, match="Line 2"):
+            await lines.__anext__()
+
+class TestArchive:
+    """アーカイブ読み込みのテスト"""
+    
+    def test_markdown_title(self):
+        """タイトル抽出のテスト"""
+        assert markdown_title("docs/guide.md", "intro\n# Guide\n## Sub") == "Guide"
+        assert markdown_title("docs/guide.md", "no heading") == "guide"
+    
+    def test_zip_skips_non_markdown(self):
+        """zip内のMarkdown以外のファイルが除外されることのテスト"""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("docs/setup.md", "# Setup\n\nsteps")
+            archive.writestr("image.png", b"\x89PNG")
+        buffer.seek(0)
+        
+        documents = list(iter_archive_documents(buffer, "zip"))
+        
+        assert documents == [{"title": "Setup", "content": "# Setup\n\nsteps"}]
+    
+    def test_gzipped_tar(self):
+        """gzip圧縮されたtarの読み込みのテスト"""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            data = "plain text".encode("utf-8")
+            info = tarfile.TarInfo("notes.txt")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        buffer.seek(0)
+        
+        documents = list(iter_archive_documents(buffer, "tar"))
+        
+        assert documents == [{"title": "notes", "content": "plain text"}]
+    
+    def test_document_size_limit(self, monkeypatch):
+        """最大サイズを超えるファイルがエラーになることのテスト"""
+        monkeypatch.setattr(bulk_documents, "MAX_DOCUMENT_BYTES", 10)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("small.md", "# ok")
+            archive.writestr("large.md", "x" * 1000)
+        buffer.seek(0)
+        
+        documents = iter_archive_documents(buffer, "zip")
+        
+        assert next(documents)["title"] == "ok"
+        with pytest.raises(ValueError, match="large.md"):
+            next(documents)
+
+class TestInsertDocuments:
+    """ドキュメント登録のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_batches_are_capped_by_bytes(self, monkeypatch):
+        """行数に達しなくても合計バイト数の上限でINSERTが分割されることのテスト"""
+        batches = []
+        
+        async def insert_batch(db, batch):
+            batches.append(len(batch))
+            return list(range(len(batch)))
+        
+        monkeypatch.setattr(bulk_documents, "_insert_batch", insert_batch)
+        monkeypatch.setattr(bulk_documents, "INSERT_BATCH_BYTES", 100)
+        documents = [{"title": "t", "content": "あ" * 13} for _ in range(5)]
+        
+        ids = await bulk_documents.insert_documents(None, documents)
+        
+        assert batches == [3, 2]
+        assert len(ids) == 5
\ No newline at end of file
@@ -0,0 +1,221 @@
+import pytest
+import threading
+from types import SimpleNamespace
+import numpy as np
+import services.chunking as chunking
+import services.chunk_store as chunk_store
+from services.chunk_dedup import (
+    ChunkDeduplicator, minhash_signatures, lsh_keys, shingles, signature_similarity,
+    cluster_near_duplicates, decode_signature
+)
+
+LICENSE = (
+    "Permission is hereby granted, free of charge, to any person obtaining a copy of this software "
+    "and associated documentation files, to deal in the Software without restriction, including "
+    "without limitation the rights to use, copy, modify, merge, publish and distribute copies."
+)
+
+
+def jaccard(a, b):
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+class TestMinHash:
+    """MinHashとLSHのテスト"""
+    
+    def test_estimates_jaccard_similarity(self):
+        """シグネチャの一致率がJaccard類似度に近いことのテスト"""
+        edited = LICENSE.replace("free of charge", "without any fee")
+        other = "Docker Composeでバックエンドとフロントエンドを起動し、ブラウザで動作を確認します。" * 3
+        signatures = minhash_signatures([LICENSE, edited, other])
+        
+        assert signature_similarity(signatures[0], signatures[1]) == pytest.approx(jaccard(LICENSE, edited), abs=0.1)
+        assert signature_similarity(signatures[0], signatures[2]) < 0.1
+    
+    def test_normalized_texts_share_all_bands(self):
+        """全角・空白の違いだけの本文は同じシグネチャとバンドになることのテスト"""
+        keys = lsh_keys(minhash_signatures(["ＤＯＣＫＥＲ  の設定ファイル", "docker の設定ファイル"]))
+        assert keys.dtype == np.int64
+        assert (keys[0] == keys[1]).all()
+    
+    def test_cluster_near_duplicates(self):
+        """同じバケットの候補のうち類似度がしきい値以上のものだけをまとめることのテスト"""
+        texts = {"a": LICENSE, "b": LICENSE + " ", "c": LICENSE.upper(), "d": "unrelated text " * 10}
+        signatures = dict(zip(texts, minhash_signatures(list(texts.values()))))
+        
+        clusters = cluster_near_duplicates([["a", "b", "d"], ["b", "c"]], signatures, 0.9)
+        
+        assert clusters == [["a", "b", "c"]]
+
+
+class TestChunkDeduplicator:
+    """取り込み時の重複判定のテスト"""
+    
+    def test_matches_existing_and_earlier_chunks(self):
+        """既存のチャンクと、同じ取り込みで先に保存したチャンクを共有先にすることのテスト"""
+        stored = ChunkDeduplicator("doc-1", lookup=lambda keys, document_id: []).match(["doc-1_chunk_0"], [LICENSE])
+        existing = [("doc-1_chunk_0", stored.signatures[0], stored.band_keys[0])]
+        requested = []
+        
+        def lookup(keys, document_id):
+            requested.append(document_id)
+            return existing
+        
+        deduplicator = ChunkDeduplicator("doc-2", lookup=lookup)
+        unique = "This section describes how to configure the search service and its environment variables. " * 3
+        first = deduplicator.match(["doc-2_chunk_0", "doc-2_chunk_1"], [LICENSE + " ", unique])
+        second = deduplicator.match(["doc-2_chunk_2", "doc-2_chunk_3"], [unique.replace("variables.", "variable.", 1), "short"])
+        
+        assert requested == ["doc-2", "doc-2"]
+        assert first.duplicate_of == ["doc-1_chunk_0", None]
+        assert second.duplicate_of == ["doc-2_chunk_1", None]
+        # 短いチャンクはシグネチャを保存しない
+        assert second.signatures[1] is None and second.band_keys[1] == []
+        assert len(decode_signature(first.signatures[1])) == 128
+
+
+class TestDedupIngestion:
+    """重複を共有する取り込みのテスト"""
+    
+    @pytest.fixture
+    def store(self, monkeypatch):
+        """チャンクストアとPineconeの代わり"""
+        state = SimpleNamespace(chunks={}, references={}, vectors={}, embedded=[])
+        
+        class FakeIndex:
+            def upsert(self, vectors):
+                state.vectors.update({v["id"]: v for v in vectors})
+            
+            def delete(self, ids=None, filter=None):
+                if filter:
+                    ids = [i for i, v in state.vectors.items() if v["metadata"]["document_id"] == filter["document_id"]]
+                for vector_id in ids:
+                    state.vectors.pop(vector_id, None)
+            
+            def fetch(self, ids):
+                found = {i: SimpleNamespace(values=state.vectors[i]["values"]) for i in ids if i in state.vectors}
+                return SimpleNamespace(vectors=found)
+            
+            def update(self, id, set_metadata):
+                if id in state.vectors:
+                    state.vectors[id]["metadata"] = {**state.vectors[id]["metadata"], **set_metadata}
+        
+        async def embed_texts(texts):
+            state.embedded.extend(texts)
+            return [[float(len(text))] for text in texts]
+        
+        def find_candidate_chunks(keys, document_id):
+            keys = set(keys)
+            return [
+                (row["id"], row["minhash"], row["lsh_bands"]) for row in state.chunks.values()
+                if row["document_id"] != document_id and keys & set(row["lsh_bands"] or [])
+            ]
+        
+        def fetch_shared_chunks(document_id, keep_chunks=0):
+            shared = []
+            for (ref_document, index), ref in sorted(state.references.items()):
+                chunk = state.chunks.get(ref["chunk_id"])
+                if ref_document != document_id and chunk and chunk["document_id"] == document_id and chunk["chunk_index"] >= keep_chunks:
+                    shared.append({**ref, "text": chunk["text"], "minhash": chunk["minhash"], "lsh_bands": chunk["lsh_bands"]})
+            return shared
+        
+        def move_chunk_references(moves, promoted):
+            for key in promoted:
+                state.references.pop(key, None)
+            for ref in state.references.values():
+                ref["chunk_id"] = moves.get(ref["chunk_id"], ref["chunk_id"])
+        
+        def delete_chunk_references(document_id, keep_chunks=0):
+            keys = [k for k in state.references if k[0] == document_id and k[1] >= keep_chunks]
+            return list(dict.fromkeys(state.references.pop(key)["chunk_id"] for key in keys))
+        
+        def fetch_chunk_document_ids(chunk_ids):
+            document_ids = {i: [state.chunks[i]["document_id"]] for i in chunk_ids if i in state.chunks}
+            for (document_id, _), ref in sorted(state.references.items()):
+                if ref["chunk_id"] in document_ids:
+                    document_ids[ref["chunk_id"]].append(document_id)
+            return document_ids
+        
+        monkeypatch.setattr(chunking, "CHUNK_DEDUP_ENABLED", True)
+        monkeypatch.setattr(chunking, "get_index", lambda: FakeIndex())
+        monkeypatch.setattr(chunking, "embed_texts", embed_texts)
+        monkeypatch.setattr(chunking, "save_chunks", lambda rows: state.chunks.update({r["id"]: r for r in rows}))
+        monkeypatch.setattr(chunking, "save_chunk_references", lambda rows: state.references.update(
+            {(r["document_id"], r["chunk_index"]): r for r in rows}
+        ))
+        monkeypatch.setattr(chunking, "delete_chunk_rows", lambda ids: [i for i in ids if state.chunks.pop(i, None)])
+        monkeypatch.setattr(chunking, "delete_chunks", lambda document_id, keep_chunks=0: [
+            state.chunks.pop(i) for i in [i for i, row in state.chunks.items() if row["document_id"] == document_id]
+        ])
+        monkeypatch.setattr(chunking, "delete_chunk_references", delete_chunk_references)
+        monkeypatch.setattr(chunking, "fetch_shared_chunks", fetch_shared_chunks)
+        monkeypatch.setattr(chunking, "move_chunk_references", move_chunk_references)
+        monkeypatch.setattr(chunking, "fetch_chunk_document_ids", fetch_chunk_document_ids)
+        monkeypatch.setattr(chunk_store, "find_candidate_chunks", find_candidate_chunks)
+        return state
+    
+    @staticmethod
+    def document(body):
+        return f"# License\n\n{LICENSE}\n\n# Usage\n\n{body}"
+    
+    @pytest.mark.asyncio
+    async def test_shared_chunk_is_embedded_once(self, store):
+        """2つ目のドキュメントの定型文はベクトル化せずに既存のチャンクを参照することのテスト"""
+        await chunking.chunk_and_embed("doc-1", "One", self.document("Run the indexer with python worker.py and wait."))
+        store.embedded.clear()
+        
+        stats = await chunking.chunk_and_embed("doc-2", "Two", self.document("Start the API server with uvicorn main:app."))
+        
+        assert stats["chunks_deduplicated"] == 1
+        assert not any("Permission is hereby granted" in text for text in store.embedded)
+        assert store.references[("doc-2", 0)]["chunk_id"] == "doc-1_chunk_0"
+        assert "doc-2_chunk_0" not in store.vectors
+        # doc-2 で絞り込んだ検索でも共有チャンクがヒットするように document_ids に含める
+        assert store.vectors["doc-1_chunk_0"]["metadata"]["document_ids"] == ["doc-1", "doc-2"]
+    
+    @pytest.mark.asyncio
+    async def test_store_calls_run_off_the_event_loop(self, store, monkeypatch):
+        """チャンクストアの同期の呼び出しはイベントループのスレッドで実行しないことのテスト"""
+        threads = []
+        save_chunks, lookup = chunking.save_chunks, chunk_store.find_candidate_chunks
+        
+        def recorded(func):
+            def call(*args):
+                threads.append(threading.get_ident())
+                return func(*args)
+            return call
+        
+        monkeypatch.setattr(chunking, "save_chunks", recorded(save_chunks))
+        monkeypatch.setattr(chunk_store, "find_candidate_chunks", recorded(lookup))
+        await chunking.chunk_and_embed("doc-1", "One", self.document("Run the indexer with python worker.py and wait."))
+        
+        assert threads and threading.get_ident() not in threads
+    
+    @pytest.mark.asyncio
+    async def test_deleting_referencing_document_updates_document_ids(self, store):
+        """共有しているドキュメントを削除すると、共有チャンクの document_ids から除くことのテスト"""
+        await chunking.chunk_and_embed("doc-1", "One", self.document("Run the indexer with python worker.py and wait."))
+        await chunking.chunk_and_embed("doc-2", "Two", self.document("Start the API server with uvicorn main:app."))
+        
+        await chunking.delete_document_chunks("doc-2")
+        
+        assert store.vectors["doc-1_chunk_0"]["metadata"]["document_ids"] == ["doc-1"]
+        assert not store.references
+    
+    @pytest.mark.asyncio
+    async def test_shared_chunk_moves_when_owner_is_deleted(self, store):
+        """共有元のドキュメントを削除すると、共有していたドキュメントのチャンクとして保存し直すことのテスト"""
+        for document_id in ("doc-1", "doc-2", "doc-3"):
+            await chunking.chunk_and_embed(document_id, document_id, self.document(f"Notes for {document_id} only."))
+        store.embedded.clear()
+        
+        moved = await chunking.release_shared_chunks("doc-1")
+        
+        assert moved == 1
+        assert store.embedded == []
+        assert store.vectors["doc-2_chunk_0"]["metadata"]["document_id"] == "doc-2"
+        assert store.chunks["doc-2_chunk_0"]["text"] == store.chunks["doc-1_chunk_0"]["text"]
+        assert ("doc-2", 0) not in store.references
+        assert store.references[("doc-3", 0)]["chunk_id"] == "doc-2_chunk_0"
+        assert store.vectors["doc-2_chunk_0"]["metadata"]["document_ids"] == ["doc-2", "doc-3"]
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import get_args
+import numpy as np
+import pytest
+from services.chunk_evaluation import (
+    LocalIndex, STRATEGIES, score_retrieval, compare_strategies, embedding_profile_report,
+    shutdown_executor, start_executor
+)
+from services.embeddings import get_embedding_profile, embedding_params, quantize_binary, pack_binary_codes, hamming_distances
+
+class TestLocalIndex:
+    """評価用ローカルインデックスのテスト"""
+    
+    def test_search_orders_by_similarity(self):
+        """類似度順に返ることのテスト"""
+        index = LocalIndex([[1, 0], [0, 1], [0.7, 0.7]])
+        ranked = index.search([[1, 0.1]], top_k=2)
+        
+        assert ranked.tolist() == [[0, 2]]
+    
+    def test_top_k_larger_than_index(self):
+        """top_kがチャンク数より大きい場合のテスト"""
+        index = LocalIndex([[1, 0], [0, 1]])
+        ranked = index.search([[0, 1]], top_k=10)
+        
+        assert ranked.tolist() == [[1, 0]]
+
+class TestScoreRetrieval:
+    """検索品質評価のテスト"""
+    
+    @pytest.fixture
+    def chunks(self):
+        return [
+            {"text": "Install the package with pip", "metadata": {"chunk_size": 28}},
+            {"text": "Configure the   DATABASE_URL variable", "metadata": {"chunk_size": 36}},
+        ]
+    
+    def test_recall_and_mrr(self, chunks):
+        """recall@kとMRRの計算テスト"""
+        queries = [
+            {"query": "install", "expected": "with pip"},
+            {"query": "database", "expected": "configure the database_url"},
+        ]
+        # 1つ目は1位、2つ目は2位でヒット
+        result = score_retrieval(chunks, [[1, 0], [0, 1]], queries, [[1, 0], [1, 0.1]], top_k=2)
+        
+        assert result["recall_at_k"] == 1.0
+        assert result["mrr"] == pytest.approx(0.75)
+    
+    def test_miss_outside_top_k(self, chunks):
+        """上位k件に入らない場合はヒットしないことのテスト"""
+        queries = [{"query": "database", "expected": "DATABASE_URL"}]
+        result = score_retrieval(chunks, [[1, 0], [0, 1]], queries, [[1, 0]], top_k=1)
+        
+        assert result["recall_at_k"] == 0.0
+
+class TestCompareStrategies:
+    """チャンク分割戦略の比較のテスト"""
+    
+    @pytest.fixture(autouse=True)
+    def stop_executor(self):
+        yield
+        shutdown_executor()
+    
+    @pytest.mark.asyncio
+    async def test_compare_strategies_reports_timing(self):
+        """全戦略の統計と所要時間が返ることのテスト"""
+        results = await compare_strategies("# Title\n\nSome content.\n\n## Next\n\nMore content.")
+        
+        assert set(results) == {"fixed", "markdown", "semantic", "hybrid"}
+        assert all("elapsed_ms" in r and r["chunks_count"] > 0 for r in results.values())
+        assert all("retrieval" not in r for r in results.values())
+    
+    @pytest.mark.asyncio
+    async def test_broken_pool_is_recreated(self):
+        """ワーカーが強制終了されて壊れたプールが作り直されることのテスト"""
+        executor = start_executor()
+        with pytest.raises(BrokenProcessPool):
+            executor.submit(os._exit, 1).result(timeout=60)
+        
+        results = await compare_strategies("# Title\n\nSome content.", strategies=["markdown"])
+        
+        assert results["markdown"]["chunks_count"] == 1
+        assert start_executor() is not executor
+    
+    def test_api_rejects_unknown_strategy(self, client):
+        """未知の戦略と不正なtop_kが422になることのテスト"""
+        body = {"document_id": "doc-1", "title": "t", "content": "text"}
+        
+        assert client.post("/api/chunk/compare", json={**body, "strategies": ["fixed", "unknown"]}).status_code == 422
+        assert client.post("/api/chunk/compare", json={**body, "top_k": 0}).status_code == 422
+    
+    def test_strategy_literals_match_chunking(self):
+        """APIの戦略・サイズ単位がチャンク分割の定義と一致することのテスト"""
+        import main
+        from services import chunking
+        
+        assert get_args(main.ChunkStrategy) == get_args(chunking.ChunkStrategy) == tuple(STRATEGIES)
+        assert get_args(main.SizeUnit) == get_args(chunking.SizeUnit)
+
+class TestQuantizedIndex:
+    """量子化したローカルインデックスのテスト"""
+    
+    @pytest.fixture
+    def vectors(self):
+        rng = np.random.default_rng(0)
+        return rng.normal(size=(500, 64)).astype(np.float32), rng.normal(size=(20, 64)).astype(np.float32)
+    
+    def test_int8_rescore_matches_float(self, vectors):
+        """int8で候補を取りfloatで再スコアした結果が、floatでの検索と一致することのテスト"""
+        docs, queries = vectors
+        expected = LocalIndex(docs).search(queries, top_k=5)
+        
+        assert LocalIndex(docs, "int8", rescore_factor=4).search(queries, top_k=5).tolist() == expected.tolist()
+    
+    def test_binary_rescore_from_memmap(self, vectors, tmp_path):
+        """2値化したインデックスでファイル上のfloatベクトルを使って再スコアできることのテスト"""
+        docs, _ = vectors
+        index = LocalIndex(docs, "binary", rescore_factor=4, rescore_path=str(tmp_path / "vectors.npy"))
+        
+        assert index.search(docs[:10], top_k=1)[:, 0].tolist() == list(range(10))
+        assert index.memory_bytes == 500 * 8
+    
+    def test_hamming_distances(self):
+        """ハミング距離の計算テスト"""
+        codes = pack_binary_codes(np.array([[1, 1, -1], [-1, -1, 1]]))
+        
+        assert hamming_distances(quantize_binary(np.array([[1, -1, -1]])), codes).tolist() == [[1, 2]]
+    
+    def test_profile_report(self, vectors):
+        """次元数・量子化ごとのrecallとサイズのレポートのテスト"""
+        docs, queries = vectors
+        report = embedding_profile_report(docs, queries, dimensions=[64, 32], top_k=5, rescore_factor=4)
+        rows = {(r["dimensions"], r["quantization"], r["rescore_factor"]): r for r in report}
+        
+        assert len(report) == 10
+        assert rows[(64, "none", 0)]["recall_at_k"] == 1.0
+        assert rows[(64, "int8", 0)]["compression"] == pytest.approx(4.0, rel=0.05)
+        assert rows[(64, "binary", 4)]["recall_at_k"] >= rows[(64, "binary", 0)]["recall_at_k"]
+
+class TestEmbeddingProfile:
+    """埋め込みプロファイルのテスト"""
+    
+    def test_embedding_params(self, monkeypatch):
+        """プロファイルと環境変数から dimensions が決まることのテスト"""
+        monkeypatch.setenv("EMBEDDING_PROFILE", "compact")
+        monkeypatch.setenv("EMBEDDING_DIMENSIONS", "256")
+        get_embedding_profile.cache_clear()
+        try:
+            assert embedding_params() == {"model": "text-embedding-3-small", "dimensions": 256}
+            assert get_embedding_profile()["quantization"] == "int8"
+        finally:
+            get_embedding_profile.cache_clear()
\ No newline at end of file
@@ -1,5 +1,5 @@
 import pytest
-from services.chunking import DocumentChunker
+from services.chunking import DocumentChunker, count_tokens, get_chunker, get_encoder, iter_markdown_sections
 
 class TestDocumentChunker:
     """ドキュメントチャンククラスのテスト"""
@@ -62,4 +62,152 @@ More detailed content here.
         chunker = DocumentChunker(strategy="fixed")
         chunks = chunker.chunk_text("")
         
-        assert len(chunks) == 0 or len(chunks) == 1
\ No newline at end of file
+        assert len(chunks) == 0 or len(chunks) == 1
+    
+    @pytest.fixture
+    def token_encoder(self):
+        """tiktokenのエンコーディング（初回はダウンロードが必要なため、取得できない環境ではスキップ）"""
+        try:
+            return get_encoder("cl100k_base")
+        except Exception as e:
+            pytest.skip(f"tiktoken encoding is not available: {e}")
+    
+    def test_token_chunking(self, sample_markdown, token_encoder):
+        """トークン単位チャンク分割のテスト"""
+        chunker = DocumentChunker(strategy="fixed", size_unit="tokens", chunk_size=20, overlap=5)
+        chunks = chunker.chunk_text(sample_markdown * 5)
+        
+        assert len(chunks) > 1
+        assert all(chunk["metadata"]["token_count"] <= 20 for chunk in chunks)
+        assert all(chunk["metadata"]["token_count"] == count_tokens(chunk["text"]) for chunk in chunks)
+    
+    def test_char_chunking_has_no_token_count(self, sample_markdown):
+        """文字単位ではトークン数を計算しないことのテスト"""
+        chunker = DocumentChunker(strategy="markdown")
+        chunks = chunker.chunk_text(sample_markdown)
+        
+        assert all("token_count" not in chunk["metadata"] for chunk in chunks)
+    
+    def test_invalid_size_unit(self):
+        """不正なサイズ単位のテスト"""
+        with pytest.raises(ValueError):
+            DocumentChunker(size_unit="words")
+    
+    def test_invalid_sizes(self):
+        """オーバーラップがチャンクサイズ以上の場合のテスト（指定しないサイズは戦略のデフォルト）"""
+        with pytest.raises(ValueError):
+            DocumentChunker(strategy="fixed", overlap=500)
+        with pytest.raises(ValueError):
+            DocumentChunker(chunk_size=0)
+    
+    def test_iter_chunks_header_context(self, sample_markdown):
+        """ストリーミング分割でヘッダー文脈が保持されることのテスト"""
+        chunker = DocumentChunker(strategy="markdown")
+        chunks = list(chunker.iter_chunks(sample_markdown.splitlines(keepends=True)))
+        
+        assert len(chunks) == 3
+        assert chunks[0]["metadata"]["headers"] == {"h1": "Main Title", "h2": "Section 1"}
+        assert chunks[2]["metadata"]["headers"] == {"h1": "Main Title", "h2": "Section 2", "h3": "Subsection 2.1"}
+        assert chunks[2]["text"].startswith("# Main Title\n## Section 2\n### Subsection 2.1")
+    
+    def test_iter_chunks_is_lazy(self):
+        """ストリーミング分割が入力を全て読む前にチャンクを返すことのテスト"""
+        import itertools
+        
+        def endless_sections():
+            for i in itertools.count():
+                yield f"## Section {i}\n"
+                yield f"Body of section {i}.\n"
+        
+        chunker = DocumentChunker(strategy="semantic")
+        chunks = list(itertools.islice(chunker.iter_chunks(endless_sections()), 3))
+        
+        assert [c["metadata"]["headers"] for c in chunks] == [{"h2": f"Section {i}"} for i in range(3)]
+    
+    def test_iter_chunks_ignores_headers_in_code(self):
+        """コードブロック内の '#' をヘッダー扱いしないことのテスト"""
+        lines = ["# Title", "```bash", "# comment", "echo hi", "```"]
+        chunks = list(DocumentChunker(strategy="markdown").iter_chunks(lines))
+        
+        assert len(chunks) == 1
+        assert "# comment" in chunks[0]["text"]
+    
+    def test_get_chunker_is_cached(self):
+        """同じ設定のチャンカーと分割器が再利用されることのテスト"""
+        assert get_chunker("markdown") is get_chunker("markdown")
+        assert get_chunker("markdown") is not get_chunker("fixed")
+        assert DocumentChunker("fixed")._splitter is DocumentChunker("fixed")._splitter
+    
+    def test_markdown_sections_without_langchain(self):
+        """純Pythonのセクション分割のテスト"""
+        sections = list(iter_markdown_sections(["# A", "intro", "## B", "", "body", "### C", "deep"]))
+        
+        assert sections == [
+            ({"h1": "A"}, ["intro"]),
+            ({"h1": "A", "h2": "B"}, ["", "body"]),
+            ({"h1": "A", "h2": "B", "h3": "C"}, ["deep"]),
+        ]
+    
+    def test_header_keeps_trailing_hash(self):
+        """見出しの末尾の '#'（C#・F#）は残し、空白の後の閉じの '#' だけを除くことのテスト"""
+        sections = list(iter_markdown_sections(["# C#", "intro", "## Using F# ##", "body"]))
+        
+        assert [headers for headers, _ in sections] == [{"h1": "C#"}, {"h1": "C#", "h2": "Using F#"}]
+    
+    def test_sections_match_langchain_splitter(self):
+        """インデントされた見出しと連続する空行を、従来のLangChainの分割と同じセクションに分けることのテスト
+        
+        従来の分割と異なり、本文の空行と行頭の空白はそのまま残す。
+        """
+        splitters = pytest.importorskip("langchain_text_splitters")
+        text = "  # A\nintro\n\n\n\n   ## B\n\n\nbody\n\n  more\n### C\ndeep"
+        
+        splitter = splitters.MarkdownHeaderTextSplitter([("#", "h1"), ("##", "h2"), ("###", "h3")])
+        expected = [(doc.metadata, doc.page_content.split()) for doc in splitter.split_text(text)]
+        sections = [(headers, "\n".join(lines).split()) for headers, lines in iter_markdown_sections(text.splitlines())]
+        
+        assert sections == expected
+    
+    def test_four_space_indent_is_not_header(self):
+        """4つ以上の空白でインデントされた '#' の行は見出しとして扱わないことのテスト"""
+        sections = list(iter_markdown_sections(["# A", "    # not a header"]))
+        
+        assert sections == [({"h1": "A"}, ["    # not a header"])]
+
+class TestChunkStorage:
+    """チャンクの保存とベクトルメタデータのテスト"""
+    
+    def test_split_metadata(self):
+        """ネストしたメタデータがPineconeのメタデータから分離されることのテスト"""
+        from services.chunking import _split_metadata
+        
+        scalars, nested = _split_metadata({"headers": {"h1": "Title"}, "chunk_size": 10})
+        
+        assert scalars == {"chunk_size": 10}
+        assert nested == {"headers": {"h1": "Title"}}
+    
+    @pytest.mark.asyncio
+    async def test_chunk_text_is_stored_outside_vector_metadata(self, monkeypatch):
+        """チャンク本文が切り詰められずにチャンクストアへ保存され、Pineconeのメタデータに含まれないことのテスト"""
+        import services.chunking as chunking
+        
+        upserted, stored = [], []
+        
+        class FakeIndex:
+            def upsert(self, vectors):
+                upserted.extend(vectors)
+        
+        async def embed_texts(texts):
+            return [[0.0] for _ in texts]
+        
+        monkeypatch.setattr(chunking, "embed_texts", embed_texts)
+        monkeypatch.setattr(chunking, "get_index", lambda: FakeIndex())
+        monkeypatch.setattr(chunking, "save_chunks", stored.extend)
+        monkeypatch.setattr(chunking, "CHUNK_DEDUP_ENABLED", False)
+        
+        section = "word " * 2000
+        await chunking.chunk_and_embed("doc-1", "Title", f"# Title\n\n{section}", strategy="fixed", chunk_size=20000)
+        
+        assert [v["id"] for v in upserted] == [row["id"] for row in stored]
+        assert all("chunk_text" not in v["metadata"] for v in upserted)
+        assert stored[0]["text"].count("word") == 2000
\ No newline at end of file
@@ -61,4 +61,116 @@ Diana,31,Sales,70000"""
         assert isinstance(insights, list)
         assert all("type" in insight for insight in insights)
         assert all("title" in insight for insight in insights)
-        assert all("message" in insight for insight in insights)
\ No newline at end of file
+        assert all("message" in insight for insight in insights)
+    
+    def test_load_csv_arrow(self, sample_csv):
+        """pyarrowエンジンでのCSV読み込みのテスト"""
+        analyzer = DataAnalyzer(sample_csv, 'csv', use_arrow=True)
+        
+        assert len(analyzer.df) == 4
+        assert isinstance(analyzer.df["age"].dtype, pd.ArrowDtype)
+        assert "department" in analyzer.get_summary_statistics()["categorical"]
+    
+    def test_optimize_dtypes(self, sample_csv):
+        """カテゴリ化とダウンキャストのテスト"""
+        analyzer = DataAnalyzer(sample_csv, 'csv', optimize_dtypes=True, category_threshold=0.75)
+        
+        assert str(analyzer.df["department"].dtype) == "category"
+        assert analyzer.df["age"].dtype.itemsize < 8
+        assert "department" in analyzer.get_summary_statistics()["categorical"]
+    
+    def test_load_parquet(self, sample_csv):
+        """Parquet読み込みのテスト"""
+        buffer = io.BytesIO()
+        pd.read_csv(io.BytesIO(sample_csv)).to_parquet(buffer)
+        analyzer = DataAnalyzer(buffer.getvalue(), 'parquet', use_arrow=True)
+        
+        assert len(analyzer.df) == 4
+        assert list(analyzer.df.columns) == ['name', 'age', 'department', 'salary']
+    
+    def test_max_rows(self, sample_csv):
+        """先頭の行だけを読み込むテスト"""
+        analyzer = DataAnalyzer(sample_csv, 'csv', max_rows=2)
+        
+        assert len(analyzer.df) == 2
+        assert analyzer.get_basic_info()["truncated"]
+    
+    def test_max_rows_equal_to_row_count(self, sample_csv):
+        """行数がちょうど max_rows のファイルは切り詰められたとみなさないことのテスト"""
+        buffer = io.BytesIO()
+        pd.read_csv(io.BytesIO(sample_csv)).to_parquet(buffer)
+        
+        for content, file_type in [(sample_csv, 'csv'), (buffer.getvalue(), 'parquet')]:
+            analyzer = DataAnalyzer(content, file_type, max_rows=4)
+            assert len(analyzer.df) == 4
+            assert not analyzer.truncated
+            assert DataAnalyzer(content, file_type, max_rows=3).truncated
+
+
+class TestExcelLoading:
+    """Excelブックの読み込みのテスト"""
+    
+    @pytest.fixture
+    def workbook(self):
+        """2シートのExcelブック"""
+        sales = pd.DataFrame({
+            "date": pd.date_range("2024-01-01", periods=6),
+            "region": ["east", "west", "east", None, "west", "east"],
+            "amount": [100, 250, None, 80, 120, 300],
+            "units": [1, 2, 3, 4, 5, 6],
+            "paid": [True, False, True, True, False, True],
+        })
+        costs = pd.DataFrame({"item": ["rent", "power"], "cost": [1200.5, 300.25]})
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+            sales.to_excel(writer, sheet_name="sales", index=False)
+            costs.to_excel(writer, sheet_name="costs", index=False)
+        return buffer.getvalue()
+    
+    def test_streaming_matches_read_excel(self, workbook):
+        """ストリーミング読み込みの結果が pd.read_excel と同じになることのテスト"""
+        analyzer = DataAnalyzer(workbook, 'excel', excel_engine='openpyxl')
+        
+        pd.testing.assert_frame_equal(analyzer.df, pd.read_excel(io.BytesIO(workbook)))
+        assert list(analyzer.sheets) == ["sales"]
+    
+    def test_sheet_selection(self, workbook):
+        """シート名・全シートの指定のテスト"""
+        costs = DataAnalyzer(workbook, 'excel', sheet_name="costs", excel_engine='openpyxl')
+        both = DataAnalyzer(workbook, 'excel', sheet_name=None, excel_engine='openpyxl')
+        
+        assert list(costs.df.columns) == ["item", "cost"]
+        assert list(both.sheets) == ["sales", "costs"]
+        with pytest.raises(ValueError):
+            DataAnalyzer(workbook, 'excel', sheet_name="missing", excel_engine='openpyxl')
+    
+    def test_max_rows(self, workbook):
+        """シートごとに先頭の行だけを読み込むテスト"""
+        analyzer = DataAnalyzer(workbook, 'excel', sheet_name=None, max_rows=3, excel_engine='openpyxl')
+        
+        assert len(analyzer.sheets["sales"]) == 3
+        assert len(analyzer.sheets["costs"]) == 2
+        assert analyzer.truncated
+        assert analyzer.truncated_sheets == {"sales"}
+    
+    def test_analyze_sheets_reports_truncation_per_sheet(self, workbook):
+        """シートごとの分析で、打ち切ったシートだけが truncated になることのテスト"""
+        analyzer = DataAnalyzer(workbook, 'excel', sheet_name=None, max_rows=2, excel_engine='openpyxl')
+        results = analyzer.analyze_sheets()
+        
+        assert results["sales"]["basic_info"]["truncated"]
+        assert not results["costs"]["basic_info"]["truncated"]
+    
+    def test_analyze_sheets(self, workbook):
+        """シートごとの分析をブックの順序で返すことのテスト"""
+        analyzer = DataAnalyzer(workbook, 'excel', sheet_name=None, excel_engine='openpyxl')
+        analyzed = []
+        
+        results = analyzer.analyze_sheets(max_workers=2, progress=analyzed.append)
+        
+        assert list(results) == ["sales", "costs"]
+        assert analyzed == ["sales", "costs"]
+        assert list(results["sales"]) == ["basic_info", "statistics", "preview", "visualizations", "insights"]
+        assert "histogram_amount" in results["sales"]["visualizations"]
+        assert results["costs"]["basic_info"]["rows"] == 2
+        assert "amount" in results["sales"]["statistics"]["numeric"]
\ No newline at end of file
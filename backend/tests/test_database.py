@@ -0,0 +1,28 @@
+import pytest
+from database import async_database_url
+
+class TestAsyncDatabaseUrl:
+    """非同期エンジン用URLの変換のテスト"""
+    
+    @pytest.mark.parametrize("url", [
+        "postgres://user:pass@db:5432/app",
+        "postgresql://user:pass@db:5432/app",
+        "postgresql+psycopg2://user:pass@db:5432/app",
+    ])
+    def test_driver_is_asyncpg(self, url):
+        """ドライバ指定によらずasyncpgになることのテスト"""
+        async_url = async_database_url(url)
+        
+        assert async_url.drivername == "postgresql+asyncpg"
+        assert (async_url.username, async_url.password, async_url.host, async_url.port, async_url.database) == \
+            ("user", "pass", "db", 5432, "app")
+    
+    def test_sslmode_is_translated(self):
+        """sslmode が asyncpg の ssl に置き換わることのテスト"""
+        async_url = async_database_url("postgresql://user:pass@db/app?sslmode=require&target_session_attrs=read-write")
+        
+        assert dict(async_url.query) == {"ssl": "require", "target_session_attrs": "read-write"}
+    
+    def test_special_characters_in_password(self):
+        """パスワード中の記号が壊れないことのテスト"""
+        assert async_database_url("postgresql://user:p%40ss%2Fword@db/app").password == "p@ss/word"
\ No newline at end of file
@@ -0,0 +1,84 @@
+import pytest
+from services.index_worker import backoff_seconds, BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS, reindex_document
+import services.chunking as chunking
+
+class TestBackoff:
+    """リトライ間隔のテスト"""
+    
+    def test_exponential(self):
+        """失敗回数に応じて倍になることのテスト"""
+        assert backoff_seconds(1) == BACKOFF_BASE_SECONDS
+        assert backoff_seconds(3) == BACKOFF_BASE_SECONDS * 4
+    
+    def test_capped(self):
+        """上限を超えないことのテスト"""
+        assert backoff_seconds(100) == BACKOFF_MAX_SECONDS
+
+class TestReindexDocument:
+    """インデックス反映のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_deleted_document_removes_all_chunks(self, monkeypatch):
+        """削除済みドキュメントは全チャンクを削除することのテスト"""
+        calls = []
+        
+        async def fake_delete(document_id, keep_chunks=0):
+            calls.append((document_id, keep_chunks))
+            return {}
+        
+        monkeypatch.setattr(chunking, "delete_document_chunks", fake_delete)
+        await reindex_document(1, None, None, "markdown")
+        
+        assert calls == [("1", 0)]
+    
+    @pytest.mark.asyncio
+    async def test_update_trims_stale_chunks(self, monkeypatch):
+        """再作成後に余ったチャンクだけを削除することのテスト"""
+        calls = []
+        
+        async def fake_embed(document_id, title, content, strategy="markdown"):
+            calls.append(("embed", document_id))
+            return {"chunks_created": 3}
+        
+        async def fake_delete(document_id, keep_chunks=0):
+            calls.append(("delete", keep_chunks))
+            return {}
+        
+        monkeypatch.setattr(chunking, "chunk_and_embed", fake_embed)
+        monkeypatch.setattr(chunking, "delete_document_chunks", fake_delete)
+        await reindex_document(2, "title", "# body", "markdown")
+        
+        assert calls == [("embed", "2"), ("delete", 3)]
+    
+    @pytest.mark.asyncio
+    async def test_worker_reindexes_on_the_running_loop(self, monkeypatch):
+        """ワーカーは新しいイベントループを作らず、実行中のループで反映することのテスト"""
+        import asyncio
+        import database
+        import services.index_worker as index_worker
+        from types import SimpleNamespace
+        
+        loops = []
+        
+        class FakeSession:
+            async def __aenter__(self):
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            async def execute(self, stmt):
+                return SimpleNamespace(first=lambda: SimpleNamespace(title="title", content="# body"))
+            
+            async def commit(self):
+                pass
+        
+        async def fake_reindex(document_id, title, content, strategy):
+            loops.append(asyncio.get_running_loop())
+            return {}
+        
+        monkeypatch.setattr(database, "AsyncSessionLocal", FakeSession)
+        monkeypatch.setattr(index_worker, "reindex_document", fake_reindex)
+        await index_worker.IndexWorker()._process({"document_id": 1, "last_id": 1, "attempts": 0, "strategy": "markdown"})
+        
+        assert loops == [asyncio.get_running_loop()]
\ No newline at end of file
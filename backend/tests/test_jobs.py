@@ -0,0 +1,57 @@
+import math
+import numpy as np
+import pytest
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from services.jobs import (
+    JobContext, parse_concurrency, retry_delay, start_event_loop, to_json, DEFAULT_CONCURRENCY, RETRY_BACKOFF_MAX_SECONDS
+)
+
+class TestConcurrency:
+    """同時実行数の設定のテスト"""
+    
+    def test_defaults(self):
+        """未指定の場合は既定値になることのテスト"""
+        assert parse_concurrency(None) == DEFAULT_CONCURRENCY
+    
+    def test_override_and_disable(self):
+        """上書きと0指定による無効化のテスト"""
+        concurrency = parse_concurrency("chunk=4, analyze=0")
+        
+        assert concurrency["chunk"] == 4
+        assert "analyze" not in concurrency
+    
+    def test_unknown_type(self):
+        """未知のジョブ種類のテスト"""
+        with pytest.raises(ValueError):
+            parse_concurrency("unknown=1")
+
+class TestJobHelpers:
+    """ジョブ補助関数のテスト"""
+    
+    def test_retry_delay_is_capped(self):
+        """リトライ間隔が倍になり上限で止まることのテスト"""
+        assert retry_delay(2) == retry_delay(1) * 2
+        assert retry_delay(50) == RETRY_BACKOFF_MAX_SECONDS
+    
+    def test_to_json(self):
+        """NaNとnumpy型の変換のテスト"""
+        result = to_json({"mean": np.float64(1.5), "count": np.int64(3), "std": math.nan, 1: [np.bool_(True)]})
+        
+        assert result == {"mean": 1.5, "count": 3, "std": None, "1": [True]}
+    
+    def test_jobs_share_one_event_loop(self):
+        """複数のスロット（スレッド）のコルーチンが同じイベントループで実行されることのテスト"""
+        loop = start_event_loop()
+        
+        async def running_loop(job_id):
+            await asyncio.sleep(0.01)
+            return asyncio.get_running_loop()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                loops = list(executor.map(lambda job_id: JobContext(None, job_id, loop).run(running_loop(job_id)), range(3)))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+        
+        assert loops == [loop, loop, loop]
\ No newline at end of file
@@ -0,0 +1,49 @@
+from functools import lru_cache
+import pytest
+from prometheus_client import REGISTRY
+from metrics import stage_timer, record_token_usage, register_cache
+
+class FakeUsage:
+    prompt_tokens = 12
+    completion_tokens = 5
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+class TestMetrics:
+    """メトリクス記録のテスト"""
+    
+    def test_stage_timer_records_on_error(self):
+        """例外時もステージ時間が記録されることのテスト"""
+        labels = {"operation": "test", "stage": "fail"}
+        before = sample("stage_duration_seconds_count", labels)
+        
+        with pytest.raises(RuntimeError):
+            with stage_timer("test", "fail"):
+                raise RuntimeError()
+        
+        assert sample("stage_duration_seconds_count", labels) == before + 1
+    
+    def test_token_usage(self):
+        """トークン数の記録のテスト"""
+        labels = {"model": "test-model", "kind": "prompt"}
+        before = sample("openai_tokens_total", labels)
+        
+        record_token_usage("test-model", FakeUsage())
+        
+        assert sample("openai_tokens_total", labels) == before + 12
+        assert sample("openai_tokens_total", {"model": "test-model", "kind": "completion"}) >= 5
+    
+    def test_cache_hit_ratio(self):
+        """lru_cacheのヒット率の公開のテスト"""
+        @lru_cache(maxsize=None)
+        def square(x):
+            return x * x
+        
+        register_cache("test_square", square)
+        square(2)
+        square(2)
+        square(2)
+        
+        assert sample("cache_hit_ratio", {"cache": "test_square"}) == pytest.approx(2 / 3)
+        assert sample("cache_hits_total", {"cache": "test_square"}) == 2
\ No newline at end of file
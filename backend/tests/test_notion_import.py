@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import services.notion_import as notion_import
+from services.notion_import import normalize_page_id, unique_page_ids, import_notion_pages
+
+class TestPageIds:
+    """NotionページIDの正規化のテスト"""
+    
+    def test_normalize_formats(self):
+        """URL・ハイフン付きのIDが同じIDになることのテスト"""
+        page_id = "0123456789abcdef0123456789abcdef"
+        
+        assert normalize_page_id("01234567-89ab-cdef-0123-456789ABCDEF") == page_id
+        assert normalize_page_id(f"https://www.notion.so/workspace/Setup-Guide-{page_id}") == page_id
+        assert normalize_page_id(" custom-id ") == "custom-id"
+    
+    def test_unique_page_ids(self):
+        """重複と空のIDを順序を保って除くことのテスト"""
+        assert unique_page_ids(["b", "a", "b", " "]) == ["b", "a"]
+
+class TestImportNotionPages:
+    """複数ページのインポートのテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_bounded_concurrency_and_errors(self, monkeypatch):
+        """同時実行数の上限と、失敗したページが集計されることのテスト"""
+        running = {"now": 0, "max": 0}
+        
+        async def fake_import(page_id, chunk_strategy="markdown", progress=None):
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            progress({"page_id": page_id, "status": "fetching"})
+            await asyncio.sleep(0.05)
+            running["now"] -= 1
+            if page_id == "broken":
+                raise RuntimeError("not found")
+            result = {"page_id": page_id, "status": "done", "chunks": 1}
+            progress(result)
+            return result
+        
+        monkeypatch.setattr(notion_import, "import_notion_page", fake_import)
+        events = [event async for event in import_notion_pages(["a", "b", "broken", "c", "a"], concurrency=2)]
+        
+        assert running["max"] == 2
+        assert events[-1] == {"status": "complete", "pages": 4, "imported": 3, "failed": 1}
+        assert {e["page_id"] for e in events if e["status"] == "done"} == {"a", "b", "c"}
+        assert [e["error"] for e in events if e["status"] == "error"] == ["not found"]
+    
+    def test_job_merges_page_id_and_page_ids(self, monkeypatch):
+        """ジョブでも page_id と page_ids がまとめてインポートされることのテスト"""
+        from services.jobs import JobContext, start_event_loop
+        from services.job_handlers import handle_notion_import
+        
+        async def fake_import(page_id, chunk_strategy="markdown", progress=None):
+            result = {"page_id": page_id, "status": "done", "chunks": 1}
+            progress(result)
+            return result
+        
+        monkeypatch.setattr(notion_import, "import_notion_page", fake_import)
+        monkeypatch.setattr(JobContext, "report", lambda self, progress, message=None, force=False: None)
+        loop = start_event_loop()
+        try:
+            result = handle_notion_import({"page_id": "c", "page_ids": ["a", "b", "c"]}, JobContext(None, 1, loop))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+        
+        assert sorted(page["page_id"] for page in result["pages"]) == ["a", "b", "c"]
+        assert result["imported"] == 3
\ No newline at end of file
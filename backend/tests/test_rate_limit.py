@@ -0,0 +1,130 @@
+import pytest
+import services.rate_limit as rate_limit
+from services.rate_limit import (
+    Budget, MemoryBucketStore, TokenBucketLimiter, estimate_tokens, search_cost, ask_cost,
+    chunk_cost, compare_cost, job_cost, notion_import_cost
+)
+
+class CountingStore(MemoryBucketStore):
+    """共有ストアへの問い合わせ回数を数える"""
+    
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+    
+    async def consume(self, buckets, cost):
+        self.calls += 1
+        return await super().consume(buckets, cost)
+
+
+class FailingStore:
+    async def consume(self, buckets, cost):
+        raise ConnectionError("database is down")
+
+
+class TestTokenBucket:
+    """トークンバケットのテスト"""
+    
+    def test_parse_budget(self):
+        """レート表記から容量と補充速度を求めるテスト"""
+        budget = Budget.parse("3000/minute")
+        assert budget.capacity == 3000
+        assert budget.rate == 50
+        assert budget.refill(0, 10) == 500
+        assert budget.refill(2900, 10) == 3000
+    
+    @pytest.mark.asyncio
+    async def test_refills_over_time(self, monkeypatch):
+        """使い切った予算が経過時間に応じて補充されることのテスト"""
+        now = [1000.0]
+        monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+        store = MemoryBucketStore()
+        buckets = [("route:search:ip:1", Budget.parse("10/minute"))]
+        
+        assert (await store.consume(buckets, 10)).allowed
+        denied = await store.consume(buckets, 3)
+        assert not denied.allowed
+        assert denied.retry_after == pytest.approx(18)
+        
+        now[0] += 18
+        assert (await store.consume(buckets, 3)).allowed
+    
+    @pytest.mark.asyncio
+    async def test_all_buckets_or_nothing(self):
+        """どれかのバケットが足りない場合はどのバケットも消費しないことのテスト"""
+        store = MemoryBucketStore()
+        route = ("route:ask:ip:1", Budget.parse("100/hour"))
+        user = ("user:ip:1", Budget.parse("50/hour"))
+        
+        assert not (await store.consume([route, user], 60)).allowed
+        decision = await store.consume([route], 100)
+        assert decision.allowed
+        assert decision.remaining == pytest.approx(0, abs=0.1)
+
+
+class TestTokenBucketLimiter:
+    """レート制限のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_user_budget_is_shared_across_routes(self):
+        """ルートの予算が残っていてもユーザー全体の予算で制限されることのテスト"""
+        limiter = TokenBucketLimiter(
+            MemoryBucketStore(), route_budgets={"search": "100/hour", "ask": "100/hour"}, user_budget="150/hour"
+        )
+        assert (await limiter.charge("ip:1", "search", 100)).allowed
+        assert not (await limiter.charge("ip:1", "ask", 100)).allowed
+        assert (await limiter.charge("ip:2", "ask", 100)).allowed
+    
+    @pytest.mark.asyncio
+    async def test_local_precheck_skips_store(self):
+        """プロセス内の推定値で足りない場合は共有ストアに問い合わせないことのテスト"""
+        store = CountingStore()
+        limiter = TokenBucketLimiter(store, route_budgets={"search": "10/hour"}, user_budget="1000/hour")
+        
+        for _ in range(10):
+            assert (await limiter.charge("ip:1", "search", 1)).allowed
+        for _ in range(5):
+            decision = await limiter.charge("ip:1", "search", 1)
+            assert not decision.allowed
+            assert decision.retry_after > 0
+        assert store.calls == 10
+    
+    @pytest.mark.asyncio
+    async def test_cost_larger_than_budget(self):
+        """予算の容量を超えるコストは待っても通らないことのテスト"""
+        limiter = TokenBucketLimiter(MemoryBucketStore(), route_budgets={"chunk": "10/hour"}, user_budget="1000/hour")
+        decision = await limiter.charge("ip:1", "chunk", 11)
+        assert not decision.allowed
+        assert decision.retry_after is None
+    
+    @pytest.mark.asyncio
+    async def test_falls_back_to_local_buckets(self):
+        """共有ストアが使えない場合もプロセス内のバケットで制限を続けることのテスト"""
+        limiter = TokenBucketLimiter(FailingStore(), route_budgets={"search": "2/hour"}, user_budget="1000/hour")
+        assert (await limiter.charge("ip:1", "search", 1)).allowed
+        assert (await limiter.charge("ip:1", "search", 1)).allowed
+        assert not (await limiter.charge("ip:1", "search", 1)).allowed
+
+
+class TestCostEstimates:
+    """推定コストのテスト"""
+    
+    def test_estimate_tokens(self):
+        """英数字とマルチバイト文字のトークン数の概算テスト"""
+        assert estimate_tokens("a" * 40) == 10
+        assert estimate_tokens("環境変数") == 4
+        assert estimate_tokens("") == 1
+    
+    def test_costs_are_weighted_by_model(self):
+        """検索は1クエリあたり最小コスト、質問応答は生成分が大きいことのテスト"""
+        assert search_cost(["how to configure"] * 3) == 3
+        assert ask_cost("how to configure") > 1000 * search_cost(["how to configure"])
+    
+    def test_compare_and_job_costs(self):
+        """戦略の比較とジョブは同期のAPIと同じ推定コストで数えることのテスト"""
+        content = "設定ファイルの書き方" * 2000
+        assert compare_cost(content, 4) == 1
+        assert compare_cost(content, 4, ["query"]) == 4 * chunk_cost(content) + search_cost(["query"])
+        assert job_cost("chunk", {"content": content}) == ("chunk", chunk_cost(content))
+        assert job_cost("notion_import", {"page_ids": ["a", "b", "a"]}) == ("notion_import", notion_import_cost(2))
+        assert job_cost("dedup_report", {}) == ("jobs", 1)
\ No newline at end of file
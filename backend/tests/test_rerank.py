@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+from services.rerank import mmr_select, rerank_matches, merge_adjacent_chunks, join_overlapping, query_params
+
+def chunk(document_id, index, text, score):
+    return {"document_id": document_id, "title": document_id, "chunk_index": index, "chunk_text": text, "score": score}
+
+
+class TestMMR:
+    """MMRによる選択のテスト"""
+    
+    def test_prefers_distinct_candidates(self):
+        """ほぼ同じ候補より、関連度が少し低くても異なる候補を選ぶことのテスト"""
+        query = [1.0, 0.0, 0.0]
+        candidates = [
+            [0.95, 0.30, 0.0],
+            [0.95, 0.31, 0.0],   # 1件目とほぼ同じ
+            [0.90, 0.0, 0.43],
+        ]
+        assert mmr_select(query, candidates, 2, lambda_mult=0.5) == [0, 2]
+        # 関連度のみの場合は類似度順
+        assert mmr_select(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+    
+    def test_per_group_cap(self):
+        """1グループあたりの上限を超えて選ばないことのテスト"""
+        query = [1.0, 0.0]
+        candidates = [[1.0, 0.0], [0.99, 0.1], [0.98, 0.2], [0.5, 0.5]]
+        groups = ["a", "a", "a", "b"]
+        assert mmr_select(query, candidates, 4, lambda_mult=1.0, groups=groups, max_per_group=2) == [0, 1, 3]
+    
+    def test_rerank_without_values_keeps_order(self):
+        """ベクトル値のない検索結果は並べ替えずに上位を返すことのテスト"""
+        matches = [SimpleNamespace(id=str(i), values=[], metadata={}) for i in range(5)]
+        assert [m.id for m in rerank_matches([1.0], matches, 3)] == ["0", "1", "2"]
+    
+    def test_query_params(self):
+        """多様化する場合は候補を多めに取りベクトル値も取得することのテスト"""
+        assert query_params(5, False) == {"top_k": 5}
+        params = query_params(5, True)
+        assert params["top_k"] > 5
+        assert params["include_values"]
+
+
+class TestMergeAdjacent:
+    """隣接チャンクの結合のテスト"""
+    
+    def test_join_removes_overlap(self):
+        """オーバーラップ部分を重複させずに結合することのテスト"""
+        assert join_overlapping("Dockerの設定ファイルを作成します。", "設定ファイルを作成します。次に起動します。") == \
+            "Dockerの設定ファイルを作成します。次に起動します。"
+        assert join_overlapping("前のチャンク", "関係のない次のチャンク") == "前のチャンク\n\n関係のない次のチャンク"
+    
+    def test_merges_consecutive_chunks(self):
+        """同じドキュメントの連続するチャンクを上位の位置に1件で返すことのテスト"""
+        results = merge_adjacent_chunks([
+            chunk("a", 3, "section three text", 0.9),
+            chunk("b", 0, "other document", 0.8),
+            chunk("a", 2, "section two text", 0.7),
+            chunk("a", 5, "section five text", 0.6),
+        ])
+        
+        assert [(r["document_id"], r["chunk_index"]) for r in results] == [("a", 2), ("b", 0), ("a", 5)]
+        assert results[0]["chunk_indices"] == [2, 3]
+        assert results[0]["chunk_text"] == "section two text\n\nsection three text"
+        assert results[0]["score"] == 0.9
+        assert "chunk_indices" not in results[2]
\ No newline at end of file
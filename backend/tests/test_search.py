@@ -0,0 +1,122 @@
+import pytest
+from types import SimpleNamespace
+import services.search as search
+import services.qa as qa
+
+class TestBatchSearch:
+    """バッチ検索のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_embeds_once_and_keeps_order(self, monkeypatch):
+        """重複を除いて1回でベクトル化し、クエリの順序で結果を返すことのテスト"""
+        calls = {"embed": [], "query": 0}
+        
+        def create(model, input, **kwargs):
+            calls["embed"].append(list(input))
+            data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+            return SimpleNamespace(data=data, usage=None)
+        
+        def query(vector, top_k, include_metadata):
+            calls["query"] += 1
+            match = SimpleNamespace(id=f"doc_chunk_{int(vector[0])}", score=1.0, metadata={"document_id": "doc"})
+            return SimpleNamespace(matches=[match])
+        
+        client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+        monkeypatch.setattr(search, "get_openai_client", lambda: client)
+        monkeypatch.setattr(search, "get_index", lambda: SimpleNamespace(query=query))
+        monkeypatch.setattr(search, "fetch_chunk_texts", lambda ids: {i: f"text of {i}" for i in ids})
+        
+        results = await search.search_similar_chunks_batch(["a", "bbb", "a", "cc"], top_k=1)
+        
+        assert calls["embed"] == [["a", "bbb", "cc"]]
+        assert calls["query"] == 3
+        assert [r[0]["chunk_text"] for r in results] == [
+            "text of doc_chunk_1", "text of doc_chunk_3", "text of doc_chunk_1", "text of doc_chunk_2"
+        ]
+
+
+class TestDiversifiedSearch:
+    """多様化した検索のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_oversamples_and_merges(self, monkeypatch):
+        """候補を多めに取り、ドキュメントごとの上限と隣接チャンクの結合を適用することのテスト"""
+        received = {}
+        vectors = {
+            "a_chunk_0": [1.0, 0.0], "a_chunk_1": [0.99, 0.1], "a_chunk_2": [0.98, 0.2],
+            "b_chunk_0": [0.6, 0.8], "c_chunk_0": [0.5, -0.8]
+        }
+        
+        def create(model, input, **kwargs):
+            return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0, 0.0])], usage=None)
+        
+        def query(vector, top_k, include_metadata, include_values):
+            received.update(top_k=top_k, include_values=include_values)
+            matches = [
+                SimpleNamespace(
+                    id=vector_id, score=values[0], values=values,
+                    metadata={"document_id": vector_id[0], "chunk_index": float(vector_id[-1])}
+                )
+                for vector_id, values in vectors.items()
+            ]
+            return SimpleNamespace(matches=matches)
+        
+        client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+        monkeypatch.setattr(search, "get_openai_client", lambda: client)
+        monkeypatch.setattr(search, "get_index", lambda: SimpleNamespace(query=query))
+        monkeypatch.setattr(search, "fetch_chunk_texts", lambda ids: {i: f"text of {i}" for i in ids})
+        monkeypatch.setattr("services.rerank.MAX_CHUNKS_PER_DOCUMENT", 2)
+        
+        results = await search.search_similar_chunks("query", top_k=4, diversify=True)
+        
+        assert received == {"top_k": 16, "include_values": True}
+        assert [(r["document_id"], r.get("chunk_indices")) for r in results] == [("a", [0.0, 1.0]), ("b", None), ("c", None)]
+
+class TestSharedChunks:
+    """複数のドキュメントが共有しているチャンクの検索のテスト"""
+    
+    @pytest.fixture
+    def shared_match(self, monkeypatch):
+        """doc-1 に保存され、doc-2 が共有しているチャンク"""
+        received = {}
+        match = SimpleNamespace(
+            id="doc-1_chunk_0", score=0.9, values=[],
+            metadata={"document_id": "doc-1", "document_ids": ["doc-1", "doc-2"], "title": "One", "chunk_index": 0}
+        )
+        
+        def create(model, input, **kwargs):
+            return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=[1.0, 0.0])], usage=None)
+        
+        def query(vector, top_k, include_metadata, filter=None):
+            received["filter"] = filter
+            return SimpleNamespace(matches=[match])
+        
+        client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+        for module in (search, qa):
+            monkeypatch.setattr(module, "get_openai_client", lambda: client)
+            monkeypatch.setattr(module, "get_index", lambda: SimpleNamespace(query=query))
+            monkeypatch.setattr(module, "fetch_chunk_texts", lambda ids: {i: "License text" for i in ids})
+        monkeypatch.setattr(qa, "fetch_chunk_references", lambda chunk_ids, document_ids: {
+            "doc-1_chunk_0": {"document_id": "doc-2", "title": "Two", "chunk_index": 3}
+        })
+        return received
+    
+    @pytest.mark.asyncio
+    async def test_search_lists_sharing_documents(self, shared_match):
+        """検索結果に共有しているドキュメントを含めることのテスト"""
+        results = await search.search_similar_chunks("license", top_k=1)
+        
+        assert results[0]["document_id"] == "doc-1"
+        assert results[0]["shared_with"] == ["doc-2"]
+    
+    @pytest.mark.asyncio
+    async def test_ask_filter_includes_shared_chunks(self, shared_match):
+        """document_ids の絞り込みで共有チャンクもヒットし、指定したドキュメントの出典にすることのテスト"""
+        context, sources = await qa._retrieve_context("license", ["doc-2"])
+        
+        assert shared_match["filter"] == {"$or": [
+            {"document_id": {"$in": ["doc-2"]}},
+            {"document_ids": {"$in": ["doc-2"]}}
+        ]}
+        assert context == ["[Two]\nLicense text"]
+        assert sources == [{"document_id": "doc-2", "title": "Two", "score": 0.9}]
\ No newline at end of file
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+from services.single_flight import SingleFlight, request_key
+from services.upstream import DeadlineExceeded, deadline_scope, remaining_time
+
+class TestRequestKey:
+    """単一実行キーのテスト"""
+    
+    def test_normalizes_text_and_lists(self):
+        """空白・全角の違いとリストの順序を無視することのテスト"""
+        assert request_key(question="Ｄｏｃｋｅｒ  の設定 ", document_ids=["2", "1"]) == \
+            request_key(question="Docker の設定", document_ids=["1", "2"])
+        assert request_key(query="a", top_k=5) != request_key(query="a", top_k=10)
+
+
+class TestSingleFlight:
+    """同一リクエストの単一実行のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_run_once(self):
+        """同時に届いた同じキーの処理は1回だけ実行されることのテスト"""
+        flight = SingleFlight("test")
+        calls = []
+        
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"value": 42}
+        
+        results = await asyncio.gather(*[flight.do("key", work) for _ in range(5)])
+        
+        assert len(calls) == 1
+        assert all(result == {"value": 42} for result in results)
+        assert flight.in_flight == 0
+        
+        # 完了後は再実行される（結果はキャッシュしない）
+        await flight.do("key", work)
+        assert len(calls) == 2
+    
+    @pytest.mark.asyncio
+    async def test_errors_are_shared(self):
+        """leaderの例外が同じキーの全リクエストに伝わることのテスト"""
+        flight = SingleFlight("test")
+        
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream error")
+        
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_late_subscriber_receives_generated_items(self):
+        """途中から購読したストリームも最初の要素から受け取ることのテスト"""
+        flight = SingleFlight("test")
+        started = []
+        second_token = asyncio.Event()
+        
+        async def generate():
+            started.append(1)
+            for i in range(4):
+                if i == 2:
+                    second_token.set()
+                await asyncio.sleep(0.01)
+                yield i
+        
+        async def collect(stream):
+            return [item async for item in stream]
+        
+        first = asyncio.create_task(collect(flight.stream("key", generate)))
+        await second_token.wait()
+        late = await collect(flight.stream("key", generate))
+        
+        assert await first == [0, 1, 2, 3]
+        assert late == [0, 1, 2, 3]
+        assert len(started) == 1
+        assert flight.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_last_unsubscribe_cancels_stream(self):
+        """購読者が全員いなくなると元のストリームを中断することのテスト"""
+        flight = SingleFlight("test")
+        closed = asyncio.Event()
+        
+        async def generate():
+            try:
+                for i in range(100):
+                    await asyncio.sleep(0.01)
+                    yield i
+            finally:
+                closed.set()
+        
+        stream = flight.stream("key", generate)
+        assert await stream.__anext__() == 0
+        await stream.aclose()
+        
+        await asyncio.wait_for(closed.wait(), timeout=1)
+        await asyncio.sleep(0)
+        assert flight.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_short_deadline_does_not_affect_other_callers(self):
+        """期限の短いリクエストが先に始めても、他のリクエストは自分の期限で結果を受け取ることのテスト"""
+        flight = SingleFlight("test", deadline_seconds=10)
+        calls = 0
+        deadlines = []
+        
+        async def work():
+            nonlocal calls
+            calls += 1
+            deadlines.append(remaining_time())
+            await asyncio.sleep(0.1)
+            return "result"
+        
+        async def call(seconds):
+            with deadline_scope(seconds):
+                return await flight.do("key", work)
+        
+        short, long = await asyncio.gather(call(0.02), call(5), return_exceptions=True)
+        assert isinstance(short, DeadlineExceeded)
+        assert long == "result"
+        assert calls == 1
+        # 共有する処理は leader（0.02秒）ではなく SingleFlight の期限で実行される
+        assert deadlines[0] > 5
\ No newline at end of file
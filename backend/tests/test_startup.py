@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import時間の上限（秒）。壁時計の時間は環境に左右されるため pytest -m benchmark でのみ計測する
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "3.0"))
+
+# import時に読み込んではいけない重いモジュール
+HEAVY_MODULES = ["openai", "pinecone", "langchain_text_splitters", "pandas"]
+
+def measure_import(module: str) -> dict:
+    """新しいプロセスでモジュールをimportし、所要時間と読み込まれた重いモジュールを返す"""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    # APIキーなしでもimportできること（import時にクライアントを作らないこと）を確認する
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "PINECONE_API_KEY")}
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+@pytest.mark.parametrize("module", ["main", "services.search", "services.qa", "services.chunking"])
+def test_import_is_lazy(module):
+    """import時に外部クライアントやLangChainを読み込まないことのテスト"""
+    measured = measure_import(module)
+    
+    assert measured["loaded"] == []
+
+@pytest.mark.benchmark
+def test_main_import_budget():
+    """アプリのimport時間が上限内であることのテスト"""
+    measured = measure_import("main")
+    
+    assert measured["elapsed"] < IMPORT_BUDGET_SECONDS
\ No newline at end of file
@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import delete
+from services.text_search import split_query
+
+# 他のテスト・既存データと混ざらないよう、このテストでしか使わない語で検索する
+DOCUMENTS = [
+    {"title": "Zymurgy basics", "content": "An introduction to brewing."},
+    {"title": "Brewing notes", "content": "Zymurgy is the chemistry of fermentation. Zymurgy needs patience."},
+    {"title": "Fermentation log", "content": "Zymurgy appears once here."},
+    {"title": "鯨骨群集の観察", "content": "深海での調査記録です。"},
+    {"title": "深海調査メモ", "content": "ROV で海底の鯨骨群集を見つけた。鯨骨群集には多くの生物が集まる。"},
+]
+
+
+class TestSplitQuery:
+    """クエリの分割のテスト"""
+    
+    def test_japanese_terms_use_substring_match(self):
+        """日本語を含む語は部分一致の語として分けられることのテスト"""
+        assert split_query('Docker "設定" 方法 -nginx') == ("Docker -nginx", ["設定", "方法"])
+        assert split_query("Docker compose") == ("Docker compose", [])
+
+
+@pytest.fixture(scope="module")
+def text_search_db():
+    """検索対象のドキュメントを登録したPostgreSQLのセッション（接続できない場合はスキップ）"""
+    from database import SessionLocal, engine
+    from models import Base, Document
+    from services.text_search import ensure_text_search
+    
+    try:
+        with engine.connect():
+            pass
+    except Exception as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    Base.metadata.create_all(bind=engine)
+    ensure_text_search(engine)
+    
+    db = SessionLocal()
+    documents = [Document(**document) for document in DOCUMENTS]
+    db.add_all(documents)
+    db.commit()
+    ids = {document.title: document.id for document in documents}
+    try:
+        yield db, ids
+    finally:
+        db.execute(delete(Document).where(Document.id.in_(ids.values())))
+        db.commit()
+        db.close()
+
+
+class TestTextSearch:
+    """PostgreSQLでの全文検索のテスト"""
+    
+    def test_title_match_ranks_first(self, text_search_db):
+        """タイトルに含まれるドキュメントが本文だけのドキュメントより上位になることのテスト"""
+        from services.text_search import search_documents_text
+        db, ids = text_search_db
+        
+        results = search_documents_text(db, "zymurgy", top_k=10, fuzzy=False)
+        
+        assert [r["document_id"] for r in results] == \
+            [ids["Zymurgy basics"], ids["Brewing notes"], ids["Fermentation log"]]
+        assert "<mark>" in results[1]["snippet"]
+    
+    def test_all_words_must_match(self, text_search_db):
+        """複数の語はすべて含むドキュメントだけが一致することのテスト"""
+        from services.text_search import search_documents_text
+        db, ids = text_search_db
+        
+        results = search_documents_text(db, "zymurgy patience", top_k=10, fuzzy=False)
+        
+        assert [r["document_id"] for r in results] == [ids["Brewing notes"]]
+    
+    def test_japanese_query_matches_inside_sentences(self, text_search_db):
+        """日本語の語が文中の一部でも一致し、タイトルの一致が上位になることのテスト"""
+        from services.text_search import search_documents_text
+        db, ids = text_search_db
+        
+        results = search_documents_text(db, "鯨骨群集", top_k=10, fuzzy=False)
+        
+        assert [r["document_id"] for r in results] == [ids["鯨骨群集の観察"], ids["深海調査メモ"]]
+        assert "<mark>鯨骨群集</mark>" in results[1]["snippet"]
+    
+    def test_japanese_and_english_terms(self, text_search_db):
+        """日本語の語と英語の語を組み合わせたクエリのテスト"""
+        from services.text_search import search_documents_text
+        db, ids = text_search_db
+        
+        results = search_documents_text(db, "rov 鯨骨群集", top_k=10, fuzzy=False)
+        
+        assert [r["document_id"] for r in results] == [ids["深海調査メモ"]]
+        assert search_documents_text(db, "zymurgy 鯨骨群集", top_k=10, fuzzy=False) == []
\ No newline at end of file
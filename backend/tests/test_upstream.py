@@ -0,0 +1,168 @@
+import time
+import asyncio
+import pytest
+import services.upstream as upstream
+from services.upstream import (
+    call_upstream, deadline_scope, retry_after_seconds, reset_upstream_state,
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, UpstreamError
+)
+
+class HTTPError(Exception):
+    """SDKのHTTPエラー（status_code と レスポンスヘッダー）の代わり"""
+    
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    reset_upstream_state()
+    monkeypatch.setattr(upstream, "BACKOFF_BASE_SECONDS", 0.001)
+    yield
+    reset_upstream_state()
+
+
+class TestRetry:
+    """再試行のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self):
+        """5xxは再試行して成功すれば結果を返すことのテスト"""
+        calls = []
+        
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise HTTPError(503)
+            return "ok"
+        
+        assert await call_upstream("openai", "embed", flaky) == "ok"
+        assert len(calls) == 3
+    
+    @pytest.mark.asyncio
+    async def test_does_not_retry_client_errors(self):
+        """400などは再試行せずにそのまま送出することのテスト"""
+        calls = []
+        
+        def bad_request():
+            calls.append(1)
+            raise HTTPError(400)
+        
+        with pytest.raises(HTTPError):
+            await call_upstream("openai", "embed", bad_request)
+        assert len(calls) == 1
+    
+    @pytest.mark.asyncio
+    async def test_gives_up_with_upstream_error(self):
+        """最大試行回数を超えると UpstreamError（Retry-After付き）にすることのテスト"""
+        def throttled():
+            raise HTTPError(429, {"Retry-After": "0.01"})
+        
+        with pytest.raises(UpstreamError) as error:
+            await call_upstream("openai", "embed", throttled)
+        assert error.value.retry_after == pytest.approx(0.01)
+    
+    def test_retry_after_formats(self):
+        """Retry-After の秒数・ミリ秒の解析テスト"""
+        assert retry_after_seconds(HTTPError(429, {"retry-after": "3"})) == 3
+        assert retry_after_seconds(HTTPError(429, {"retry-after-ms": "250"})) == 0.25
+        assert retry_after_seconds(HTTPError(429)) is None
+
+
+class TestDeadline:
+    """期限のテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_deadline_bounds_the_call(self):
+        """期限を過ぎた呼び出しは待たずに DeadlineExceeded にすることのテスト"""
+        start = time.perf_counter()
+        with deadline_scope(0.05):
+            with pytest.raises(DeadlineExceeded):
+                await call_upstream("pinecone", "query", time.sleep, 0.5)
+        assert time.perf_counter() - start < 0.3
+    
+    @pytest.mark.asyncio
+    async def test_timeout_argument_and_nested_scope(self):
+        """残り時間を関数に渡し、内側の期限は外側より長くならないことのテスト"""
+        received = {}
+        
+        def create(timeout=None):
+            received["timeout"] = timeout
+            return "ok"
+        
+        with deadline_scope(1.0):
+            with deadline_scope(10.0):
+                await call_upstream("openai", "chat", create, timeout_arg="timeout")
+        assert 0 < received["timeout"] <= 1.0
+
+
+class TestCircuitBreaker:
+    """サーキットブレーカーのテスト"""
+    
+    def test_opens_and_recovers(self, monkeypatch):
+        """連続失敗で開き、一定時間後の試行が成功すると閉じることのテスト"""
+        now = [100.0]
+        monkeypatch.setattr(upstream.time, "monotonic", lambda: now[0])
+        breaker = CircuitBreaker("openai", failure_threshold=2, reset_seconds=10)
+        
+        breaker.record_failure(HTTPError(503))
+        breaker.before_call()
+        breaker.record_failure(HTTPError(503))
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        
+        now[0] += 10
+        breaker.before_call()
+        # 試行中は他の呼び出しを通さない
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == "closed"
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_probe_allows_next_call(self):
+        """試行中の呼び出しがキャンセルされても、次の呼び出しで試行し直せることのテスト"""
+        breaker = CircuitBreaker("openai", failure_threshold=1, reset_seconds=0.05)
+        upstream._breakers["openai"] = breaker
+        breaker.record_failure(HTTPError(503))
+        await asyncio.sleep(0.06)
+        
+        probe = asyncio.create_task(call_upstream("openai", "embed", time.sleep, 0.3))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        
+        assert await call_upstream("openai", "embed", lambda: "ok") == "ok"
+        assert breaker.state == "closed"
+    
+    def test_rate_limits_do_not_open(self):
+        """429ではブレーカーを開かないことのテスト"""
+        breaker = CircuitBreaker("openai", failure_threshold=1)
+        breaker.record_failure(HTTPError(429))
+        assert breaker.state == "closed"
+
+
+class TestHedging:
+    """ヘッジのテスト"""
+    
+    @pytest.mark.asyncio
+    async def test_slow_call_is_hedged(self):
+        """p95を超えて遅い呼び出しは2つ目のリクエストの結果を使うことのテスト"""
+        calls = []
+        
+        def query():
+            calls.append(1)
+            # 21回目（ヘッジ対象の最初の呼び出し）だけ遅い
+            time.sleep(1.0 if len(calls) == 21 else 0.001)
+            return len(calls)
+        
+        for _ in range(20):
+            await call_upstream("pinecone", "query", query, hedge=True)
+        
+        start = time.perf_counter()
+        result = await call_upstream("pinecone", "query", query, hedge=True)
+        assert time.perf_counter() - start < 0.5
+        assert result == 22
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""バックグラウンドジョブのワーカープロセス
+
+APIとは別プロセスで起動し、jobsテーブルから実行待ちのジョブを取得して実行する。
+プロセスを増やせば処理能力を独立してスケールできる。
+
+    python worker.py
+    JOB_CONCURRENCY="chunk=4,analyze=1" python worker.py
+"""
+import os
+import asyncio
+import signal
+import socket
+import threading
+import traceback
+import uuid
+from typing import Dict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import SessionLocal, engine
+from models import Base
+from services.jobs import (
+    JobContext, JobCancelled, parse_concurrency, claim_job, finish_job,
+    fail_job, mark_cancelled, heartbeat, requeue_stale_jobs, start_event_loop
+)
+from services.job_handlers import JOB_HANDLERS
+from services.notion_import import ensure_notion_columns
+from services.chunk_dedup import ensure_dedup_columns
+from services.clients import warmup
+
+# 実行待ちのジョブがないときの確認間隔（秒）
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+# ハートビートと停止ジョブ回収の間隔（秒）
+HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "15"))
+
+
+def run_job(job, loop: asyncio.AbstractEventLoop) -> None:
+    ctx = JobContext(SessionLocal, job.id, loop)
+    try:
+        result = JOB_HANDLERS[job.type](job.payload, ctx)
+    except JobCancelled:
+        with SessionLocal() as db:
+            mark_cancelled(db, job.id)
+        print(f"Job {job.id} ({job.type}) cancelled")
+        return
+    except Exception as e:
+        traceback.print_exc()
+        with SessionLocal() as db:
+            fail_job(db, job, str(e))
+        print(f"Job {job.id} ({job.type}) failed (attempt {job.attempts}/{job.max_attempts}): {e}")
+        return
+    
+    with SessionLocal() as db:
+        finish_job(db, job.id, result)
+    print(f"Job {job.id} ({job.type}) succeeded")
+
+
+def slot_loop(job_type: str, worker_id: str, stop: threading.Event, loop: asyncio.AbstractEventLoop) -> None:
+    """1スロット分のジョブを順に実行（スロット数が種類ごとの同時実行数になる）"""
+    
+    while not stop.is_set():
+        try:
+            with SessionLocal() as db:
+                job = claim_job(db, job_type, worker_id)
+        except Exception as e:
+            print(f"Failed to claim {job_type} job: {e}")
+            job = None
+        
+        if job is None:
+            stop.wait(POLL_INTERVAL)
+            continue
+        try:
+            run_job(job, loop)
+        except Exception as e:
+            # 結果の書き込みに失敗した場合はハートビート切れとして回収される
+            print(f"Job {job.id} ({job.type}) could not be finalized: {e}")
+
+
+def run_worker(concurrency: Dict[str, int]) -> None:
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    stop = threading.Event()
+    
+    def request_stop(signum, frame):
+        print("Stopping worker after running jobs finish...")
+        stop.set()
+    
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    
+    Base.metadata.create_all(bind=engine)
+    ensure_notion_columns(engine)
+    ensure_dedup_columns(engine)
+    print(f"Warmup finished: {warmup()}")
+    
+    # 非同期のジョブ（チャンク分割・Notionインポート）はすべてのスロットで1つのイベントループを共有する
+    loop = start_event_loop()
+    threads = [
+        threading.Thread(target=slot_loop, args=(job_type, worker_id, stop, loop), name=f"{job_type}-{i}", daemon=True)
+        for job_type, count in concurrency.items()
+        for i in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Worker {worker_id} started: {concurrency}")
+    
+    # 実行中ジョブのハートビートと、落ちたワーカーのジョブの回収
+    while not stop.is_set():
+        try:
+            with SessionLocal() as db:
+                heartbeat(db, worker_id)
+                requeued = requeue_stale_jobs(db)
+            if requeued:
+                print(f"Requeued {requeued} stale jobs")
+        except Exception as e:
+            print(f"Heartbeat failed: {e}")
+        stop.wait(HEARTBEAT_INTERVAL)
+    
+    for thread in threads:
+        thread.join()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == "__main__":
+    run_worker(parse_concurrency(os.getenv("JOB_CONCURRENCY")))
\ No newline at end of file
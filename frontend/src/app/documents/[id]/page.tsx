@@ -1,10 +1,11 @@
 'use client';
 
-import { useEffect, useState } from 'react';
+import { useCallback, useEffect, useState } from 'react';
 import { useSession } from 'next-auth/react';
 import { useRouter, useParams } from 'next/navigation';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
+import { Alert, AlertDescription, AlertTitle } from '@/components/ui/alert';
 
 // 環境変数からAPIのURLを取得（未設定ならlocalhost）
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8001';
@@ -30,6 +31,10 @@ export default function DocumentDetailPage() {
   const [isEditing, setIsEditing] = useState(isNew); // 新規作成なら最初から編集モード
   const [editTitle, setEditTitle] = useState('');
   const [editContent, setEditContent] = useState('');
+  // 取得時のETag（更新時に If-Match で送り、他の人の更新を上書きしないようにする）
+  const [etag, setEtag] = useState<string | null>(null);
+  // 編集中に他の人が更新した（412 Precondition Failed）
+  const [conflict, setConflict] = useState(false);
 
   useEffect(() => {
     if (status === 'unauthenticated') {
@@ -37,30 +42,32 @@ export default function DocumentDetailPage() {
     }
   }, [status, router]);
 
-  useEffect(() => {
-    const fetchDocument = async () => {
-      // 新規作成時はデータ取得をスキップ
-      if (isNew) return;
-
-      try {
-        const res = await fetch(`${API_URL}/documents/${params.id}`);
-        if (res.ok) {
-          const data = await res.json();
-          setDocument(data);
-          setEditTitle(data.title);
-          setEditContent(data.content);
-        }
-      } catch (error) {
-        console.error('Failed to fetch document:', error);
-      } finally {
-        setLoading(false);
+  const fetchDocument = useCallback(async () => {
+    // 新規作成時はデータ取得をスキップ
+    if (isNew) return;
+
+    try {
+      const res = await fetch(`${API_URL}/documents/${params.id}`);
+      if (res.ok) {
+        const data = await res.json();
+        setDocument(data);
+        setEditTitle(data.title);
+        setEditContent(data.content);
+        setEtag(res.headers.get('ETag'));
+        setConflict(false);
       }
-    };
+    } catch (error) {
+      console.error('Failed to fetch document:', error);
+    } finally {
+      setLoading(false);
+    }
+  }, [params.id, isNew]);
 
+  useEffect(() => {
     if (status === 'authenticated' && params.id) {
       fetchDocument();
     }
-  }, [status, params.id, isNew]);
+  }, [status, params.id, fetchDocument]);
 
   // 保存処理 (新規作成 POST / 更新 PUT)
   const handleSave = async () => {
@@ -68,15 +75,26 @@ export default function DocumentDetailPage() {
       const method = isNew ? 'POST' : 'PUT';
       const url = isNew ? `${API_URL}/documents` : `${API_URL}/documents/${params.id}`;
       
+      const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+      if (!isNew && etag) {
+        headers['If-Match'] = etag;
+      }
+
       const res = await fetch(url, {
         method: method,
-        headers: { 'Content-Type': 'application/json' },
+        headers,
         body: JSON.stringify({
           title: editTitle,
           content: editContent,
         }),
       });
 
+      if (res.status === 412) {
+        // 取得後に他の人が更新している（編集内容は残したまま知らせる）
+        setConflict(true);
+        return;
+      }
+
       if (res.ok) {
         // 保存成功したら一覧へ戻る
         router.push('/documents');
@@ -113,6 +131,19 @@ export default function DocumentDetailPage() {
           </Button>
         </div>
 
+        {conflict && (
+          <Alert variant="warning" className="mb-4">
+            <AlertTitle>他のユーザーがこのドキュメントを更新しました</AlertTitle>
+            <AlertDescription>
+              編集を始めた後にドキュメントが更新されたため、保存できませんでした。
+              編集内容を控えてから最新の内容を読み込み、もう一度編集してください。
+            </AlertDescription>
+            <Button variant="outline" className="mt-2" onClick={fetchDocument}>
+              最新の内容を読み込む（編集内容は破棄されます）
+            </Button>
+          </Alert>
+        )}
+
         <Card>
           <CardHeader>
             <CardTitle className="text-2xl mb-2">
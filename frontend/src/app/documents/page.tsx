@@ -21,6 +21,7 @@ export default function DocumentsPage() {
   const { data: session, status } = useSession();
   const router = useRouter();
   const [documents, setDocuments] = useState<Document[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -29,14 +30,18 @@ export default function DocumentsPage() {
     }
   }, [status, router]);
 
-  const fetchDocuments = async () => {
+  // 一覧は本文を切り詰めた summary ビューをページ単位で取得
+  const fetchDocuments = async (cursor?: string) => {
     try {
-      const res = await fetch(`${API_URL}/documents`);
+      const params = new URLSearchParams({ view: 'summary', limit: '50' });
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`${API_URL}/documents?${params}`);
       if (res.ok) {
         const data = await res.json();
         if (Array.isArray(data)) {
-          setDocuments(data);
+          setDocuments((prev) => (cursor ? [...prev, ...data] : data));
         }
+        setNextCursor(res.headers.get('X-Next-Cursor'));
       }
     } catch (error) {
       console.error('Failed to fetch documents:', error);
@@ -155,6 +160,13 @@ export default function DocumentsPage() {
                     </CardContent>
                 </Card>
                 ))}
+            {nextCursor && (
+              <div className="text-center">
+                <Button variant="outline" onClick={() => fetchDocuments(nextCursor)}>
+                  さらに読み込む
+                </Button>
+              </div>
+            )}
           </div>
         )}
 